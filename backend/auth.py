@@ -1,21 +1,33 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from functools import lru_cache
+from typing import Optional, Tuple
+import asyncio
 
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Query, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from pydantic import BaseModel
 import os
-from bson import ObjectId
 
-from models import UserProfile, Token, UserType
+from models import UserProfile, Token, hydrate
+from database import get_document
 
-# Setup password hashing context
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Password hashing defaults (see password_context and _hashing_pool)
+DEFAULT_BCRYPT_ROUNDS = 12
+DEFAULT_PASSWORD_HASH_WORKERS = min(4, os.cpu_count() or 1)
+DEFAULT_PASSWORD_HASH_QUEUE_SIZE = 64
+
+# Lifetime of the tokens that open event streams (see create_stream_token)
+DEFAULT_STREAM_TOKEN_EXPIRE_SECONDS = 300
 
 # Setup OAuth2 with Bearer token
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/token")
+# Same, for endpoints that also take a token some other way
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/token", auto_error=False)
+
+# Scope claim of stream tokens; access tokens have none
+STREAM_TOKEN_SCOPE = "stream"
 
 # JWT settings
 SECRET_KEY = os.environ.get("SECRET_KEY", "temporary_secret_key_change_in_production")
@@ -23,18 +35,105 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 1 week
 
 
-class TokenData(BaseModel):
-    user_id: str
-    email: str
-    user_type: UserType
+@lru_cache(maxsize=None)
+def password_context() -> CryptContext:
+    """
+    The bcrypt context, built on first use so BCRYPT_ROUNDS is read after
+    the environment is loaded. Hashes made at any other cost are flagged
+    for an update, which login applies (see verify_and_update_password).
+    """
+    rounds = int(os.environ.get("BCRYPT_ROUNDS", DEFAULT_BCRYPT_ROUNDS))
+    return CryptContext(
+        schemes=["bcrypt"],
+        deprecated="auto",
+        bcrypt__default_rounds=rounds,
+        bcrypt__min_rounds=rounds,
+        bcrypt__max_rounds=rounds
+    )
 
 
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return password_context().verify(plain_password, hashed_password)
 
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    return password_context().hash(password)
+
+
+# bcrypt is deliberately slow (tens to hundreds of milliseconds), so the async
+# endpoints hand it to a small dedicated thread pool instead of blocking the
+# event loop; bcrypt releases the GIL while it works. At most workers +
+# queue size calls are admitted at once; beyond that a login burst is turned
+# away with a 503 rather than queueing without bound.
+_hashing_executor: Optional[ThreadPoolExecutor] = None
+_hashing_slots: Optional[asyncio.Semaphore] = None
+
+
+def _hashing_pool() -> Tuple[ThreadPoolExecutor, asyncio.Semaphore]:
+    global _hashing_executor, _hashing_slots
+    if _hashing_executor is None:
+        workers = int(os.environ.get("PASSWORD_HASH_WORKERS", DEFAULT_PASSWORD_HASH_WORKERS))
+        queue_size = int(os.environ.get("PASSWORD_HASH_QUEUE_SIZE", DEFAULT_PASSWORD_HASH_QUEUE_SIZE))
+        _hashing_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        _hashing_slots = asyncio.Semaphore(workers + queue_size)
+    return _hashing_executor, _hashing_slots
+
+
+async def _run_hashing(function, *args):
+    """Run a password hashing call on the hashing pool"""
+    executor, slots = _hashing_pool()
+    
+    if slots.locked():
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many sign-in requests, please retry shortly",
+            headers={"Retry-After": "1"},
+        )
+    
+    async with slots:
+        return await asyncio.get_running_loop().run_in_executor(executor, function, *args)
+
+
+async def hash_password(password: str) -> str:
+    """
+    Hash a password on the hashing pool
+    """
+    return await _run_hashing(get_password_hash, password)
+
+
+async def verify_and_update_password(
+    plain_password: str, hashed_password: Optional[str]
+) -> Tuple[bool, Optional[str]]:
+    """
+    Check a password on the hashing pool. Also returns a new hash to store
+    when the stored one was made at a different cost (None otherwise).
+    hashed_password is None for an unknown user, which never verifies.
+    """
+    if not hashed_password:
+        # No such user: do the same bcrypt work anyway, so the response time
+        # doesn't tell which emails are registered
+        await _run_hashing(_verify_dummy_password, plain_password)
+        return False, None
+    return await _run_hashing(password_context().verify_and_update, plain_password, hashed_password)
+
+
+@lru_cache(maxsize=None)
+def _dummy_password_hash() -> str:
+    """A hash at the current cost that no password is checked against for real"""
+    return get_password_hash(os.urandom(16).hex())
+
+
+def _verify_dummy_password(plain_password: str) -> bool:
+    return password_context().verify(plain_password, _dummy_password_hash())
+
+
+def shutdown_password_hashing() -> None:
+    """Stop the hashing pool's threads"""
+    global _hashing_executor, _hashing_slots
+    if _hashing_executor is not None:
+        _hashing_executor.shutdown(wait=False)
+        _hashing_executor = None
+        _hashing_slots = None
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -50,9 +149,34 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db=None):
+def stream_token_expire_seconds() -> int:
+    return int(os.environ.get("STREAM_TOKEN_EXPIRE_SECONDS", DEFAULT_STREAM_TOKEN_EXPIRE_SECONDS))
+
+
+def create_stream_token(user_id: str) -> str:
+    """
+    Create a short-lived token that only opens event streams.
+    
+    Browsers' EventSource can't send an Authorization header, so stream
+    endpoints also take a token in the query string. URLs end up in logs and
+    browser history, so that token is scoped to streams (get_current_user
+    rejects it) and expires after STREAM_TOKEN_EXPIRE_SECONDS.
+    """
+    return create_access_token(
+        {"sub": user_id, "scope": STREAM_TOKEN_SCOPE},
+        timedelta(seconds=stream_token_expire_seconds())
+    )
+
+
+async def _resolve_principal(token: str, scope: Optional[str]) -> UserProfile:
     """
-    Get the current user from the JWT token
+    Resolve the user a token was issued to, if the token has the given scope.
+    
+    The token only identifies the user: the principal (role, onboarding
+    state...) comes from their profile, so authorization sees changes as soon
+    as they are saved. Profiles are read through the entity cache, which every
+    profile write invalidates (on all workers), so most requests resolve the
+    user without a MongoDB round trip.
     """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -63,45 +187,49 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db=None):
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: str = payload.get("sub")
-        email: str = payload.get("email")
-        user_type: str = payload.get("user_type")
         
-        if user_id is None or email is None:
+        if user_id is None or payload.get("scope") != scope:
             raise credentials_exception
-            
-        token_data = TokenData(
-            user_id=user_id,
-            email=email,
-            user_type=UserType(user_type)
-        )
     except JWTError:
         raise credentials_exception
-        
-    # Look up the user from the database if db is provided
-    if db:
-        try:
-            user_doc = await db.profiles.find_one({"_id": ObjectId(token_data.user_id)})
-            if user_doc:
-                return UserProfile(
-                    id=str(user_doc["_id"]),
-                    email=user_doc["email"],
-                    user_type=UserType(user_doc["user_type"]),
-                    display_name=user_doc.get("display_name", None),
-                    avatar_url=user_doc.get("avatar_url", None),
-                    completed_onboarding=user_doc.get("completed_onboarding", False),
-                    created_at=user_doc.get("created_at", datetime.utcnow()),
-                    updated_at=user_doc.get("updated_at", datetime.utcnow())
-                )
-        except:
-            pass
     
-    # If db lookup failed or wasn't attempted, construct user from token
-    user = UserProfile(
-        id=token_data.user_id,
-        email=token_data.email,
-        user_type=token_data.user_type,
-        created_at=datetime.utcnow(),
-        updated_at=datetime.utcnow()
-    )
+    # Look up the user's profile (a deleted user's token is no longer valid).
+    # It is read whole, since projected reads don't fill the entity cache
+    user_doc = await get_document("profiles", user_id)
+    
+    if not user_doc:
+        raise credentials_exception
     
-    return user
+    # The copy returned is our own, so the hash can be dropped from it
+    user_doc.pop("hashed_password", None)
+    
+    return hydrate(UserProfile, user_doc)
+
+
+async def get_current_user(token: str = Depends(oauth2_scheme)) -> UserProfile:
+    """
+    Get the current user from the JWT access token
+    """
+    return await _resolve_principal(token, scope=None)
+
+
+async def get_stream_user(
+    bearer: Optional[str] = Depends(optional_oauth2_scheme),
+    token: Optional[str] = Query(None, description="Stream token, for clients that can't set headers")
+) -> UserProfile:
+    """
+    Get the current user of an event stream, from either an access token in
+    the Authorization header (fetch-based clients) or a stream token in the
+    token query parameter (EventSource)
+    """
+    if bearer:
+        return await _resolve_principal(bearer, scope=None)
+    
+    if token:
+        return await _resolve_principal(token, scope=STREAM_TOKEN_SCOPE)
+    
+    raise HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Not authenticated",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
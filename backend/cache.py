@@ -0,0 +1,477 @@
+"""
+Caches for data read from MongoDB.
+
+The entity cache sits in front of database.get_document. It has two tiers:
+
+- an in-process LRU with a TTL, so hot documents (listings on nearly every
+  request, the profiles behind ownership checks) are served from memory;
+- an optional Redis tier shared by every worker, enabled by setting REDIS_URL.
+
+The query cache holds whole result pages of hot browse queries (e.g. the
+listing feed) in process, keyed by collection, the collection's current
+generation and the normalized query. Any write to the collection bumps its
+generation, which orphans every cached page at once; orphans age out of the
+LRU.
+
+database's write helpers call invalidate() after every write. That drops
+the document from the entity cache, deletes its Redis key, bumps the
+collection's generation and publishes both on a pub/sub channel so the other
+workers do the same. The TTLs bound how stale an entry can get if a message
+is ever missed (or when several workers run without Redis).
+
+A worker may read a document just before another worker writes it and try
+to cache that copy after the write's invalidation, before the message
+reaches it. So every Redis entry has a version key, incremented by each
+invalidation: a reader notes the version before reading from MongoDB and
+only stores its copy in Redis if the version is still the same.
+
+Settings (read by connect_cache):
+    ENTITY_CACHE_COLLECTIONS      comma separated collections to cache
+    ENTITY_CACHE_SIZE             local entries kept (0 disables the cache)
+    ENTITY_CACHE_TTL_SECONDS      local entry lifetime
+    ENTITY_CACHE_REDIS_TTL_SECONDS  Redis entry lifetime
+    QUERY_CACHE_SIZE              result pages kept (0 disables the cache)
+    QUERY_CACHE_TTL_SECONDS       result page lifetime
+    REDIS_URL                     e.g. redis://localhost:6379/0
+    CACHE_CHANNEL                 pub/sub channel for invalidations
+"""
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Optional, Set, Tuple
+from bson import json_util
+import asyncio
+import copy
+import logging
+import os
+import time
+
+try:
+    import redis.asyncio as aioredis
+    from redis.exceptions import RedisError, WatchError
+except ImportError:  # the Redis tier is optional
+    aioredis = None
+    RedisError = OSError
+    WatchError = OSError
+
+logger = logging.getLogger(__name__)
+
+# Sentinel for cache misses (None is a legitimate cached value elsewhere)
+MISSING = object()
+
+# Documents in Redis decode to naive UTC datetimes, as they do from MongoDB
+_REDIS_JSON_OPTIONS = json_util.RELAXED_JSON_OPTIONS.with_options(tz_aware=False)
+
+
+class TTLCache:
+    """
+    A bounded LRU mapping whose entries also expire after ttl seconds
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Any, tuple]" = OrderedDict()
+
+    def get(self, key: Any) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            return MISSING
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return MISSING
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Any, value: Any) -> None:
+        if self.maxsize <= 0:
+            return
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def delete(self, key: Any) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class CacheBus:
+    """
+    The Redis connection the caches share, and the pub/sub channel their
+    invalidations travel on. Messages are "<kind> <payload>"; each cache
+    registers a handler for its kind and a reset to run if messages may
+    have been missed.
+    """
+
+    def __init__(self, channel: str = "seedsmb:cache"):
+        self.channel = channel
+        self.redis = None
+        self._handlers: Dict[str, Callable[[str], None]] = {}
+        self._resets: list = []
+        self._listener: Optional[asyncio.Task] = None
+
+    def register(self, kind: str, handler: Callable[[str], None], reset: Callable[[], None]) -> None:
+        self._handlers[kind] = handler
+        self._resets.append(reset)
+
+    async def publish(self, kind: str, payload: str) -> None:
+        if self.redis is None:
+            return
+        try:
+            await self.redis.publish(self.channel, f"{kind} {payload}")
+        except RedisError as exc:
+            logger.warning(f"Cache invalidation publish failed: {exc}")
+
+    def _dispatch(self, message: str) -> None:
+        """Invalidation published by any worker (including this one)"""
+        kind, _, payload = message.partition(" ")
+        handler = self._handlers.get(kind)
+        if handler is not None:
+            handler(payload)
+
+    async def _listen(self) -> None:
+        """
+        Apply invalidations published by other workers. If the subscription
+        drops, messages may have been missed, so every cache is reset.
+        """
+        while True:
+            try:
+                async with self.redis.pubsub() as pubsub:
+                    await pubsub.subscribe(self.channel)
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            self._dispatch(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except RedisError as exc:
+                logger.warning(f"Cache invalidation subscription lost: {exc}")
+                for reset in self._resets:
+                    reset()
+                await asyncio.sleep(1)
+
+    async def start(self, redis_url: Optional[str] = None) -> None:
+        """
+        Connect to Redis, if configured, and subscribe to invalidations
+        """
+        if not redis_url:
+            return
+        if aioredis is None:
+            logger.warning("REDIS_URL is set but the redis package is not installed; "
+                           "using in-process caches only")
+            return
+        self.redis = aioredis.from_url(redis_url, decode_responses=True)
+        self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+        if self.redis is not None:
+            await self.redis.aclose()
+            self.redis = None
+        for reset in self._resets:
+            reset()
+
+
+class EntityCache:
+    """
+    Two-tier cache of whole documents keyed by collection and string ID.
+    Documents are copied on the way in and out, so callers may mutate them.
+    Secrets listed in excluded_fields (per collection) are never cached, so
+    cached copies come back without them.
+    """
+
+    def __init__(
+        self,
+        bus: CacheBus,
+        collections: Set[str],
+        maxsize: int = 10000,
+        ttl: float = 30,
+        redis_ttl: int = 300,
+        excluded_fields: Optional[Dict[str, Set[str]]] = None
+    ):
+        self.bus = bus
+        self.collections = collections
+        self.excluded_fields = excluded_fields or {}
+        self.local = TTLCache(maxsize, ttl)
+        self.redis_ttl = redis_ttl
+        # Bumped on every invalidation; see fill_token
+        self._invalidations = 0
+        bus.register("entity", self._on_message, self.reset)
+
+    def enabled_for(self, collection: str) -> bool:
+        return self.local.maxsize > 0 and collection in self.collections
+
+    def can_answer(self, collection: str, projection: Optional[Dict[str, Any]]) -> bool:
+        """Whether a cached copy holds every field projection asks for"""
+        excluded = self.excluded_fields.get(collection)
+        if not excluded or not projection:
+            return True
+        return not any(projection.get(field) for field in excluded)
+
+    @staticmethod
+    def _key(collection: str, document_id: Any) -> str:
+        return f"{collection}:{document_id}"
+
+    @staticmethod
+    def _version_key(key: str) -> str:
+        return f"{key}:version"
+
+    async def fill_token(self, collection: str, document_id: Any) -> Tuple[int, Optional[str]]:
+        """
+        Take before reading a document from MongoDB and pass to set(). If the
+        document was invalidated in between (by this worker, or in Redis by
+        any worker), the read may predate the write, so set() skips caching it.
+        """
+        redis = self.bus.redis
+        if redis is None:
+            return self._invalidations, None
+        key = self._key(collection, document_id)
+        invalidations = self._invalidations
+        try:
+            version = await redis.get(self._version_key(key))
+        except RedisError as exc:
+            logger.warning(f"Entity cache read from Redis failed: {exc}")
+            # Keep the copy out of Redis, where it can't be checked
+            return invalidations, None
+        return invalidations, version or "0"
+
+    async def get(self, collection: str, document_id: Any) -> Optional[Dict[str, Any]]:
+        """
+        Get a copy of a cached document, or None on a miss
+        """
+        key = self._key(collection, document_id)
+        document = self.local.get(key)
+        if document is not MISSING:
+            return copy.deepcopy(document)
+
+        redis = self.bus.redis
+        if redis is None:
+            return None
+        invalidations = self._invalidations
+        try:
+            payload = await redis.get(key)
+        except RedisError as exc:
+            logger.warning(f"Entity cache read from Redis failed: {exc}")
+            return None
+        if payload is None:
+            return None
+        document = json_util.loads(payload, json_options=_REDIS_JSON_OPTIONS)
+        if invalidations == self._invalidations:
+            self.local.set(key, document)
+        return copy.deepcopy(document)
+
+    async def set(
+        self,
+        collection: str,
+        document_id: Any,
+        document: Dict[str, Any],
+        token: Tuple[int, Optional[str]]
+    ) -> None:
+        """
+        Cache a document freshly read from MongoDB
+        """
+        invalidations, version = token
+        if invalidations != self._invalidations:
+            return
+        excluded = self.excluded_fields.get(collection, ())
+        document = {name: value for name, value in document.items() if name not in excluded}
+        key = self._key(collection, document_id)
+        self.local.set(key, copy.deepcopy(document))
+        redis = self.bus.redis
+        if redis is None or version is None:
+            return
+        payload = json_util.dumps(document, json_options=_REDIS_JSON_OPTIONS)
+        version_key = self._version_key(key)
+        try:
+            # Store only if no invalidation has bumped the version since the
+            # token was taken (the transaction fails if one lands meanwhile)
+            async with redis.pipeline(transaction=True) as pipe:
+                await pipe.watch(version_key)
+                if (await pipe.get(version_key) or "0") != version:
+                    return
+                pipe.multi()
+                pipe.set(key, payload, ex=self.redis_ttl)
+                await pipe.execute()
+        except WatchError:
+            pass
+        except RedisError as exc:
+            logger.warning(f"Entity cache write to Redis failed: {exc}")
+
+    async def invalidate(self, collection: str, document_ids: Iterable[Any]) -> None:
+        """
+        Drop documents from every tier and tell the other workers to drop them
+        """
+        if not self.enabled_for(collection):
+            return
+        keys = [self._key(collection, document_id) for document_id in document_ids]
+        if not keys:
+            return
+        for key in keys:
+            self._drop_local(key)
+        redis = self.bus.redis
+        if redis is not None:
+            try:
+                async with redis.pipeline(transaction=True) as pipe:
+                    for key in keys:
+                        # Outlives any read that started before it
+                        pipe.incr(self._version_key(key))
+                        pipe.expire(self._version_key(key), self.redis_ttl)
+                    pipe.delete(*keys)
+                    await pipe.execute()
+            except RedisError as exc:
+                logger.warning(f"Entity cache delete from Redis failed: {exc}")
+            await self.bus.publish("entity", " ".join(keys))
+
+    def _on_message(self, payload: str) -> None:
+        for key in payload.split():
+            self._drop_local(key)
+
+    def _drop_local(self, key: str) -> None:
+        self._invalidations += 1
+        self.local.delete(key)
+
+    def reset(self) -> None:
+        self._invalidations += 1
+        self.local.clear()
+
+
+class QueryCache:
+    """
+    In-process cache of query results, invalidated a whole collection at a
+    time by bumping the collection's generation.
+    """
+
+    def __init__(self, bus: CacheBus, maxsize: int = 1000, ttl: float = 30):
+        self.bus = bus
+        self.local = TTLCache(maxsize, ttl)
+        self._generations: Dict[str, int] = {}
+        bus.register("generation", self.bump_local, self.reset)
+
+    def key(self, collection: str, *parts: Any) -> Optional[str]:
+        """
+        Build the cache key for a query on collection from its parts (filter,
+        sort, page...), normalized so equal queries share a key. Take the key
+        before running the query: a write that lands meanwhile moves the
+        collection to a new generation, so the result is never served.
+        Returns None when the cache is disabled.
+        """
+        if self.local.maxsize <= 0:
+            return None
+        generation = self._generations.get(collection, 0)
+        return f"{collection}:{generation}:{json_util.dumps(parts, sort_keys=True)}"
+
+    def get(self, key: Optional[str]) -> Any:
+        """
+        Get a cached result, or MISSING
+        """
+        if key is None:
+            return MISSING
+        return self.local.get(key)
+
+    def set(self, key: Optional[str], value: Any) -> None:
+        if key is not None:
+            self.local.set(key, value)
+
+    async def bump(self, collection: str) -> None:
+        """
+        Invalidate every cached query on collection, in every worker
+        """
+        self.bump_local(collection)
+        await self.bus.publish("generation", collection)
+
+    def bump_local(self, collection: str) -> None:
+        """
+        Invalidate every cached query on collection, in this worker only
+        """
+        self._generations[collection] = self._generations.get(collection, 0) + 1
+
+    def reset(self) -> None:
+        self.local.clear()
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+# Module-level caches, configured from the environment by connect_cache()
+cache_bus = CacheBus()
+entity_cache = EntityCache(
+    cache_bus,
+    {"business_listings", "profiles", "offers", "deals"},
+    excluded_fields={"profiles": {"hashed_password"}}
+)
+query_cache = QueryCache(cache_bus)
+
+
+async def connect_cache():
+    """
+    Configure the caches from the environment and connect the Redis tier
+    """
+    collections = os.environ.get("ENTITY_CACHE_COLLECTIONS")
+    if collections is not None:
+        entity_cache.collections = {name.strip() for name in collections.split(",") if name.strip()}
+    entity_cache.local = TTLCache(
+        _env_int("ENTITY_CACHE_SIZE", entity_cache.local.maxsize),
+        _env_int("ENTITY_CACHE_TTL_SECONDS", int(entity_cache.local.ttl))
+    )
+    entity_cache.redis_ttl = _env_int("ENTITY_CACHE_REDIS_TTL_SECONDS", entity_cache.redis_ttl)
+    query_cache.local = TTLCache(
+        _env_int("QUERY_CACHE_SIZE", query_cache.local.maxsize),
+        _env_int("QUERY_CACHE_TTL_SECONDS", int(query_cache.local.ttl))
+    )
+    cache_bus.channel = os.environ.get("CACHE_CHANNEL", cache_bus.channel)
+    await cache_bus.start(os.environ.get("REDIS_URL"))
+
+
+async def close_cache():
+    """
+    Disconnect the Redis tier
+    """
+    await cache_bus.stop()
+
+
+async def invalidate(collection: str, *document_ids: Any) -> None:
+    """
+    Called after every write to collection: drops the written documents (when
+    known) from the entity cache and orphans the collection's cached queries
+    """
+    await entity_cache.invalidate(collection, [str(document_id) for document_id in document_ids])
+    await query_cache.bump(collection)
+
+
+def project_document(
+    document: Dict[str, Any], projection: Optional[Dict[str, Any]]
+) -> Optional[Dict[str, Any]]:
+    """
+    Apply a simple top-level find() projection to a cached document.
+    Returns None for projections this can't reproduce faithfully (dotted
+    paths, operators, mixed inclusion and exclusion).
+    """
+    if not projection:
+        return document
+    fields = {name: value for name, value in projection.items() if name != "_id"}
+    if any("." in name or isinstance(value, dict) for name, value in fields.items()):
+        return None
+    flags = {bool(value) for value in fields.values()}
+    if len(flags) > 1:
+        return None
+
+    if flags == {True}:
+        projected = {name: document[name] for name in fields if name in document}
+    else:
+        projected = {name: value for name, value in document.items() if name not in fields}
+    if projection.get("_id", 1):
+        if "_id" in document:
+            projected["_id"] = document["_id"]
+            projected["id"] = document["_id"]
+    else:
+        projected.pop("_id", None)
+        projected.pop("id", None)
+    return projected
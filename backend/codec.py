@@ -0,0 +1,93 @@
+"""
+Conversion between MongoDB documents and the shapes the API works with.
+
+Reads: the database handle is opened with CODEC_OPTIONS, so the BSON decoder
+itself turns every ObjectId into a string while it decodes the reply, at any
+nesting depth (embedded listings, timeline events, arrays). decode_document
+then only has to expose _id as id.
+
+Writes and filters: encode_ids converts string IDs back to ObjectId in any
+field named _id or ending in _id, including inside $or/$and/$nor clauses,
+comparison operators and embedded documents.
+"""
+from typing import Any, Dict, List, Optional
+
+from bson import ObjectId
+from bson.codec_options import CodecOptions, TypeDecoder, TypeRegistry
+
+
+class ObjectIdDecoder(TypeDecoder):
+    """Decode ObjectIds straight to their string form"""
+    bson_type = ObjectId
+
+    def transform_bson(self, value: ObjectId) -> str:
+        return str(value)
+
+
+CODEC_OPTIONS = CodecOptions(type_registry=TypeRegistry([ObjectIdDecoder()]))
+
+# Logical operators whose value is a list of sub-filters
+_LOGICAL_OPERATORS = ("$or", "$and", "$nor")
+
+# Operators on an *_id field whose operand is an ID or a list of IDs
+_ID_OPERATORS = ("$eq", "$ne", "$gt", "$gte", "$lt", "$lte", "$in", "$nin")
+
+
+def to_object_id(value: Any) -> Any:
+    """Convert a string ID to ObjectId, leaving anything else untouched"""
+    if isinstance(value, str) and ObjectId.is_valid(value):
+        return ObjectId(value)
+    return value
+
+
+def _encode_id_value(value: Any) -> Any:
+    """Convert the value of an *_id field: an ID, a list of IDs or an operator map"""
+    if isinstance(value, str):
+        return to_object_id(value)
+    if isinstance(value, list):
+        return [to_object_id(item) for item in value]
+    if isinstance(value, dict):
+        for operator, operand in value.items():
+            if operator in _ID_OPERATORS:
+                value[operator] = _encode_id_value(operand)
+        return value
+    return value
+
+
+def encode_ids(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Convert string IDs to ObjectId in a document, update or filter, in place.
+    Returns data so it can be used inline.
+    """
+    for key, value in data.items():
+        if key in _LOGICAL_OPERATORS and isinstance(value, list):
+            for clause in value:
+                if isinstance(clause, dict):
+                    encode_ids(clause)
+        elif key.endswith("_id"):
+            data[key] = _encode_id_value(value)
+        elif isinstance(value, dict):
+            encode_ids(value)
+        elif isinstance(value, list):
+            for item in value:
+                if isinstance(item, dict):
+                    encode_ids(item)
+    return data
+
+
+def decode_document(document: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Expose the (already string) _id of a decoded document as id.
+    Returns the document so it can be used inline.
+    """
+    if document is not None and "_id" in document:
+        document["id"] = document["_id"]
+    return document
+
+
+def decode_documents(documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """decode_document for every document in a list"""
+    for document in documents:
+        if "_id" in document:
+            document["id"] = document["_id"]
+    return documents
@@ -1,8 +1,25 @@
-from typing import Optional, List, Dict, Any, Union
+from typing import Optional, List, Dict, Any, AsyncIterator, Tuple, Union
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
-from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel, ReturnDocument
+from pymongo.errors import BulkWriteError, OperationFailure
+from pymongo.read_preferences import (
+    Nearest,
+    Primary,
+    PrimaryPreferred,
+    Secondary,
+    SecondaryPreferred,
+)
+from bson import ObjectId, json_util
+from bson.errors import BSONError
+from codec import CODEC_OPTIONS, decode_document, decode_documents, encode_ids, to_object_id
+from cache import entity_cache, invalidate as invalidate_cache, project_document
+import base64
+import binascii
+import logging
 import os
 
+logger = logging.getLogger(__name__)
+
 # Initialize MongoDB connection
 mongo_url = os.environ.get("MONGO_URL")
 db_name = os.environ.get("DB_NAME", "seedsmb")
@@ -10,6 +27,60 @@ db_name = os.environ.get("DB_NAME", "seedsmb")
 client: Optional[AsyncIOMotorClient] = None
 db: Optional[AsyncIOMotorDatabase] = None
 
+# Server-side time limit for interactive reads (MONGO_MAX_TIME_MS), so a slow
+# query can't hold a pooled connection indefinitely. None disables the limit.
+max_time_ms: Optional[int] = 15000
+
+# Read preference for the public browse endpoints (MONGO_BROWSE_READ_PREFERENCE),
+# e.g. "secondaryPreferred" to keep listing traffic off the primary
+browse_read_preference = Primary()
+
+_READ_PREFERENCES = {
+    "primary": Primary,
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+
+
+def _env_int(name: str, default: Optional[int] = None) -> Optional[int]:
+    """Read an integer setting from the environment; empty means unset"""
+    value = os.environ.get(name)
+    if value is None or value == "":
+        return default
+    return int(value)
+
+
+def _read_preference(mode: str, max_staleness: Optional[int] = None):
+    """Build a pymongo read preference from its mode name"""
+    if mode not in _READ_PREFERENCES:
+        raise ValueError(f"Unknown MongoDB read preference: {mode}")
+    if mode == "primary":
+        return Primary()
+    return _READ_PREFERENCES[mode](max_staleness=max_staleness if max_staleness else -1)
+
+
+def _client_options() -> Dict[str, Any]:
+    """
+    Connection pool, timeout, compression and read preference options for the
+    client, read from the environment. Unset options keep the driver defaults.
+    """
+    options = {
+        "maxPoolSize": _env_int("MONGO_MAX_POOL_SIZE"),
+        "minPoolSize": _env_int("MONGO_MIN_POOL_SIZE"),
+        "maxIdleTimeMS": _env_int("MONGO_MAX_IDLE_TIME_MS"),
+        "waitQueueTimeoutMS": _env_int("MONGO_WAIT_QUEUE_TIMEOUT_MS"),
+        "serverSelectionTimeoutMS": _env_int("MONGO_SERVER_SELECTION_TIMEOUT_MS"),
+        "connectTimeoutMS": _env_int("MONGO_CONNECT_TIMEOUT_MS"),
+        "socketTimeoutMS": _env_int("MONGO_SOCKET_TIMEOUT_MS"),
+        # Comma-separated list, e.g. "zstd,snappy,zlib"
+        "compressors": os.environ.get("MONGO_COMPRESSORS") or None,
+        "readPreference": os.environ.get("MONGO_READ_PREFERENCE") or None,
+        "appname": os.environ.get("MONGO_APP_NAME", "seedsmb-api"),
+    }
+    return {key: value for key, value in options.items() if value is not None}
+
 
 def get_database() -> AsyncIOMotorDatabase:
     """
@@ -22,10 +93,32 @@ async def connect_to_mongo():
     """
     Connect to MongoDB
     """
-    global client, db
+    global client, db, max_time_ms, browse_read_preference
     if client is None:
-        client = AsyncIOMotorClient(mongo_url)
-        db = client[db_name]
+        max_time_ms = _env_int("MONGO_MAX_TIME_MS", max_time_ms) or None
+        browse_read_preference = _read_preference(
+            os.environ.get("MONGO_BROWSE_READ_PREFERENCE", "primary"),
+            _env_int("MONGO_BROWSE_MAX_STALENESS_SECONDS")
+        )
+        
+        client = AsyncIOMotorClient(os.environ.get("MONGO_URL", mongo_url), **_client_options())
+        # Decode ObjectIds to strings while reading replies (see codec.py)
+        db = client.get_database(db_name, codec_options=CODEC_OPTIONS)
+
+
+def _collection(collection: str, browse: bool = False):
+    """
+    Get a collection handle. Browse reads use the browse read preference so
+    public listing traffic can be served by secondaries.
+    """
+    if browse:
+        return db.get_collection(collection, read_preference=browse_read_preference)
+    return db[collection]
+
+
+def _max_time_kwargs() -> Dict[str, Any]:
+    """maxTimeMS option for aggregate(), when a limit is configured"""
+    return {"maxTimeMS": max_time_ms} if max_time_ms else {}
 
 
 async def close_mongo_connection():
@@ -37,17 +130,181 @@ async def close_mongo_connection():
         client.close()
 
 
-# Helper to handle ObjectId conversion
-def convert_id(id_value: Union[str, ObjectId]) -> Union[str, ObjectId]:
-    """Convert string ID to ObjectId for MongoDB queries or vice versa"""
-    if isinstance(id_value, str):
-        try:
-            return ObjectId(id_value)
-        except:
-            return id_value
-    elif isinstance(id_value, ObjectId):
-        return str(id_value)
-    return id_value
+# Index registry: every index the router queries rely on, declared per collection.
+# Names are part of the declaration so drift can be detected on later startups.
+INDEXES: Dict[str, List[IndexModel]] = {
+    "profiles": [
+        # Login, registration and check-email lookups
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        # get_users_by_type, paged by created_at
+        IndexModel(
+            [("user_type", ASCENDING), ("created_at", ASCENDING), ("_id", ASCENDING)],
+            name="user_type_created_at_id"
+        ),
+    ],
+    "business_listings": [
+        # get_listings: status filter, newest first
+        IndexModel(
+            [("status", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+            name="status_created_at_id"
+        ),
+        # get_featured_listings: status filter, furthest funded first
+        IndexModel(
+            [("status", ASCENDING), ("funding_progress", DESCENDING), ("_id", DESCENDING)],
+            name="status_funding_progress_id"
+        ),
+        # get_closing_soon_listings: status filter, soonest funding deadline first
+        IndexModel(
+            [("status", ASCENDING), ("funding_end_date", ASCENDING), ("_id", ASCENDING)],
+            name="status_funding_end_date_id"
+        ),
+        # get_listings search: status equality plus full-text match, title weighted highest
+        IndexModel(
+            [("status", ASCENDING), ("title", TEXT), ("industry", TEXT), ("description", TEXT)],
+            weights={"title": 10, "industry": 5, "description": 1},
+            name="status_listing_text"
+        ),
+        # get_seller_listings and get_seller_offers
+        IndexModel(
+            [("seller_id", ASCENDING), ("created_at", ASCENDING), ("_id", ASCENDING)],
+            name="seller_id_created_at_id"
+        ),
+    ],
+    "offers": [
+        # get_user_offers
+        IndexModel(
+            [("buyer_id", ASCENDING), ("created_at", ASCENDING), ("_id", ASCENDING)],
+            name="buyer_id_created_at_id"
+        ),
+        # get_seller_offers ($in over the seller's listings)
+        IndexModel(
+            [("business_id", ASCENDING), ("created_at", ASCENDING), ("_id", ASCENDING)],
+            name="business_id_created_at_id"
+        ),
+    ],
+    "investments": [
+        # get_user_investments
+        IndexModel(
+            [("investor_id", ASCENDING), ("created_at", ASCENDING), ("_id", ASCENDING)],
+            name="investor_id_created_at_id"
+        ),
+        # get_business_investments
+        IndexModel(
+            [("business_id", ASCENDING), ("created_at", ASCENDING), ("_id", ASCENDING)],
+            name="business_id_created_at_id"
+        ),
+    ],
+    "deals": [
+        # get_user_deals: one index per $or branch
+        IndexModel(
+            [("buyer_id", ASCENDING), ("created_at", ASCENDING), ("_id", ASCENDING)],
+            name="buyer_id_created_at_id"
+        ),
+        IndexModel(
+            [("seller_id", ASCENDING), ("created_at", ASCENDING), ("_id", ASCENDING)],
+            name="seller_id_created_at_id"
+        ),
+    ],
+    "timeline_events": [
+        # Deal timelines, read in chronological order
+        IndexModel([("deal_id", ASCENDING), ("timestamp", ASCENDING)], name="deal_id_timestamp"),
+    ],
+    "timeline_buckets": [
+        # Deal timelines in bucket storage: appends find the deal's open bucket
+        # and reads fetch all of its buckets in order
+        IndexModel([("deal_id", ASCENDING), ("_id", ASCENDING)], name="deal_id_id"),
+    ],
+    "documents": [
+        # get_deal_documents
+        IndexModel(
+            [("deal_id", ASCENDING), ("created_at", ASCENDING), ("_id", ASCENDING)],
+            name="deal_id_created_at_id"
+        ),
+    ],
+}
+
+
+def _index_matches(declared: Dict[str, Any], existing: Dict[str, Any]) -> bool:
+    """Check whether an existing index has the key pattern and options we declared"""
+    declared_key = list(declared["key"].items())
+    existing_key = [
+        (field, int(direction) if isinstance(direction, float) else direction)
+        for field, direction in existing["key"]
+    ]
+    
+    # The server stores the text fields of a text index as _fts/_ftsx keys
+    # plus a weights map, so compare it in that form
+    text_fields = [field for field, direction in declared_key if direction == TEXT]
+    if text_fields:
+        first_text = declared_key.index((text_fields[0], TEXT))
+        declared_key = (
+            [key for key in declared_key[:first_text]]
+            + [("_fts", TEXT), ("_ftsx", 1)]
+            + [key for key in declared_key[first_text:] if key[1] != TEXT]
+        )
+        declared_weights = {
+            field: declared.get("weights", {}).get(field, 1) for field in text_fields
+        }
+        existing_weights = {
+            field: int(weight) for field, weight in existing.get("weights", {}).items()
+        }
+        if declared_weights != existing_weights:
+            return False
+    
+    return (
+        declared_key == existing_key
+        and bool(declared.get("unique", False)) == bool(existing.get("unique", False))
+    )
+
+
+async def ensure_indexes() -> Dict[str, Dict[str, List[str]]]:
+    """
+    Build every index in the registry that is missing and report drift.
+
+    Safe to run on every startup: existing indexes are left alone. Indexes whose
+    definition no longer matches the registry, and indexes that are not declared
+    at all, are reported but never dropped automatically.
+    """
+    report: Dict[str, Dict[str, List[str]]] = {}
+
+    for collection, indexes in INDEXES.items():
+        existing = await db[collection].index_information()
+        created, drifted, failed = [], [], []
+
+        for index in indexes:
+            spec = index.document
+            name = spec["name"]
+
+            if name not in existing:
+                # Build one at a time so a single failure (e.g. duplicate emails
+                # blocking the unique index) doesn't block the others
+                try:
+                    await db[collection].create_indexes([index])
+                    created.append(name)
+                except OperationFailure as exc:
+                    logger.error(f"Failed to build index {collection}.{name}: {exc}")
+                    failed.append(name)
+            elif not _index_matches(spec, existing[name]):
+                drifted.append(name)
+
+        declared = {index.document["name"] for index in indexes}
+        unmanaged = [name for name in existing if name != "_id_" and name not in declared]
+
+        if created:
+            logger.info(f"Created indexes on {collection}: {', '.join(created)}")
+        for name in drifted:
+            logger.warning(f"Index {collection}.{name} differs from its declaration in INDEXES")
+        for name in unmanaged:
+            logger.warning(f"Index {collection}.{name} is not declared in INDEXES")
+
+        report[collection] = {
+            "created": created,
+            "drifted": drifted,
+            "unmanaged": unmanaged,
+            "failed": failed,
+        }
+
+    return report
 
 
 # MongoDB Collection helpers
@@ -56,36 +313,122 @@ async def create_document(collection: str, document: Dict[str, Any]) -> str:
     Create a document in MongoDB and return its ID
     """
     # Convert string IDs to ObjectId for related fields
-    for key, value in document.items():
-        if key.endswith('_id') and isinstance(value, str) and value:
-            try:
-                document[key] = ObjectId(value)
-            except:
-                pass
+    encode_ids(document)
     
     result = await db[collection].insert_one(document)
+    await invalidate_cache(collection)
     return str(result.inserted_id)
 
 
-async def get_document(collection: str, document_id: str) -> Optional[Dict[str, Any]]:
+async def create_documents_many(
+    collection: str, documents: List[Dict[str, Any]], ordered: bool = False
+) -> Tuple[Dict[int, str], Dict[int, str]]:
     """
-    Get a document by ID
+    Insert many documents in one batch.
+    
+    With ordered=False the server keeps going past failed documents, so the
+    result is a pair of maps keyed by position in documents: the IDs that were
+    inserted and the error message for each document that wasn't.
     """
+    if not documents:
+        return {}, {}
+    
+    # Convert string IDs to ObjectId for related fields
+    for document in documents:
+        encode_ids(document)
+    
+    errors: Dict[int, str] = {}
     try:
-        obj_id = ObjectId(document_id)
-    except:
-        obj_id = document_id
-        
-    document = await db[collection].find_one({"_id": obj_id})
-    if document:
-        # Convert all ObjectIds to strings for JSON serialization
-        document["id"] = str(document["_id"])
-        for key, value in document.items():
-            if isinstance(value, ObjectId):
-                document[key] = str(value)
+        await db[collection].insert_many(documents, ordered=ordered)
+    except BulkWriteError as exc:
+        for error in exc.details.get("writeErrors", []):
+            errors[error["index"]] = error.get("errmsg", "Insert failed")
+        # An ordered batch stops at the first error; report the rest as skipped
+        if ordered and errors:
+            first_failure = min(errors)
+            for index in range(first_failure + 1, len(documents)):
+                errors[index] = "Not inserted: an earlier document in the batch failed"
+    await invalidate_cache(collection)
+    
+    # insert_many assigns each document its _id before sending the batch
+    inserted = {
+        index: str(document["_id"])
+        for index, document in enumerate(documents)
+        if index not in errors
+    }
+    return inserted, errors
+
+
+async def get_document(
+    collection: str,
+    document_id: str,
+    projection: Optional[Dict[str, Any]] = None,
+    browse: bool = False,
+    use_cache: bool = True
+) -> Optional[Dict[str, Any]]:
+    """
+    Get a document by ID, optionally limited to the fields in projection.
+    Set browse for public read traffic that may be served by a secondary.
+    
+    Reads of cached collections go through the entity cache (see cache.py),
+    whose copies leave out secrets such as profiles' hashed_password (read it
+    with a projection naming it, or use_cache=False). Projected reads are
+    answered from a cached copy when there is one but never fill the cache,
+    and neither do browse reads that may be served by a secondary: one
+    lagging behind a write could put the copy from before it back in the
+    cache just after the write invalidated it. Pass use_cache=False when the
+    value read feeds a write, so it comes straight from the primary.
+    """
+    document_id = str(document_id)
+    cacheable = use_cache and entity_cache.enabled_for(collection)
+    if cacheable and entity_cache.can_answer(collection, projection):
+        cached = await entity_cache.get(collection, document_id)
+        if cached is not None:
+            projected = project_document(cached, projection)
+            if projected is not None:
+                return projected
+    
+    token = await entity_cache.fill_token(collection, document_id) if cacheable else None
+    document = await _collection(collection, browse).find_one(
+        {"_id": to_object_id(document_id)}, projection, max_time_ms=max_time_ms
+    )
+    decode_document(document)
+    
+    from_primary = not browse or browse_read_preference == Primary()
+    if cacheable and projection is None and from_primary and document is not None:
+        await entity_cache.set(collection, document_id, document, token)
     return document
 
 
+async def get_documents_many(
+    collection: str, document_ids: List[Union[str, ObjectId]]
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Get several documents by ID in a single query, keyed by string ID.
+    IDs that don't exist are simply absent from the result.
+    """
+    obj_ids = []
+    seen = set()
+    for document_id in document_ids:
+        if not document_id:
+            continue
+        obj_id = to_object_id(document_id)
+        if obj_id not in seen:
+            seen.add(obj_id)
+            obj_ids.append(obj_id)
+
+    if not obj_ids:
+        return {}
+
+    documents = {}
+    cursor = db[collection].find({"_id": {"$in": obj_ids}}, max_time_ms=max_time_ms)
+    async for document in cursor:
+        decode_document(document)
+        documents[document["id"]] = document
+
+    return documents
+
+
 async def update_document(
     collection: str, document_id: str, update_data: Dict[str, Any]
 ) -> bool:
@@ -93,34 +436,106 @@ async def update_document(
     Update a document by ID
     """
     # Convert string IDs to ObjectId for related fields
-    for key, value in update_data.items():
-        if key.endswith('_id') and isinstance(value, str) and value:
-            try:
-                update_data[key] = ObjectId(value)
-            except:
-                pass
-    
-    try:
-        obj_id = ObjectId(document_id)
-    except:
-        obj_id = document_id
+    encode_ids(update_data)
     
     result = await db[collection].update_one(
-        {"_id": obj_id}, {"$set": update_data}
+        {"_id": to_object_id(document_id)}, {"$set": update_data}
+    )
+    await invalidate_cache(collection, document_id)
+    # An update that changes nothing still found the document
+    return result.matched_count > 0
+
+
+async def update_document_returning(
+    collection: str,
+    document_id: str,
+    update_data: Dict[str, Any],
+    precondition: Optional[Dict[str, Any]] = None,
+    projection: Optional[Dict[str, Any]] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    Update a document by ID and return it as it is after the update, in one
+    round trip.
+    
+    precondition holds conditions the document must also meet for the update
+    to apply (e.g. {"status": "draft"}); None is returned when it doesn't, or
+    when there is no such document.
+    """
+    filter_query = {"_id": document_id, **(precondition or {})}
+    
+    # $set needs at least one field; an empty update just reads the document
+    if not update_data:
+        document = await db[collection].find_one(
+            encode_ids(filter_query), projection=projection
+        )
+        return decode_document(document)
+    
+    # Convert string IDs to ObjectId for related fields
+    encode_ids(update_data)
+    
+    return await find_and_update_document(
+        collection, filter_query, {"$set": update_data}, projection=projection
     )
-    return result.modified_count > 0
+
+
+async def update_documents_many(
+    collection: str,
+    filter_query: Dict[str, Any],
+    update_data: Dict[str, Any],
+    document_ids: Optional[List[str]] = None
+) -> int:
+    """
+    Set update_data on every document matching filter_query and return how
+    many were modified. Cached copies of the matched documents are dropped,
+    so for cached collections their IDs are read first, unless the caller
+    already knows them (document_ids).
+    """
+    filter_query = encode_ids(dict(filter_query))
+    encode_ids(update_data)
+    
+    cached_ids = document_ids or []
+    if document_ids is None and entity_cache.enabled_for(collection):
+        cached_ids = [
+            document["_id"]
+            async for document in db[collection].find(filter_query, {"_id": 1})
+        ]
+    
+    result = await db[collection].update_many(filter_query, {"$set": update_data})
+    await invalidate_cache(collection, *cached_ids)
+    return result.modified_count
+
+
+async def find_and_update_document(
+    collection: str,
+    filter_query: Dict[str, Any],
+    update: Union[Dict[str, Any], List[Dict[str, Any]]],
+    projection: Optional[Dict[str, Any]] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    Atomically update the document matching filter_query and return it as it
+    is after the update, or None if nothing matched.
+    
+    update is passed through as is: update operators ($inc, $set...) or an
+    aggregation pipeline, so conditions in filter_query and the change are
+    applied in one server-side step.
+    """
+    document = await db[collection].find_one_and_update(
+        encode_ids(dict(filter_query)),
+        update,
+        projection=projection,
+        return_document=ReturnDocument.AFTER
+    )
+    if document is not None:
+        await invalidate_cache(collection, document["_id"])
+    return decode_document(document)
 
 
 async def delete_document(collection: str, document_id: str) -> bool:
     """
     Delete a document by ID
     """
-    try:
-        obj_id = ObjectId(document_id)
-    except:
-        obj_id = document_id
-        
-    result = await db[collection].delete_one({"_id": obj_id})
+    result = await db[collection].delete_one({"_id": to_object_id(document_id)})
+    await invalidate_cache(collection, document_id)
     return result.deleted_count > 0
 
 
@@ -128,44 +543,463 @@ async def list_documents(
     collection: str, 
     filter_query: Dict[str, Any] = None, 
     skip: int = 0, 
-    limit: int = 100,
-    sort_by: Dict[str, int] = None
+    limit: Optional[int] = 100,
+    sort_by: Dict[str, int] = None,
+    projection: Optional[Dict[str, Any]] = None,
+    browse: bool = False
 ) -> List[Dict[str, Any]]:
     """
-    List documents with optional filtering, pagination, and sorting
+    List documents with optional filtering, pagination, sorting and projection.
+    A limit of None returns every matching document. Set browse for public read
+    traffic that may be served by a secondary.
     """
     # Process filter_query to convert string IDs to ObjectId
     if filter_query:
-        for key, value in filter_query.items():
-            if key.endswith('_id') and isinstance(value, str) and value:
-                try:
-                    filter_query[key] = ObjectId(value)
-                except:
-                    pass
-            # Handle $in operator with list of IDs
-            elif isinstance(value, dict) and '$in' in value and key.endswith('_id'):
-                id_list = value['$in']
-                if isinstance(id_list, list):
-                    try:
-                        filter_query[key]['$in'] = [ObjectId(id) if isinstance(id, str) else id for id in id_list]
-                    except:
-                        pass
-    
-    cursor = db[collection].find(filter_query or {})
+        encode_ids(filter_query)
+    
+    cursor = _collection(collection, browse).find(
+        filter_query or {}, projection, max_time_ms=max_time_ms
+    )
     
     if sort_by:
         cursor = cursor.sort(list(sort_by.items()))
     
-    cursor = cursor.skip(skip).limit(limit)
+    cursor = cursor.skip(skip)
+    if limit:
+        cursor = cursor.limit(limit)
     
     documents = await cursor.to_list(length=limit)
     
-    # Convert _id to string id for each document
+    return decode_documents(documents)
+
+
+# Keyset pagination
+#
+# A page is continued from the sort key values of its last document plus its
+# _id as a tiebreaker, so every page is an index range scan no matter how deep
+# the client has paged. The values are packed into an opaque token that the
+# routers hand back in the NEXT_CURSOR_HEADER response header.
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+class InvalidCursorError(ValueError):
+    """Raised when a pagination cursor can't be decoded for the requested sort"""
+
+
+def _sort_spec(sort_by: Optional[Dict[str, int]]) -> List[Tuple[str, int]]:
+    """Sort keys for a keyset page, with _id appended as the tiebreaker"""
+    spec = [(key, direction) for key, direction in (sort_by or {}).items() if key != "_id"]
+    tiebreak = (sort_by or {}).get("_id", spec[-1][1] if spec else ASCENDING)
+    return spec + [("_id", tiebreak)]
+
+
+def _pack_cursor(values: List[Any]) -> str:
+    """Pack cursor values into an opaque URL-safe token"""
+    payload = json_util.dumps(values).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+
+def encode_cursor(document: Dict[str, Any], sort_spec: List[Tuple[str, int]]) -> str:
+    """Encode the sort key values of a document into an opaque cursor"""
+    # IDs come back from the decoder as strings but compare as ObjectIds
+    values = [
+        to_object_id(document.get(key)) if key.endswith("_id") else document.get(key)
+        for key, _ in sort_spec
+    ]
+    return _pack_cursor(values)
+
+
+def decode_cursor(cursor: str, sort_spec: List[Tuple[str, int]]) -> List[Any]:
+    """Decode a cursor produced by encode_cursor for the same sort"""
+    try:
+        payload = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json_util.loads(payload)
+    except (binascii.Error, ValueError, TypeError, BSONError):
+        raise InvalidCursorError("Invalid pagination cursor")
+    
+    if not isinstance(values, list) or len(values) != len(sort_spec):
+        raise InvalidCursorError("Invalid pagination cursor")
+    
+    return values
+
+
+def _keyset_filter(sort_spec: List[Tuple[str, int]], values: List[Any]) -> Dict[str, Any]:
+    """Filter matching the documents that sort strictly after the given key values"""
+    clauses = []
+    for position, (key, direction) in enumerate(sort_spec):
+        clause = {prev_key: values[i] for i, (prev_key, _) in enumerate(sort_spec[:position])}
+        clause[key] = {"$gt" if direction == ASCENDING else "$lt": values[position]}
+        clauses.append(clause)
+    return {"$or": clauses}
+
+
+def _apply_cursor(
+    filter_query: Dict[str, Any],
+    sort_spec: List[Tuple[str, int]],
+    cursor: Optional[str]
+) -> Dict[str, Any]:
+    """Combine a filter with the keyset condition for the given cursor"""
+    if not cursor:
+        return filter_query
+    keyset = _keyset_filter(sort_spec, decode_cursor(cursor, sort_spec))
+    return {"$and": [filter_query, keyset]} if filter_query else keyset
+
+
+async def list_documents_page(
+    collection: str,
+    filter_query: Dict[str, Any] = None,
+    limit: int = 100,
+    sort_by: Dict[str, int] = None,
+    projection: Optional[Dict[str, Any]] = None,
+    cursor: Optional[str] = None,
+    skip: int = 0,
+    browse: bool = False
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    List one keyset page of documents.
+    
+    Returns the documents and the cursor for the next page, or None when this
+    is the last page. Raises InvalidCursorError for a malformed cursor. Set
+    browse for public read traffic that may be served by a secondary.
+    """
+    sort_spec = _sort_spec(sort_by)
+    
+    if filter_query:
+        encode_ids(filter_query)
+    query = _apply_cursor(filter_query or {}, sort_spec, cursor)
+    
+    # Fetch one extra document to learn whether another page exists
+    documents = await (
+        _collection(collection, browse).find(query, projection, max_time_ms=max_time_ms)
+        .sort(sort_spec)
+        .skip(skip)
+        .limit(limit + 1)
+        .to_list(length=limit + 1)
+    )
+    
+    next_cursor = None
+    if len(documents) > limit:
+        documents = documents[:limit]
+        next_cursor = encode_cursor(documents[-1], sort_spec)
+    
+    return decode_documents(documents), next_cursor
+
+
+# Relevance scores can't be range-scanned like sort keys, so search result
+# pages are continued from an offset, packed into the same kind of cursor
+_SEARCH_CURSOR_SPEC = [("offset", ASCENDING)]
+
+
+def _decode_offset_cursor(cursor: Optional[str], skip: int = 0) -> int:
+    """The result offset a search cursor continues from (skip without a cursor)"""
+    if not cursor:
+        return skip
+    (offset,) = decode_cursor(cursor, _SEARCH_CURSOR_SPEC)
+    if not isinstance(offset, int) or offset < 0:
+        raise InvalidCursorError("Invalid pagination cursor")
+    return offset
+
+
+async def search_documents_page(
+    collection: str,
+    text: str,
+    filter_query: Dict[str, Any] = None,
+    limit: int = 100,
+    projection: Optional[Dict[str, Any]] = None,
+    cursor: Optional[str] = None,
+    skip: int = 0,
+    browse: bool = False
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Full-text search over the collection's text index, most relevant first.
+    
+    filter_query narrows the matches as usual (for a compound text index it
+    must include equality on the index's leading fields). Returns the page
+    and the cursor for the next one, or None on the last page.
+    """
+    offset = _decode_offset_cursor(cursor, skip)
+    
+    query = encode_ids(dict(filter_query or {}))
+    query["$text"] = {"$search": text}
+    
+    # Project the score so servers before 4.4 can sort on it
+    score = {"$meta": "textScore"}
+    search_projection = dict(projection or {})
+    search_projection["score"] = score
+    
+    find_cursor = (
+        _collection(collection, browse)
+        .find(query, search_projection, max_time_ms=max_time_ms)
+        .sort([("score", score), ("_id", DESCENDING)])
+        .skip(offset)
+        .limit(limit + 1)
+    )
+    documents = await find_cursor.to_list(length=limit + 1)
+    
+    next_cursor = None
+    if len(documents) > limit:
+        documents = documents[:limit]
+        next_cursor = _pack_cursor([offset + limit])
+    
     for document in documents:
-        document["id"] = str(document["_id"])
-        # Convert all ObjectIds to strings for JSON serialization
-        for key, value in document.items():
-            if isinstance(value, ObjectId):
-                document[key] = str(value)
+        document.pop("score", None)
+    return decode_documents(documents), next_cursor
+
+
+async def list_ranked_documents_page(
+    collection: str,
+    ranked_ids: List[str],
+    filter_query: Dict[str, Any] = None,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    skip: int = 0,
+    browse: bool = False
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Page through documents ranked elsewhere (e.g. by the search engine),
+    keeping only those that match filter_query, in ranked_ids order.
     
-    return documents
+    IDs are looked up a chunk at a time until the page is full, so only
+    documents near the page are fetched. The cursor carries the rank the
+    next page starts from.
+    """
+    offset = _decode_offset_cursor(cursor, skip)
+    filter_query = encode_ids(dict(filter_query or {}))
+    chunk_size = max(2 * limit, 50)
+    
+    page: List[Tuple[int, Dict[str, Any]]] = []
+    position = offset
+    while position < len(ranked_ids) and len(page) <= limit:
+        chunk = ranked_ids[position:position + chunk_size]
+        query = dict(filter_query)
+        query["_id"] = {"$in": [to_object_id(document_id) for document_id in chunk]}
+        found = {
+            document["_id"]: document
+            async for document in _collection(collection, browse).find(query, max_time_ms=max_time_ms)
+        }
+        for rank, document_id in enumerate(chunk, start=position):
+            if document_id in found:
+                page.append((rank, found[document_id]))
+                if len(page) > limit:
+                    break
+        position += len(chunk)
+    
+    next_cursor = None
+    if len(page) > limit:
+        next_cursor = _pack_cursor([page[limit][0]])
+        page = page[:limit]
+    
+    return decode_documents([document for _, document in page]), next_cursor
+
+
+async def facet_counts(
+    collection: str,
+    filter_query: Dict[str, Any],
+    facets: Dict[str, List[Dict[str, Any]]],
+    browse: bool = False
+) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Run several aggregation sub-pipelines over the documents matching
+    filter_query in one $facet round trip. Returns each facet's output by name.
+    """
+    pipeline = [
+        {"$match": encode_ids(dict(filter_query or {}))},
+        {"$facet": facets},
+    ]
+    cursor = _collection(collection, browse).aggregate(pipeline, **_max_time_kwargs())
+    results = await cursor.to_list(length=1)
+    return results[0] if results else {name: [] for name in facets}
+
+
+async def stream_documents(
+    collection: str,
+    filter_query: Dict[str, Any] = None,
+    sort_by: Dict[str, int] = None,
+    projection: Optional[Dict[str, Any]] = None,
+    batch_size: int = 500
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Iterate over every matching document without materializing the result.
+    
+    Documents are pulled from the server batch_size at a time, so memory stays
+    flat however many documents match. Exports are expected to run long, so
+    the interactive max_time_ms limit doesn't apply here.
+    """
+    if filter_query:
+        encode_ids(filter_query)
+    
+    cursor = db[collection].find(filter_query or {}, projection).batch_size(batch_size)
+    
+    if sort_by:
+        cursor = cursor.sort(list(sort_by.items()))
+    
+    async for document in cursor:
+        yield decode_document(document)
+
+
+# Timeline storage modes (TIMELINE_STORAGE): one timeline_events document
+# per event, or each deal's events pushed into timeline_buckets documents of
+# at most TIMELINE_BUCKET_SIZE events
+TIMELINE_STORAGE_COLLECTION = "collection"
+TIMELINE_STORAGE_BUCKETS = "buckets"
+
+DEFAULT_TIMELINE_BUCKET_SIZE = 100
+
+
+def timeline_storage() -> str:
+    """The configured timeline storage mode"""
+    return os.environ.get("TIMELINE_STORAGE", TIMELINE_STORAGE_COLLECTION)
+
+
+def timeline_bucket_size() -> int:
+    """Most events kept in one timeline bucket"""
+    return int(os.environ.get("TIMELINE_BUCKET_SIZE", DEFAULT_TIMELINE_BUCKET_SIZE))
+
+
+async def append_timeline_event(event: Dict[str, Any]) -> str:
+    """
+    Store a timeline event (a TimelineEvent dump, optionally with its _id
+    already assigned) and return its ID.
+    
+    In bucket storage the event is pushed onto the deal's open bucket in one
+    upsert; once every bucket is full the upsert starts a new one.
+    """
+    if timeline_storage() != TIMELINE_STORAGE_BUCKETS:
+        return await create_document("timeline_events", event)
+    
+    event = encode_ids(dict(event))
+    event.setdefault("_id", ObjectId())
+    # The embedded event's _id is its ID
+    event.pop("id", None)
+    
+    await db.timeline_buckets.update_one(
+        {"deal_id": event["deal_id"], "count": {"$lt": timeline_bucket_size()}},
+        {"$push": {"events": event}, "$inc": {"count": 1}},
+        upsert=True
+    )
+    return str(event["_id"])
+
+
+async def delete_timeline_event(deal_id: str, event_id: str) -> None:
+    """
+    Remove a stored timeline event (to undo append_timeline_event)
+    """
+    if timeline_storage() != TIMELINE_STORAGE_BUCKETS:
+        await delete_document("timeline_events", event_id)
+        return
+    
+    event_id = to_object_id(event_id)
+    await db.timeline_buckets.update_one(
+        {"deal_id": to_object_id(deal_id), "events._id": event_id},
+        {"$pull": {"events": {"_id": event_id}}, "$inc": {"count": -1}}
+    )
+
+
+async def list_timeline_events(deal_id: str) -> List[Dict[str, Any]]:
+    """
+    Get a deal's timeline events in chronological order
+    """
+    if timeline_storage() != TIMELINE_STORAGE_BUCKETS:
+        return await list_documents(
+            "timeline_events",
+            filter_query={"deal_id": deal_id},
+            limit=None,
+            sort_by={"timestamp": 1}
+        )
+    
+    events = []
+    async for bucket in db.timeline_buckets.find(
+        {"deal_id": to_object_id(deal_id)}, {"events": 1}
+    ).sort([("deal_id", ASCENDING), ("_id", ASCENDING)]):
+        events.extend(bucket["events"])
+    
+    # Buckets are in order, but concurrent appends can open two at once whose
+    # events interleave, so the events are merged by time (then creation)
+    events.sort(key=lambda event: (event["timestamp"], event["_id"]))
+    return decode_documents(events)
+
+
+def _timeline_lookup() -> Dict[str, Any]:
+    """$lookup stage embedding a deal's timeline events, sorted by timestamp"""
+    if timeline_storage() != TIMELINE_STORAGE_BUCKETS:
+        return {"$lookup": {
+            "from": "timeline_events",
+            "let": {"deal_id": "$_id"},
+            "pipeline": [
+                {"$match": {"$expr": {"$eq": ["$deal_id", "$$deal_id"]}}},
+                {"$sort": {"timestamp": 1}},
+            ],
+            "as": "timeline_events",
+        }}
+    
+    return {"$lookup": {
+        "from": "timeline_buckets",
+        "let": {"deal_id": "$_id"},
+        "pipeline": [
+            {"$match": {"$expr": {"$eq": ["$deal_id", "$$deal_id"]}}},
+            {"$unwind": "$events"},
+            {"$replaceRoot": {"newRoot": "$events"}},
+            {"$sort": {"timestamp": 1, "_id": 1}},
+        ],
+        "as": "timeline_events",
+    }}
+
+
+async def get_hydrated_deals(
+    filter_query: Dict[str, Any] = None,
+    limit: int = 100,
+    sort_by: Dict[str, int] = None,
+    cursor: Optional[str] = None
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    List one keyset page of deals with their business listing and timeline
+    events embedded, plus the cursor for the next page.
+    
+    Everything is resolved server-side in one aggregation: the listing is
+    joined on business_id and the timeline events (or timeline buckets) on
+    deal_id, sorted by timestamp, so a page of deals costs a single round trip.
+    """
+    sort_spec = _sort_spec(sort_by)
+    query = _apply_cursor(encode_ids(filter_query or {}), sort_spec, cursor)
+    
+    # Page before joining so only the returned deals are hydrated, fetching
+    # one extra deal to learn whether another page exists
+    pipeline: List[Dict[str, Any]] = [
+        {"$match": query},
+        {"$sort": dict(sort_spec)},
+        {"$limit": limit + 1},
+        {"$lookup": {
+            "from": "business_listings",
+            "localField": "business_id",
+            "foreignField": "_id",
+            "as": "business",
+        }},
+        {"$unwind": {"path": "$business", "preserveNullAndEmptyArrays": True}},
+        _timeline_lookup(),
+    ]
+    
+    deals = await db.deals.aggregate(pipeline, **_max_time_kwargs()).to_list(length=limit + 1)
+    
+    next_cursor = None
+    if len(deals) > limit:
+        deals = deals[:limit]
+        next_cursor = encode_cursor(deals[-1], sort_spec)
+    
+    for deal in deals:
+        decode_document(deal)
+        decode_document(deal.get("business"))
+        if deal["timeline_events"]:
+            decode_documents(deal["timeline_events"])
+        else:
+            # Deals without events keep timeline_events unset, as before
+            del deal["timeline_events"]
+    
+    return deals, next_cursor
+
+
+async def get_hydrated_deal(deal_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Get a single deal with its business listing and timeline events embedded
+    """
+    deals, _ = await get_hydrated_deals({"_id": deal_id}, limit=1)
+    return deals[0] if deals else None
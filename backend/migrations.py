@@ -0,0 +1,120 @@
+import argparse
+import asyncio
+from motor.motor_asyncio import AsyncIOMotorClient
+import os
+
+from database import timeline_bucket_size
+from models import FUNDING_PROGRESS_EXPRESSION
+
+
+async def backfill_funding_progress(db):
+    """Store funding_raised / funding_target on every listing as funding_progress"""
+    result = await db.business_listings.update_many(
+        {},
+        [{"$set": {"funding_progress": FUNDING_PROGRESS_EXPRESSION}}]
+    )
+    print(f"funding_progress set on {result.modified_count} of {result.matched_count} listings")
+
+
+async def bucket_timeline_events(db):
+    """
+    Copy timeline_events into timeline_buckets, for TIMELINE_STORAGE=buckets.
+    
+    Run it before switching the storage mode. Each deal's buckets are rebuilt
+    from scratch, so it can be re-run until then; timeline_events is left in
+    place. The new buckets are written before the old ones are removed, so a
+    failed run never leaves a deal without its timeline (at worst, with both
+    copies until it is re-run).
+    
+    Once the switch is made, new events are only stored in buckets. A deal
+    whose buckets hold events missing from timeline_events is left alone and
+    reported, since rebuilding it would lose them.
+    """
+    bucket_size = timeline_bucket_size()
+    deals = 0
+    events = 0
+    skipped = []
+    
+    async def write_deal(deal_id, deal_events):
+        old_buckets = await db.timeline_buckets.find(
+            {"deal_id": deal_id}, {"events._id": 1}
+        ).to_list(None)
+        known_ids = {event["_id"] for event in deal_events}
+        if any(
+            event["_id"] not in known_ids
+            for bucket in old_buckets
+            for event in bucket.get("events", [])
+        ):
+            skipped.append(deal_id)
+            return False
+        
+        buckets = [
+            {
+                "deal_id": deal_id,
+                "count": len(deal_events[start:start + bucket_size]),
+                "events": deal_events[start:start + bucket_size],
+            }
+            for start in range(0, len(deal_events), bucket_size)
+        ]
+        await db.timeline_buckets.insert_many(buckets)
+        await db.timeline_buckets.delete_many(
+            {"_id": {"$in": [bucket["_id"] for bucket in old_buckets]}}
+        )
+        return True
+    
+    # Walk the events deal by deal in timeline order (the deal_id_timestamp index)
+    current_deal_id = None
+    deal_events = []
+    cursor = db.timeline_events.find({}, {"id": 0}).sort(
+        [("deal_id", 1), ("timestamp", 1)]
+    ).batch_size(1000)
+    
+    async for event in cursor:
+        if event["deal_id"] != current_deal_id and deal_events:
+            if await write_deal(current_deal_id, deal_events):
+                deals += 1
+                events += len(deal_events)
+            deal_events = []
+        current_deal_id = event["deal_id"]
+        deal_events.append(event)
+    
+    if deal_events and await write_deal(current_deal_id, deal_events):
+        deals += 1
+        events += len(deal_events)
+    
+    print(f"{events} timeline events bucketed for {deals} deals")
+    if skipped:
+        print(
+            f"{len(skipped)} deals left alone, their buckets hold events added after "
+            f"the switch to buckets: {', '.join(str(deal_id) for deal_id in skipped)}"
+        )
+
+
+# Available migrations, by name
+MIGRATIONS = {
+    "funding_progress": backfill_funding_progress,
+    "timeline_buckets": bucket_timeline_events,
+}
+
+
+async def run_migrations(names):
+    """Run the named migrations, in order, against the configured database"""
+    mongo_url = os.environ.get("MONGO_URL", "mongodb://localhost:27017")
+    db_name = os.environ.get("DB_NAME", "seedsmb")
+    
+    client = AsyncIOMotorClient(mongo_url)
+    db = client[db_name]
+    
+    try:
+        for name in names:
+            print(f"Running migration: {name}")
+            await MIGRATIONS[name](db)
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run data migrations")
+    parser.add_argument("migrations", nargs="+", choices=sorted(MIGRATIONS), help="Migrations to run")
+    args = parser.parse_args()
+    asyncio.run(run_migrations(args.migrations))
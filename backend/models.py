@@ -1,6 +1,7 @@
-from typing import List, Optional, Union, Any
+from typing import List, Optional, Union, Any, Dict, Tuple, Type, TypeVar, get_args, get_origin
 from pydantic import BaseModel, Field, EmailStr, model_validator
 from datetime import datetime
+from functools import lru_cache
 import uuid
 from enum import Enum
 
@@ -81,6 +82,11 @@ class Token(BaseModel):
     token_type: str = "bearer"
 
 
+class StreamToken(BaseModel):
+    token: str
+    expires_in: int  # seconds
+
+
 # Business Listing models
 class BusinessListingBase(BaseModel):
     title: str
@@ -113,6 +119,8 @@ class BusinessListing(BusinessListingBase, BaseId, TimestampModel):
     seller_id: str
     status: BusinessStatus = BusinessStatus.DRAFT
     funding_raised: float = 0
+    # funding_raised / funding_target, stored so the featured rail can sort on an index
+    funding_progress: float = 0
     under_loi: bool = False
     investor_count: int = 0
     funding_end_date: Optional[datetime] = None
@@ -122,10 +130,62 @@ class BusinessListing(BusinessListingBase, BaseId, TimestampModel):
         from_attributes = True
 
 
+def funding_progress(funding_raised: Optional[float], funding_target: Optional[float]) -> float:
+    """
+    Fraction of the funding target raised (0 when there is no target)
+    """
+    if not funding_target:
+        return 0
+    return (funding_raised or 0) / funding_target
+
+
+# The same formula as an aggregation expression, for pipeline updates
+FUNDING_PROGRESS_EXPRESSION = {
+    "$cond": [
+        {"$gt": [{"$ifNull": ["$funding_target", 0]}, 0]},
+        {"$divide": [{"$ifNull": ["$funding_raised", 0]}, "$funding_target"]},
+        0
+    ]
+}
+
+
+# Bulk listing import models
+class ListingImportRowError(BaseModel):
+    row: int
+    errors: List[str]
+
+
+class ListingImportResult(BaseModel):
+    inserted: int = 0
+    failed: int = 0
+    listing_ids: List[str] = []
+    errors: List[ListingImportRowError] = []
+
+
+# Listing facet models
+class FacetValueCount(BaseModel):
+    value: str
+    count: int
+
+
+class FacetRangeCount(BaseModel):
+    min: float
+    max: Optional[float] = None
+    count: int
+
+
+class ListingFacets(BaseModel):
+    total: int = 0
+    industry: List[FacetValueCount] = []
+    location: List[FacetValueCount] = []
+    annual_revenue: List[FacetRangeCount] = []
+    annual_profit: List[FacetRangeCount] = []
+
+
 # Investment models
 class InvestmentCreate(BaseModel):
     business_id: str
-    amount: float
+    amount: float = Field(gt=0)
 
 
 class Investment(BaseId, TimestampModel):
@@ -207,3 +267,83 @@ class Document(BaseId, TimestampModel):
     class Config:
         populate_by_name = True
         from_attributes = True
+
+
+# Trusted hydration
+#
+# Documents read back from MongoDB were validated when they were written, so
+# building response models from them with Model(**doc) repeats work that
+# dominates the CPU time of the list endpoints. hydrate() uses model_construct
+# instead and only coerces what the serializer needs typed: enum values and
+# nested models. FastAPI passes an instance of the response_model class
+# through without revalidating it, so the response is built with no
+# validation at all. Documents missing a required field (e.g. written by an
+# older version) fall back to full validation so they still fail loudly.
+
+ModelT = TypeVar("ModelT", bound=BaseModel)
+
+# How a field's raw value has to be converted before model_construct
+_ENUM, _MODEL, _MODEL_LIST = "enum", "model", "model_list"
+
+
+def _unwrap_optional(annotation: Any) -> Any:
+    """Strip Optional[...] from an annotation"""
+    if get_origin(annotation) is Union:
+        args = [arg for arg in get_args(annotation) if arg is not type(None)]
+        if len(args) == 1:
+            return args[0]
+    return annotation
+
+
+@lru_cache(maxsize=None)
+def _hydration_plan(model: Type[BaseModel]) -> Tuple[Tuple[Tuple[str, str, Any], ...], frozenset]:
+    """
+    Work out once per model which fields need converting and which are required
+    """
+    conversions = []
+    required = set()
+    for name, field in model.model_fields.items():
+        if field.is_required():
+            required.add(name)
+        annotation = _unwrap_optional(field.annotation)
+        if isinstance(annotation, type) and issubclass(annotation, Enum):
+            conversions.append((name, _ENUM, annotation))
+        elif isinstance(annotation, type) and issubclass(annotation, BaseModel):
+            conversions.append((name, _MODEL, annotation))
+        elif get_origin(annotation) in (list, List):
+            (item_type,) = get_args(annotation) or (Any,)
+            if isinstance(item_type, type) and issubclass(item_type, BaseModel):
+                conversions.append((name, _MODEL_LIST, item_type))
+    return tuple(conversions), frozenset(required)
+
+
+def hydrate(model: Type[ModelT], document: Dict[str, Any]) -> ModelT:
+    """
+    Build a model from a trusted database document without validating it
+    """
+    conversions, required = _hydration_plan(model)
+    if not required.issubset(document.keys()):
+        return model.model_validate(document)
+
+    values = dict(document)
+    for name, kind, target in conversions:
+        value = values.get(name)
+        if value is None:
+            continue
+        if kind == _ENUM:
+            if not isinstance(value, target):
+                values[name] = target(value)
+        elif kind == _MODEL:
+            if isinstance(value, dict):
+                values[name] = hydrate(target, value)
+        elif kind == _MODEL_LIST:
+            values[name] = [
+                hydrate(target, item) if isinstance(item, dict) else item
+                for item in value
+            ]
+    return model.model_construct(**values)
+
+
+def hydrate_many(model: Type[ModelT], documents: List[Dict[str, Any]]) -> List[ModelT]:
+    """hydrate for every document in a list"""
+    return [hydrate(model, document) for document in documents]
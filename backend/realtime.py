@@ -0,0 +1,362 @@
+"""
+Live updates over Server-Sent Events.
+
+Two streams replace polling:
+
+- GET /deals/{deal_id}/events streams a deal's new timeline events as they
+  are created, so the deal room doesn't have to poll GET /deals/{deal_id}.
+- GET /listings/{listing_id}/funding streams a listing's funding totals as
+  investments come in, so investors watching a raise don't have to poll
+  GET /listings/{listing_id}.
+
+Browsers' EventSource can't send an Authorization header. The funding stream
+is public, so it needs none. The deal stream also accepts a short-lived
+stream token (POST /auth/stream-token) in its token query parameter; clients
+that read the stream with fetch can send their access token as usual.
+
+Each stream has a hub that keeps, per deal or listing, the connections currently
+watching it. Nothing nobody is watching has an entry, so publishing to it is
+a dict lookup and idle pages cost nothing. Each message is encoded once and
+the same string is handed to every subscriber.
+
+DealTimelineHub gives every subscriber a bounded queue. A subscriber that
+falls QUEUE_SIZE events behind is disconnected rather than having events
+dropped, and the client resyncs with a full GET /deals/{deal_id}. EventSource
+reconnects on its own while its stream token is valid; after that the
+reconnect is refused with 401, which EventSource doesn't retry, so the client
+gets a new token and opens a new EventSource (fetch clients reconnect
+themselves).
+
+FundingTickerHub only ever needs the latest totals, so it coalesces: the
+first change to a listing goes out at once and later ones within the
+interval are merged into a single update at its end. However many
+investments land, a listing's watchers get at most one update per interval.
+Subscribers hold only the latest update, so a slow client can't build up a
+backlog.
+
+With several workers, timeline events and (already coalesced) funding
+updates are also published on the cache bus (Redis pub/sub, when REDIS_URL
+is set), and every other worker delivers them to its own subscribers. If the
+bus subscription drops, messages may have been missed, so every stream is
+closed to make clients resync.
+
+Settings (read per connection, or per update):
+    TIMELINE_STREAM_QUEUE_SIZE          events buffered per timeline subscriber
+    FUNDING_TICKER_INTERVAL_SECONDS     shortest time between funding updates
+    STREAM_HEARTBEAT_SECONDS            idle time before a keep-alive comment
+"""
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional, Set
+import asyncio
+import json
+import logging
+import os
+import uuid
+
+from cache import cache_bus
+from database import get_document
+from models import TimelineEvent
+from responses import encode_json
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_SIZE = 100
+DEFAULT_TICKER_INTERVAL_SECONDS = 1.0
+DEFAULT_HEARTBEAT_SECONDS = 15
+
+# Listing fields carried by funding updates
+FUNDING_FIELDS = ("funding_raised", "funding_target", "funding_progress", "investor_count")
+
+# Identifies this worker's own messages on the cache bus
+_WORKER_ID = uuid.uuid4().hex
+
+# Queued in place of an event to end a stream
+_CLOSE = None
+
+
+def _heartbeat_seconds() -> float:
+    return float(os.environ.get("STREAM_HEARTBEAT_SECONDS", DEFAULT_HEARTBEAT_SECONDS))
+
+
+class DealTimelineHub:
+    """
+    In-process fan-out of encoded timeline events to the streams watching a deal
+    """
+
+    def __init__(self):
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+
+    def subscriber_count(self, deal_id: Optional[str] = None) -> int:
+        if deal_id is not None:
+            return len(self._subscribers.get(deal_id, ()))
+        return sum(len(queues) for queues in self._subscribers.values())
+
+    @asynccontextmanager
+    async def subscribe(self, deal_id: str, queue_size: int) -> AsyncIterator[asyncio.Queue]:
+        """
+        Watch a deal for the duration of the block. The queue yields encoded
+        events, or _CLOSE when the stream should end.
+        """
+        # One slot is kept free for _CLOSE
+        queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size + 1)
+        self._subscribers.setdefault(deal_id, set()).add(queue)
+        try:
+            yield queue
+        finally:
+            queues = self._subscribers.get(deal_id)
+            if queues is not None:
+                queues.discard(queue)
+                if not queues:
+                    del self._subscribers[deal_id]
+
+    def deliver(self, deal_id: str, data: str) -> None:
+        """
+        Hand an encoded event to every local subscriber of the deal
+        """
+        queues = self._subscribers.get(deal_id)
+        if not queues:
+            return
+        for queue in list(queues):
+            if queue.maxsize - queue.qsize() > 1:
+                queue.put_nowait(data)
+            else:
+                # Too far behind: end the stream instead of dropping events
+                self._close(deal_id, queue)
+
+    def _close(self, deal_id: str, queue: asyncio.Queue) -> None:
+        self._subscribers[deal_id].discard(queue)
+        if not self._subscribers[deal_id]:
+            del self._subscribers[deal_id]
+        queue.put_nowait(_CLOSE)
+
+    def close_all(self) -> None:
+        """End every stream (clients reconnect and resync)"""
+        for deal_id, queues in list(self._subscribers.items()):
+            for queue in list(queues):
+                self._close(deal_id, queue)
+
+
+class _TickerSubscriber:
+    """A funding stream's mailbox: only the latest update is kept"""
+
+    def __init__(self):
+        self.data: Optional[str] = None
+        self.closed = False
+        self.ready = asyncio.Event()
+
+    def put(self, data: str) -> None:
+        self.data = data
+        self.ready.set()
+
+    def close(self) -> None:
+        self.closed = True
+        self.ready.set()
+
+
+class FundingTickerHub:
+    """
+    Coalesces funding changes per listing and fans each update out to the
+    streams watching it
+    """
+
+    def __init__(self):
+        self._subscribers: Dict[str, Set[_TickerSubscriber]] = {}
+        # Per listing with an open interval: the totals not yet sent (if any)
+        # and whether they include changes made on this worker
+        self._pending: Dict[str, Optional[Dict[str, Any]]] = {}
+        self._relay: Set[str] = set()
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+
+    def subscriber_count(self, listing_id: Optional[str] = None) -> int:
+        if listing_id is not None:
+            return len(self._subscribers.get(listing_id, ()))
+        return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    @asynccontextmanager
+    async def subscribe(self, listing_id: str) -> AsyncIterator[_TickerSubscriber]:
+        """
+        Watch a listing's funding for the duration of the block
+        """
+        subscriber = _TickerSubscriber()
+        self._subscribers.setdefault(listing_id, set()).add(subscriber)
+        try:
+            yield subscriber
+        finally:
+            subscribers = self._subscribers.get(listing_id)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[listing_id]
+
+    def update(self, listing_id: str, totals: Dict[str, Any], relay: bool) -> None:
+        """
+        Record a listing's new funding totals. relay is set for changes made
+        on this worker, which the other workers need to hear about.
+        """
+        # Nobody to tell
+        if listing_id not in self._subscribers and not (relay and cache_bus.redis is not None):
+            return
+
+        if relay:
+            self._relay.add(listing_id)
+
+        if listing_id in self._timers:
+            # Inside the listing's interval: keep the newest totals for its end.
+            # Every investment adds an investor, so investor_count orders them
+            pending = self._pending.get(listing_id)
+            if pending is None or totals.get("investor_count", 0) >= pending.get("investor_count", 0):
+                self._pending[listing_id] = totals
+        else:
+            self._pending[listing_id] = totals
+            self._flush(listing_id)
+
+    def _flush(self, listing_id: str) -> None:
+        """
+        Send a listing's pending totals, if any, and open its next interval
+        """
+        totals = self._pending.pop(listing_id, None)
+        self._timers.pop(listing_id, None)
+        if totals is None:
+            # Nothing changed during the interval: it just closes
+            self._relay.discard(listing_id)
+            return
+
+        data = json.dumps({"listing_id": listing_id, **totals}, default=str)
+        self.deliver(listing_id, data)
+        if listing_id in self._relay:
+            self._relay.discard(listing_id)
+            asyncio.get_running_loop().create_task(
+                cache_bus.publish("funding", f"{_WORKER_ID} {listing_id} {data}")
+            )
+
+        interval = float(os.environ.get("FUNDING_TICKER_INTERVAL_SECONDS", DEFAULT_TICKER_INTERVAL_SECONDS))
+        self._pending[listing_id] = None
+        self._timers[listing_id] = asyncio.get_running_loop().call_later(
+            interval, self._flush, listing_id
+        )
+
+    def deliver(self, listing_id: str, data: str) -> None:
+        """
+        Hand an encoded update to every local subscriber of the listing
+        """
+        for subscriber in self._subscribers.get(listing_id, ()):
+            subscriber.put(data)
+
+    def close_all(self) -> None:
+        """End every stream (clients reconnect and resync)"""
+        for subscribers in self._subscribers.values():
+            for subscriber in subscribers:
+                subscriber.close()
+        self._subscribers.clear()
+
+
+deal_timeline_hub = DealTimelineHub()
+funding_ticker_hub = FundingTickerHub()
+
+
+def _sse(event: str, data: str) -> str:
+    """Format one Server-Sent Events message"""
+    return f"event: {event}\ndata: {data}\n\n"
+
+
+def _on_timeline_event(payload: str) -> None:
+    worker_id, _, message = payload.partition(" ")
+    if worker_id != _WORKER_ID:
+        deal_id, _, data = message.partition(" ")
+        deal_timeline_hub.deliver(deal_id, data)
+
+
+def _on_funding_update(payload: str) -> None:
+    worker_id, _, message = payload.partition(" ")
+    if worker_id != _WORKER_ID:
+        listing_id, _, data = message.partition(" ")
+        totals = json.loads(data)
+        totals.pop("listing_id", None)
+        funding_ticker_hub.update(listing_id, totals, relay=False)
+
+
+async def publish_timeline_event(event: TimelineEvent) -> None:
+    """
+    Push a newly stored timeline event to everyone watching its deal, on
+    this worker and (over the cache bus) the others
+    """
+    data = encode_json(TimelineEvent, event).decode()
+    deal_timeline_hub.deliver(event.deal_id, data)
+    await cache_bus.publish("timeline", f"{_WORKER_ID} {event.deal_id} {data}")
+
+
+def publish_funding_update(listing: Dict[str, Any]) -> None:
+    """
+    Report a listing's funding totals after an investment (listing holds
+    at least its id and FUNDING_FIELDS)
+    """
+    totals = {field: listing.get(field) for field in FUNDING_FIELDS}
+    funding_ticker_hub.update(listing["id"], totals, relay=True)
+
+
+async def timeline_event_stream(deal_id: str) -> AsyncIterator[str]:
+    """
+    Server-Sent Events for a deal's new timeline events, with keep-alive
+    comments while the deal is quiet. Ends when the client disconnects.
+    """
+    queue_size = int(os.environ.get("TIMELINE_STREAM_QUEUE_SIZE", DEFAULT_QUEUE_SIZE))
+    heartbeat = _heartbeat_seconds()
+
+    async with deal_timeline_hub.subscribe(deal_id, queue_size) as queue:
+        # Sent at once so the client knows the subscription is live
+        yield ": connected\n\n"
+        while True:
+            try:
+                data = await asyncio.wait_for(queue.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if data is _CLOSE:
+                return
+            yield _sse("timeline_event", data)
+
+
+async def funding_stream(listing_id: str) -> AsyncIterator[str]:
+    """
+    Server-Sent Events for a listing's funding totals: the current totals
+    first, then each coalesced update. Ends when the client disconnects (or
+    if the listing is gone).
+    """
+    heartbeat = _heartbeat_seconds()
+
+    # Subscribe before reading the current totals, so an investment landing
+    # in between is delivered rather than lost. The totals are read from the
+    # primary: a lagging secondary could miss one that was already published
+    async with funding_ticker_hub.subscribe(listing_id) as subscriber:
+        listing = await get_document(
+            "business_listings",
+            listing_id,
+            projection={field: 1 for field in FUNDING_FIELDS},
+            use_cache=False
+        )
+        if listing is None:
+            return
+        totals = {field: listing.get(field) for field in FUNDING_FIELDS}
+        yield _sse("funding", json.dumps({"listing_id": listing_id, **totals}, default=str))
+
+        # Updates published before the read are already in the totals sent
+        sent_count = totals.get("investor_count") or 0
+        while True:
+            try:
+                await asyncio.wait_for(subscriber.ready.wait(), heartbeat)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            subscriber.ready.clear()
+            if subscriber.closed:
+                return
+            count = json.loads(subscriber.data).get("investor_count") or 0
+            if count < sent_count:
+                continue
+            sent_count = count
+            yield _sse("funding", subscriber.data)
+
+
+# Missed messages can't be replayed, so streams are closed to make clients resync
+cache_bus.register("timeline", _on_timeline_event, deal_timeline_hub.close_all)
+cache_bus.register("funding", _on_funding_update, funding_ticker_hub.close_all)
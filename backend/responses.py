@@ -0,0 +1,38 @@
+"""
+Fast JSON responses.
+
+The app's default response class is FastAPI's ORJSONResponse, so regular
+endpoints are rendered by orjson instead of the standard json module.
+
+Hot read endpoints can go one step further and return pre-encoded bytes:
+encode_json serializes the models in one pass through pydantic-core's
+dump_json, and JSONBytesResponse sends the bytes as they are, bypassing
+FastAPI's response validation and jsonable_encoder entirely. Keep response_model on those routes so the
+OpenAPI schema still documents the payload.
+"""
+from functools import lru_cache
+from typing import Any
+
+from fastapi.responses import Response
+from pydantic import TypeAdapter
+
+
+class JSONBytesResponse(Response):
+    """A JSON response whose content is already encoded"""
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return content
+
+
+@lru_cache(maxsize=None)
+def _type_adapter(response_type: Any) -> TypeAdapter:
+    """One TypeAdapter per response type, built on first use"""
+    return TypeAdapter(response_type)
+
+
+def encode_json(response_type: Any, content: Any) -> bytes:
+    """
+    Encode content as response_type (e.g. List[BusinessListing]) straight to bytes
+    """
+    return _type_adapter(response_type).dump_json(content)
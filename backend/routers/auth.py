@@ -3,18 +3,43 @@ from fastapi.security import OAuth2PasswordRequestForm
 from datetime import timedelta
 from typing import Dict
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError, PyMongoError
+import logging
 
-from models import UserCreate, UserLogin, UserProfile, Token, UserType
+from models import UserCreate, UserLogin, UserProfile, Token, StreamToken, UserType
 from auth import (
-    get_password_hash,
-    verify_password,
+    hash_password,
+    verify_and_update_password,
     create_access_token,
+    create_stream_token,
+    stream_token_expire_seconds,
     get_current_user,
 )
-from database import get_database, create_document, get_document
+from database import get_database, create_document, get_document, update_document
 
 router = APIRouter(prefix="/auth", tags=["authentication"])
 
+logger = logging.getLogger(__name__)
+
+
+async def _check_password(user, password: str) -> bool:
+    """
+    Check a login password against the user's stored hash, re-hashing it
+    when it was made at a different cost than BCRYPT_ROUNDS
+    """
+    verified, new_hash = await verify_and_update_password(
+        password, user.get("hashed_password") if user else None
+    )
+    
+    if verified and new_hash:
+        # The login stands either way; the next one retries the re-hash
+        try:
+            await update_document("profiles", user["_id"], {"hashed_password": new_hash})
+        except PyMongoError:
+            logger.exception("Could not store the re-hashed password of user %s", user["_id"])
+    
+    return verified
+
 
 @router.post("/register", response_model=UserProfile, status_code=status.HTTP_201_CREATED)
 async def register_user(user_data: UserCreate, db=Depends(get_database)):
@@ -30,7 +55,7 @@ async def register_user(user_data: UserCreate, db=Depends(get_database)):
         )
 
     # Create user in database
-    hashed_password = get_password_hash(user_data.password)
+    hashed_password = await hash_password(user_data.password)
     
     # Create user profile
     user_profile = UserProfile(
@@ -48,8 +73,14 @@ async def register_user(user_data: UserCreate, db=Depends(get_database)):
     if 'id' in user_dict:
         del user_dict['id']
     
-    # Insert document and get ID
-    user_id = await create_document("profiles", user_dict)
+    # Insert document and get ID (the unique email index catches concurrent registrations)
+    try:
+        user_id = await create_document("profiles", user_dict)
+    except DuplicateKeyError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="User with this email already exists",
+        )
     
     # Update the profile with the ID
     user_profile.id = user_id
@@ -65,7 +96,7 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
     # Find user by email
     user = await db.profiles.find_one({"email": form_data.username})
     
-    if not user or not verify_password(form_data.password, user.get("hashed_password", "")):
+    if not await _check_password(user, form_data.password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
@@ -92,7 +123,7 @@ async def login(login_data: UserLogin, db=Depends(get_database)):
     # Find user by email
     user = await db.profiles.find_one({"email": login_data.email})
     
-    if not user or not verify_password(login_data.password, user.get("hashed_password", "")):
+    if not await _check_password(user, login_data.password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
@@ -118,6 +149,16 @@ async def get_user_profile(current_user: UserProfile = Depends(get_current_user)
     return current_user
 
 
+@router.post("/stream-token", response_model=StreamToken)
+async def get_stream_token(current_user: UserProfile = Depends(get_current_user)):
+    """
+    Get a short-lived token for opening event streams with EventSource, which
+    can't send an Authorization header: pass it as the token query parameter.
+    Once it expires, reconnecting fails with 401 and a new one is needed.
+    """
+    return {"token": create_stream_token(current_user.id), "expires_in": stream_token_expire_seconds()}
+
+
 @router.post("/check-email", response_model=Dict[str, bool])
 async def check_email_exists(email: str, db=Depends(get_database)):
     """
@@ -1,6 +1,9 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Response
+from fastapi.responses import StreamingResponse
 from typing import List, Optional
 from datetime import datetime
+from bson import ObjectId
+import asyncio
 
 from models import (
     Deal,
@@ -8,22 +11,43 @@ from models import (
     UserProfile,
     UserType,
     DealStatus,
+    BusinessStatus,
     Document,
-    BusinessListing
+    BusinessListing,
+    hydrate,
+    hydrate_many
+)
+from auth import get_current_user, get_stream_user
+from realtime import publish_timeline_event, timeline_event_stream
+from database import (
+    get_database,
+    create_document,
+    append_timeline_event,
+    delete_timeline_event,
+    list_timeline_events,
+    list_documents_page,
+    get_document,
+    get_hydrated_deal,
+    get_hydrated_deals,
+    update_document,
+    update_document_returning,
+    NEXT_CURSOR_HEADER
 )
-from auth import get_current_user
-from database import get_database, create_document, list_documents, get_document, update_document
 
 router = APIRouter(prefix="/deals", tags=["deals"])
 
 
 @router.get("/", response_model=List[Deal])
 async def get_user_deals(
+    response: Response,
+    limit: int = Query(100, ge=1, le=100),
+    cursor: Optional[str] = None,
     current_user: UserProfile = Depends(get_current_user),
     db=Depends(get_database)
 ):
     """
-    Get deals for the current user (as buyer or seller)
+    Get deals for the current user (as buyer or seller), paged with the
+    X-Next-Cursor header
     """
     # Build filter query for deals where user is either buyer or seller
     filter_query = {
@@ -33,26 +57,19 @@ async def get_user_deals(
         ]
     }
     
-    # Get deals
-    deals = await list_documents("deals", filter_query=filter_query)
-    
-    # For each deal, get the associated business listing and timeline events
-    for deal in deals:
-        # Get business
-        business = await get_document("business_listings", deal["business_id"])
-        if business:
-            deal["business"] = business
-        
-        # Get timeline events
-        timeline_events = await list_documents(
-            "timeline_events", 
-            filter_query={"deal_id": deal["id"]}
-        )
-        if timeline_events:
-            deal["timeline_events"] = timeline_events
+    # Get deals with their business listing and timeline events in one query
+    deals, next_cursor = await get_hydrated_deals(
+        filter_query=filter_query,
+        limit=limit,
+        sort_by={"created_at": 1},
+        cursor=cursor
+    )
+    
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
     
     # Convert to Deal objects
-    return [Deal(**deal) for deal in deals]
+    return hydrate_many(Deal, deals)
 
 
 @router.get("/{deal_id}", response_model=Deal)
@@ -64,8 +81,8 @@ async def get_deal(
     """
     Get a specific deal
     """
-    # Get the deal
-    deal = await get_document("deals", deal_id)
+    # Get the deal with its business listing and timeline events
+    deal = await get_hydrated_deal(deal_id)
     
     if not deal:
         raise HTTPException(
@@ -82,22 +99,46 @@ async def get_deal(
             detail="You do not have permission to view this deal"
         )
     
-    # Get the business listing
-    business = await get_document("business_listings", deal["business_id"])
+    return hydrate(Deal, deal)
+
+
+@router.get("/{deal_id}/events")
+async def stream_deal_events(
+    deal_id: str,
+    current_user: UserProfile = Depends(get_stream_user),
+    db=Depends(get_database)
+):
+    """
+    Stream a deal's new timeline events as Server-Sent Events.
     
-    if business:
-        deal["business"] = business
+    Authenticated like any other endpoint with an Authorization header
+    (fetch-based clients), or, for EventSource, with a stream token from
+    POST /auth/stream-token in the token query parameter.
+    """
+    # Get the deal (only the fields the permission check needs)
+    deal = await get_document("deals", deal_id, projection={"buyer_id": 1, "seller_id": 1})
     
-    # Get timeline events
-    timeline_events = await list_documents(
-        "timeline_events", 
-        filter_query={"deal_id": deal_id}
-    )
+    if not deal:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Deal not found"
+        )
     
-    if timeline_events:
-        deal["timeline_events"] = timeline_events
+    # Check if user is the buyer, the seller, or an admin
+    if (deal["buyer_id"] != current_user.id and 
+        deal["seller_id"] != current_user.id and
+        current_user.user_type != UserType.ADMIN):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You do not have permission to view this deal"
+        )
     
-    return Deal(**deal)
+    return StreamingResponse(
+        timeline_event_stream(deal_id),
+        media_type="text/event-stream",
+        # Keep proxies from caching or buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 @router.post("/{deal_id}/timeline", response_model=TimelineEvent)
@@ -110,8 +151,8 @@ async def add_timeline_event(
     """
     Add a timeline event to a deal
     """
-    # Get the deal
-    deal = await get_document("deals", deal_id)
+    # Get the deal (only the fields the permission check needs)
+    deal = await get_document("deals", deal_id, projection={"buyer_id": 1, "seller_id": 1})
     
     if not deal:
         raise HTTPException(
@@ -138,11 +179,13 @@ async def add_timeline_event(
     
     # Insert document
     timeline_event_dict = timeline_event.model_dump(by_alias=True)
-    event_id = await create_document("timeline_events", timeline_event_dict)
+    event_id = await append_timeline_event(timeline_event_dict)
     
     # Update the ID
     timeline_event.id = event_id
     
+    await publish_timeline_event(timeline_event)
+    
     return timeline_event
 
 
@@ -155,8 +198,10 @@ async def complete_deal(
     """
     Mark a deal as completed
     """
-    # Get the deal
-    deal = await get_document("deals", deal_id)
+    # Get the deal (only the fields the checks and listing update need)
+    deal = await get_document(
+        "deals", deal_id, projection={"seller_id": 1, "status": 1, "business_id": 1}
+    )
     
     if not deal:
         raise HTTPException(
@@ -178,20 +223,25 @@ async def complete_deal(
             detail="This deal cannot be marked as completed"
         )
     
-    # Update the deal status
-    await update_document("deals", deal_id, {
-        "status": DealStatus.COMPLETED.value,
-        "updated_at": datetime.utcnow()
-    })
+    # Update the deal status, provided it is still in progress, and get it back
+    now = datetime.utcnow()
+    updated_deal = await update_document_returning(
+        "deals",
+        deal_id,
+        {"status": DealStatus.COMPLETED.value, "updated_at": now},
+        precondition={"status": DealStatus.IN_PROGRESS.value}
+    )
     
-    # Update the business listing status to CLOSED
-    await update_document("business_listings", deal["business_id"], {
-        "status": "closed",
-        "updated_at": datetime.utcnow()
-    })
+    if not updated_deal:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="This deal cannot be marked as completed"
+        )
     
-    # Create timeline event
+    # Create timeline event (its ID is assigned here so it can be told apart
+    # in the timeline read below)
     timeline_event = TimelineEvent(
+        id=str(ObjectId()),
         deal_id=deal_id,
         title="Deal Completed",
         description="The transaction has been completed successfully",
@@ -199,27 +249,50 @@ async def complete_deal(
     )
     
     timeline_event_dict = timeline_event.model_dump(by_alias=True)
-    await create_document("timeline_events", timeline_event_dict)
-    
-    # Get the updated deal
-    updated_deal = await get_document("deals", deal_id)
-    
-    # Get the business
-    business = await get_document("business_listings", updated_deal["business_id"])
-    
-    if business:
-        updated_deal["business"] = business
-    
-    # Get timeline events
-    timeline_events = await list_documents(
-        "timeline_events", 
-        filter_query={"deal_id": deal_id}
+    timeline_event_dict["_id"] = timeline_event.id
+    
+    # Close the business listing, insert the event and read the timeline
+    # together
+    business, event_result, timeline_events = await asyncio.gather(
+        update_document_returning("business_listings", deal["business_id"], {
+            "status": BusinessStatus.CLOSED.value,
+            "updated_at": now
+        }),
+        append_timeline_event(timeline_event_dict),
+        list_timeline_events(deal_id),
+        return_exceptions=True
     )
     
-    if timeline_events:
-        updated_deal["timeline_events"] = timeline_events
-    
-    return Deal(**updated_deal)
+    failures = [
+        result for result in (business, event_result, timeline_events)
+        if isinstance(result, Exception)
+    ]
+    if failures:
+        # Undo whatever went through, so the deal can be completed again
+        if not isinstance(business, Exception):
+            # A deal in progress keeps its listing under LOI
+            await update_document("business_listings", deal["business_id"], {
+                "status": BusinessStatus.UNDER_LOI.value,
+                "updated_at": datetime.utcnow()
+            })
+        if not isinstance(event_result, Exception):
+            await delete_timeline_event(deal_id, timeline_event.id)
+        await update_document("deals", deal_id, {
+            "status": DealStatus.IN_PROGRESS.value,
+            "updated_at": datetime.utcnow()
+        })
+        raise failures[0]
+    
+    # The read may or may not have seen the new event; it goes last either way
+    timeline_events = [event for event in timeline_events if event["id"] != timeline_event.id]
+    
+    await publish_timeline_event(timeline_event)
+    
+    # Build the response from the documents in hand
+    updated_deal["business"] = business
+    updated_deal["timeline_events"] = timeline_events + [timeline_event.model_dump()]
+    
+    return hydrate(Deal, updated_deal)
 
 
 @router.post("/{deal_id}/documents", response_model=Document)
@@ -232,8 +305,8 @@ async def add_document(
     """
     Add a document to a deal
     """
-    # Get the deal
-    deal = await get_document("deals", deal_id)
+    # Get the deal (only the fields the permission check needs)
+    deal = await get_document("deals", deal_id, projection={"buyer_id": 1, "seller_id": 1})
     
     if not deal:
         raise HTTPException(
@@ -276,7 +349,8 @@ async def add_document(
     )
     
     timeline_event_dict = timeline_event.model_dump(by_alias=True)
-    await create_document("timeline_events", timeline_event_dict)
+    timeline_event.id = await append_timeline_event(timeline_event_dict)
+    await publish_timeline_event(timeline_event)
     
     return document
 
@@ -284,14 +358,17 @@ async def add_document(
 @router.get("/{deal_id}/documents", response_model=List[Document])
 async def get_deal_documents(
     deal_id: str,
+    response: Response,
+    limit: int = Query(100, ge=1, le=100),
+    cursor: Optional[str] = None,
     current_user: UserProfile = Depends(get_current_user),
     db=Depends(get_database)
 ):
     """
-    Get all documents for a deal
+    Get the documents for a deal, paged with the X-Next-Cursor header
     """
-    # Get the deal
-    deal = await get_document("deals", deal_id)
+    # Get the deal (only the fields the permission check needs)
+    deal = await get_document("deals", deal_id, projection={"buyer_id": 1, "seller_id": 1})
     
     if not deal:
         raise HTTPException(
@@ -309,7 +386,16 @@ async def get_deal_documents(
         )
     
     # Get documents
-    documents = await list_documents("documents", filter_query={"deal_id": deal_id})
+    documents, next_cursor = await list_documents_page(
+        "documents",
+        filter_query={"deal_id": deal_id},
+        limit=limit,
+        sort_by={"created_at": 1},
+        cursor=cursor
+    )
+    
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
     
     # Convert to Document objects
-    return [Document(**document) for document in documents]
+    return hydrate_many(Document, documents)
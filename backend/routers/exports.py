@@ -0,0 +1,121 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import StreamingResponse
+from typing import Any, AsyncIterator, Dict, Optional
+from datetime import datetime
+import json
+
+from models import UserProfile, UserType, BusinessStatus
+from auth import get_current_user
+from database import get_database, stream_documents
+
+router = APIRouter(prefix="/exports", tags=["exports"])
+
+# Documents pulled from MongoDB and written to the response per chunk
+EXPORT_BATCH_SIZE = 500
+
+
+def _json_default(value: Any) -> Any:
+    """Serialize the non-JSON types that come back from MongoDB"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+async def _ndjson_lines(documents: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[str]:
+    """Encode documents as newline-delimited JSON, one chunk per batch"""
+    lines = []
+    async for document in documents:
+        document.pop("_id", None)
+        lines.append(json.dumps(document, default=_json_default))
+        if len(lines) >= EXPORT_BATCH_SIZE:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+def _ndjson_response(documents: AsyncIterator[Dict[str, Any]], filename: str) -> StreamingResponse:
+    """Stream documents to the client as an NDJSON download"""
+    return StreamingResponse(
+        _ndjson_lines(documents),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
+def _require_admin(current_user: UserProfile):
+    """Exports are only available to admins"""
+    if current_user.user_type != UserType.ADMIN:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only admins can access this endpoint"
+        )
+
+
+@router.get("/listings")
+async def export_listings(
+    status: Optional[BusinessStatus] = None,
+    current_user: UserProfile = Depends(get_current_user),
+    db=Depends(get_database)
+):
+    """
+    Export business listings as NDJSON (admin only)
+    """
+    _require_admin(current_user)
+    
+    filter_query = {"status": status.value} if status else {}
+    
+    documents = stream_documents(
+        "business_listings",
+        filter_query=filter_query,
+        batch_size=EXPORT_BATCH_SIZE
+    )
+    
+    return _ndjson_response(documents, "listings.ndjson")
+
+
+@router.get("/investments")
+async def export_investments(
+    business_id: Optional[str] = None,
+    current_user: UserProfile = Depends(get_current_user),
+    db=Depends(get_database)
+):
+    """
+    Export investments as NDJSON (admin only)
+    """
+    _require_admin(current_user)
+    
+    filter_query = {"business_id": business_id} if business_id else {}
+    
+    documents = stream_documents(
+        "investments",
+        filter_query=filter_query,
+        batch_size=EXPORT_BATCH_SIZE
+    )
+    
+    return _ndjson_response(documents, "investments.ndjson")
+
+
+@router.get("/profiles")
+async def export_profiles(
+    user_type: Optional[UserType] = None,
+    current_user: UserProfile = Depends(get_current_user),
+    db=Depends(get_database)
+):
+    """
+    Export user profiles as NDJSON (admin only)
+    """
+    _require_admin(current_user)
+    
+    filter_query = {"user_type": user_type.value} if user_type else {}
+    
+    # Never export password hashes
+    documents = stream_documents(
+        "profiles",
+        filter_query=filter_query,
+        projection={"hashed_password": 0},
+        batch_size=EXPORT_BATCH_SIZE
+    )
+    
+    return _ndjson_response(documents, "profiles.ndjson")
@@ -1,6 +1,8 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Response
+from typing import Any, Dict, List, Optional
 from datetime import datetime
+from pymongo.errors import PyMongoError
+import os
 
 from models import (
     Investment,
@@ -8,32 +10,70 @@ from models import (
     UserProfile,
     UserType,
     BusinessListing,
-    BusinessStatus
+    BusinessStatus,
+    FUNDING_PROGRESS_EXPRESSION,
+    hydrate,
+    hydrate_many
 )
 from auth import get_current_user
-from database import get_database, create_document, list_documents, get_document, update_document
+from realtime import FUNDING_FIELDS, publish_funding_update
+from database import (
+    get_database,
+    create_document,
+    list_documents_page,
+    get_document,
+    get_documents_many,
+    find_and_update_document,
+    NEXT_CURSOR_HEADER
+)
 
 router = APIRouter(prefix="/investments", tags=["investments"])
 
 
-@router.post("/", response_model=Investment)
-async def create_investment(
-    investment_data: InvestmentCreate,
-    current_user: UserProfile = Depends(get_current_user),
-    db=Depends(get_database)
-):
+def _cap_at_target() -> bool:
+    """Whether investments may not take a listing past its funding target"""
+    return os.environ.get("INVESTMENT_CAP_AT_TARGET", "false").lower() in ("1", "true", "yes")
+
+
+def _investable_filter(business_id: str, amount: float) -> Dict[str, Any]:
+    """Match the listing only if it can take an investment of amount"""
+    filter_query = {
+        "_id": business_id,
+        "status": BusinessStatus.ACTIVE.value,
+        "funding_target": {"$gt": 0},
+    }
+    if _cap_at_target():
+        filter_query["$expr"] = {
+            "$lte": [{"$add": [{"$ifNull": ["$funding_raised", 0]}, amount]}, "$funding_target"]
+        }
+    return filter_query
+
+
+def _funding_update(amount: float, investors: int) -> List[Dict[str, Any]]:
     """
-    Create a new investment
+    Pipeline update adding to the listing's totals and recomputing
+    funding_progress from the new total in the same write
     """
-    # Only investors can create investments
-    if current_user.user_type != UserType.INVESTOR and current_user.user_type != UserType.ADMIN:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Only investors can make investments"
-        )
-    
-    # Get the business listing
-    listing = await get_document("business_listings", investment_data.business_id)
+    return [
+        {
+            "$set": {
+                "funding_raised": {"$add": [{"$ifNull": ["$funding_raised", 0]}, amount]},
+                "investor_count": {"$add": [{"$ifNull": ["$investor_count", 0]}, investors]},
+                "updated_at": datetime.utcnow(),
+            }
+        },
+        {"$set": {"funding_progress": FUNDING_PROGRESS_EXPRESSION}},
+    ]
+
+
+async def _raise_not_investable(business_id: str):
+    """Work out why the conditional funding update matched nothing"""
+    listing = await get_document(
+        "business_listings",
+        business_id,
+        projection={"status": 1, "funding_target": 1, "funding_raised": 1},
+        use_cache=False
+    )
     
     if not listing:
         raise HTTPException(
@@ -55,6 +95,51 @@ async def create_investment(
             detail="This business is not open for investments"
         )
     
+    if not _cap_at_target():
+        # Without the cap only the status can have stopped it: the listing
+        # was taken off the market between the write and this read
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Cannot invest in a non-active business"
+        )
+    
+    remaining = listing["funding_target"] - listing.get("funding_raised", 0)
+    raise HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail=f"Investment exceeds the remaining funding target ({max(remaining, 0):g})"
+    )
+
+
+@router.post("/", response_model=Investment)
+async def create_investment(
+    investment_data: InvestmentCreate,
+    current_user: UserProfile = Depends(get_current_user),
+    db=Depends(get_database)
+):
+    """
+    Create a new investment
+    """
+    # Only investors can create investments
+    if current_user.user_type != UserType.INVESTOR and current_user.user_type != UserType.ADMIN:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only investors can make investments"
+        )
+    
+    # Count the investment against the listing in one atomic, conditional
+    # write: it only matches an active listing open for investment (and, with
+    # INVESTMENT_CAP_AT_TARGET, one with room left under its target), so
+    # concurrent investors can't overwrite each other's totals
+    listing = await find_and_update_document(
+        "business_listings",
+        _investable_filter(investment_data.business_id, investment_data.amount),
+        _funding_update(investment_data.amount, 1),
+        projection={field: 1 for field in FUNDING_FIELDS}
+    )
+    
+    if not listing:
+        await _raise_not_investable(investment_data.business_id)
+    
     # Create the investment
     investment = Investment(
         business_id=investment_data.business_id,
@@ -62,63 +147,80 @@ async def create_investment(
         amount=investment_data.amount
     )
     
-    # Insert document
+    # Insert document, handing the amount back to the listing if that fails
     investment_dict = investment.model_dump(by_alias=True)
-    investment_id = await create_document("investments", investment_dict)
+    try:
+        investment_id = await create_document("investments", investment_dict)
+    except PyMongoError:
+        await find_and_update_document(
+            "business_listings",
+            {"_id": investment_data.business_id},
+            _funding_update(-investment_data.amount, -1)
+        )
+        raise
     
     # Update the ID
     investment.id = investment_id
     
-    # Update the business listing with new funding_raised amount
-    new_funding_raised = listing.get("funding_raised", 0) + investment_data.amount
-    new_investor_count = listing.get("investor_count", 0) + 1
-    
-    update_data = {
-        "funding_raised": new_funding_raised,
-        "investor_count": new_investor_count,
-        "updated_at": datetime.utcnow()
-    }
-    
-    await update_document("business_listings", investment_data.business_id, update_data)
+    # Tell anyone watching the listing's raise
+    publish_funding_update(listing)
     
     return investment
 
 
 @router.get("/", response_model=List[Investment])
 async def get_user_investments(
+    response: Response,
+    limit: int = Query(100, ge=1, le=100),
+    cursor: Optional[str] = None,
     current_user: UserProfile = Depends(get_current_user),
     db=Depends(get_database)
 ):
     """
-    Get investments for the current user
+    Get investments for the current user, paged with the X-Next-Cursor header
     """
     # Build filter query
     filter_query = {"investor_id": current_user.id}
     
     # Get investments
-    investments = await list_documents("investments", filter_query=filter_query)
+    investments, next_cursor = await list_documents_page(
+        "investments",
+        filter_query=filter_query,
+        limit=limit,
+        sort_by={"created_at": 1},
+        cursor=cursor
+    )
+    
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
     
-    # For each investment, get the associated business listing
+    # Fetch the associated business listings in one query
+    businesses = await get_documents_many(
+        "business_listings", [investment["business_id"] for investment in investments]
+    )
     for investment in investments:
-        business = await get_document("business_listings", investment["business_id"])
+        business = businesses.get(investment["business_id"])
         if business:
             investment["business"] = business
     
     # Convert to Investment objects
-    return [Investment(**investment) for investment in investments]
+    return hydrate_many(Investment, investments)
 
 
 @router.get("/business/{business_id}", response_model=List[Investment])
 async def get_business_investments(
     business_id: str,
+    response: Response,
+    limit: int = Query(100, ge=1, le=100),
+    cursor: Optional[str] = None,
     current_user: UserProfile = Depends(get_current_user),
     db=Depends(get_database)
 ):
     """
-    Get investments for a specific business
+    Get investments for a specific business, paged with the X-Next-Cursor header
     """
-    # Get the business listing
-    listing = await get_document("business_listings", business_id)
+    # Get the business listing (only the fields the ownership check needs)
+    listing = await get_document("business_listings", business_id, projection={"seller_id": 1})
     
     if not listing:
         raise HTTPException(
@@ -137,10 +239,19 @@ async def get_business_investments(
     filter_query = {"business_id": business_id}
     
     # Get investments
-    investments = await list_documents("investments", filter_query=filter_query)
+    investments, next_cursor = await list_documents_page(
+        "investments",
+        filter_query=filter_query,
+        limit=limit,
+        sort_by={"created_at": 1},
+        cursor=cursor
+    )
+    
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
     
     # Convert to Investment objects
-    return [Investment(**investment) for investment in investments]
+    return hydrate_many(Investment, investments)
 
 
 @router.get("/{investment_id}", response_model=Investment)
@@ -176,4 +287,4 @@ async def get_investment(
     if business:
         investment["business"] = business
     
-    return Investment(**investment)
+    return hydrate(Investment, investment)
@@ -1,6 +1,11 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
-from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Response, UploadFile, File
+from fastapi.responses import StreamingResponse
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 from datetime import datetime
+from pydantic import ValidationError
+import codecs
+import csv
+import json
 
 from models import (
     BusinessListing,
@@ -8,13 +13,47 @@ from models import (
     BusinessListingUpdate,
     UserProfile,
     BusinessStatus,
-    UserType
+    UserType,
+    ListingImportResult,
+    ListingImportRowError,
+    ListingFacets,
+    FacetValueCount,
+    FacetRangeCount,
+    FUNDING_PROGRESS_EXPRESSION,
+    hydrate,
+    hydrate_many
 )
 from auth import get_current_user
-from database import get_database, create_document, list_documents, get_document, update_document, delete_document
+from responses import JSONBytesResponse, encode_json
+from cache import MISSING, query_cache
+from realtime import funding_stream
+from search import SEARCH_MODE_BM25, SEARCH_MODE_TEXT, listing_changed, listing_search, search_mode
+from database import (
+    get_database,
+    create_document,
+    create_documents_many,
+    list_documents,
+    list_documents_page,
+    list_ranked_documents_page,
+    search_documents_page,
+    get_document,
+    update_document_returning,
+    find_and_update_document,
+    delete_document,
+    facet_counts,
+    NEXT_CURSOR_HEADER
+)
 
 router = APIRouter(prefix="/listings", tags=["listings"])
 
+# Bulk import: bytes read from the upload at a time, and rows per insert_many
+IMPORT_CHUNK_SIZE = 64 * 1024
+IMPORT_BATCH_SIZE = 500
+
+# Lower bounds of the revenue and profit bands counted by get_listing_facets
+REVENUE_BANDS = [0, 100000, 250000, 500000, 1000000, 2500000, 5000000, 10000000]
+PROFIT_BANDS = [0, 25000, 50000, 100000, 250000, 500000, 1000000]
+
 
 @router.post("/", response_model=BusinessListing)
 async def create_listing(
@@ -42,6 +81,7 @@ async def create_listing(
     # Insert document
     listing_dict = listing.model_dump(by_alias=True)
     listing_id = await create_document("business_listings", listing_dict)
+    await listing_changed(listing_id, listing_dict)
     
     # Update the ID
     listing.id = listing_id
@@ -49,23 +89,185 @@ async def create_listing(
     return listing
 
 
-@router.get("/", response_model=List[BusinessListing])
-async def get_listings(
-    status: Optional[BusinessStatus] = None,
-    industry: Optional[str] = None,
-    min_revenue: Optional[float] = None,
-    max_revenue: Optional[float] = None,
-    min_profit: Optional[float] = None,
-    max_profit: Optional[float] = None,
-    location: Optional[str] = None,
-    search: Optional[str] = None,
-    skip: int = Query(0, ge=0),
-    limit: int = Query(20, ge=1, le=100),
+async def _read_lines(upload: UploadFile) -> AsyncIterator[str]:
+    """Decode an upload incrementally and yield it line by line"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer = ""
+    
+    while True:
+        chunk = await upload.read(IMPORT_CHUNK_SIZE)
+        if not chunk:
+            break
+        buffer += decoder.decode(chunk)
+        lines = buffer.split("\n")
+        buffer = lines.pop()
+        for line in lines:
+            yield line + "\n"
+    
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer
+
+
+async def _parse_csv(upload: UploadFile) -> AsyncIterator[Tuple[int, Any]]:
+    """
+    Yield (row number, row) for each CSV record after the header row.
+    Quoted fields may span lines; a record is complete once its quotes balance.
+    """
+    header: Optional[List[str]] = None
+    record = ""
+    row_number = 0
+    
+    async for line in _read_lines(upload):
+        record += line
+        if record.count('"') % 2:
+            continue
+        
+        values = next(csv.reader([record]), [])
+        record = ""
+        if not any(value.strip() for value in values):
+            continue
+        
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        
+        row_number += 1
+        # Empty cells mean "not provided" so optional fields fall back to None
+        yield row_number, {
+            name: value
+            for name, value in zip(header, values)
+            if name and value.strip() != ""
+        }
+    
+    if record.strip():
+        row_number += 1
+        yield row_number, "Unterminated quoted field"
+
+
+async def _parse_ndjson(upload: UploadFile) -> AsyncIterator[Tuple[int, Any]]:
+    """Yield (row number, row) for each non-empty NDJSON line"""
+    row_number = 0
+    
+    async for line in _read_lines(upload):
+        if not line.strip():
+            continue
+        
+        row_number += 1
+        try:
+            row = json.loads(line)
+        except ValueError as exc:
+            yield row_number, f"Invalid JSON: {exc}"
+            continue
+        
+        yield row_number, row if isinstance(row, dict) else "Each line must be a JSON object"
+
+
+async def _insert_import_batch(
+    batch: List[Tuple[int, Dict[str, Any]]],
+    result: ListingImportResult
+):
+    """Insert one batch of validated listings and record the outcome per row"""
+    inserted, errors = await create_documents_many(
+        "business_listings", [document for _, document in batch], ordered=False
+    )
+    
+    for index, (row_number, document) in enumerate(batch):
+        if index in inserted:
+            result.inserted += 1
+            result.listing_ids.append(inserted[index])
+            await listing_changed(inserted[index], document)
+        else:
+            result.failed += 1
+            result.errors.append(ListingImportRowError(row=row_number, errors=[errors[index]]))
+
+
+@router.post("/import", response_model=ListingImportResult)
+async def import_listings(
+    file: UploadFile = File(...),
+    file_format: Optional[str] = Query(None, alias="format", pattern="^(csv|ndjson)$"),
+    current_user: UserProfile = Depends(get_current_user),
     db=Depends(get_database)
 ):
     """
-    Get business listings with optional filtering
+    Bulk import business listings from a CSV (with a header row) or NDJSON upload.
+    
+    Rows are parsed as the upload streams in, validated like a single create,
+    and written as draft listings in unordered batches, so one bad row never
+    blocks the others. The result reports every row that wasn't imported.
     """
+    # Only sellers can create listings
+    if current_user.user_type != UserType.SELLER and current_user.user_type != UserType.ADMIN:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only sellers can create business listings"
+        )
+    
+    # Use the explicit format, falling back to the file extension
+    if not file_format:
+        filename = (file.filename or "").lower()
+        if filename.endswith(".csv"):
+            file_format = "csv"
+        elif filename.endswith((".ndjson", ".jsonl")):
+            file_format = "ndjson"
+        else:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Could not detect the file format, pass format=csv or format=ndjson"
+            )
+    
+    rows = _parse_csv(file) if file_format == "csv" else _parse_ndjson(file)
+    
+    result = ListingImportResult()
+    batch: List[Tuple[int, Dict[str, Any]]] = []
+    
+    async for row_number, row in rows:
+        # Parse errors come through as a message instead of a row
+        if isinstance(row, str):
+            result.failed += 1
+            result.errors.append(ListingImportRowError(row=row_number, errors=[row]))
+            continue
+        
+        try:
+            listing_data = BusinessListingCreate.model_validate(row)
+        except ValidationError as exc:
+            result.failed += 1
+            result.errors.append(ListingImportRowError(
+                row=row_number,
+                errors=[
+                    f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}"
+                    for error in exc.errors()
+                ]
+            ))
+            continue
+        
+        listing = BusinessListing(
+            **listing_data.model_dump(),
+            seller_id=current_user.id,
+            status=BusinessStatus.DRAFT
+        )
+        batch.append((row_number, listing.model_dump(by_alias=True)))
+        
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            await _insert_import_batch(batch, result)
+            batch = []
+    
+    if batch:
+        await _insert_import_batch(batch, result)
+    
+    return result
+
+
+def _listing_filter(
+    status: Optional[BusinessStatus],
+    industry: Optional[str],
+    min_revenue: Optional[float],
+    max_revenue: Optional[float],
+    min_profit: Optional[float],
+    max_profit: Optional[float],
+    location: Optional[str]
+) -> Dict[str, Any]:
+    """Build the listing browse filter shared by get_listings and get_listing_facets"""
     # Build filter query
     filter_query = {}
     
@@ -96,28 +298,212 @@ async def get_listings(
     if location:
         filter_query["location"] = {"$regex": location, "$options": "i"}
     
+    return filter_query
+
+
+def _search_mode(search: Optional[str]) -> Optional[str]:
+    """
+    How a search is answered: the weighted text index by default
+    (LISTING_SEARCH_MODE=text), the in-process engine for "bm25" (search.py),
+    or the old substring match for "regex", which has to scan every listing
+    """
+    if not search:
+        return None
+    mode = search_mode()
+    if mode == SEARCH_MODE_BM25 and not listing_search.ready:
+        return SEARCH_MODE_TEXT
+    return mode
+
+
+def _regex_search_clauses(search: str) -> List[Dict[str, Any]]:
+    """Substring match on title, description or industry"""
+    return [
+        {"title": {"$regex": search, "$options": "i"}},
+        {"description": {"$regex": search, "$options": "i"}},
+        {"industry": {"$regex": search, "$options": "i"}},
+    ]
+
+
+@router.get("/", response_model=List[BusinessListing])
+async def get_listings(
+    status: Optional[BusinessStatus] = None,
+    industry: Optional[str] = None,
+    min_revenue: Optional[float] = None,
+    max_revenue: Optional[float] = None,
+    min_profit: Optional[float] = None,
+    max_profit: Optional[float] = None,
+    location: Optional[str] = None,
+    search: Optional[str] = None,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    db=Depends(get_database)
+):
+    """
+    Get business listings with optional filtering.
+    
+    Pass the X-Next-Cursor header of a page back as cursor to get the next one;
+    skip is still honoured for older clients but gets slower the deeper it goes.
+    With search, results come most relevant first; in bm25 mode they end after
+    the best LISTING_SEARCH_MAX_RESULTS matches.
+    """
+    filter_query = _listing_filter(
+        status, industry, min_revenue, max_revenue, min_profit, max_profit, location
+    )
+    mode = _search_mode(search)
+    text_search = mode in (SEARCH_MODE_TEXT, SEARCH_MODE_BM25)
+    
     # Add text search if provided
-    if search:
-        filter_query["$or"] = [
-            {"title": {"$regex": search, "$options": "i"}},
-            {"description": {"$regex": search, "$options": "i"}},
-            {"industry": {"$regex": search, "$options": "i"}},
-        ]
+    if search and not text_search:
+        filter_query["$or"] = _regex_search_clauses(search)
     
-    # Sort by most recently created
+    # Sort by most recently created (text search sorts by relevance instead)
     sort_by = {"created_at": -1}
+    skip = 0 if cursor else skip
     
-    # Get listings
-    listings = await list_documents(
-        "business_listings", 
-        filter_query=filter_query, 
-        skip=skip, 
-        limit=limit,
-        sort_by=sort_by
+    # The same few filter combinations are requested over and over, so serve
+    # repeats of a page from the query cache until the next listing write
+    cache_key = query_cache.key(
+        "business_listings", filter_query, sort_by, limit, cursor, skip, mode, search if text_search else None
     )
+    cached = query_cache.get(cache_key)
+    if cached is MISSING:
+        # Get listings
+        if mode == SEARCH_MODE_BM25:
+            listings, next_cursor = await list_ranked_documents_page(
+                "business_listings",
+                listing_search.search(search),
+                filter_query=filter_query,
+                limit=limit,
+                cursor=cursor,
+                skip=skip,
+                browse=True
+            )
+        elif text_search:
+            listings, next_cursor = await search_documents_page(
+                "business_listings",
+                search,
+                filter_query=filter_query,
+                limit=limit,
+                cursor=cursor,
+                skip=skip,
+                browse=True
+            )
+        else:
+            listings, next_cursor = await list_documents_page(
+                "business_listings", 
+                filter_query=filter_query, 
+                limit=limit,
+                sort_by=sort_by,
+                cursor=cursor,
+                skip=skip,
+                browse=True
+            )
+        
+        # Encode the page straight to JSON bytes
+        cached = (encode_json(List[BusinessListing], hydrate_many(BusinessListing, listings)), next_cursor)
+        query_cache.set(cache_key, cached)
+    
+    body, next_cursor = cached
+    headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None
+    return JSONBytesResponse(content=body, headers=headers)
+
+
+def _value_facet(field: str, limit: int) -> List[Dict[str, Any]]:
+    """Most common values of a field with their counts (ties in value order)"""
+    return [
+        {"$match": {field: {"$nin": [None, ""]}}},
+        {"$group": {"_id": f"${field}", "count": {"$sum": 1}}},
+        {"$sort": {"count": -1, "_id": 1}},
+        {"$limit": limit},
+    ]
+
+
+def _band_facet(field: str, bands: List[float]) -> List[Dict[str, Any]]:
+    """Counts of a numeric field per band (the last band is open-ended)"""
+    return [
+        {"$match": {field: {"$gte": bands[0]}}},
+        {
+            "$bucket": {
+                "groupBy": f"${field}",
+                "boundaries": bands + [float("inf")],
+                "default": "other",
+                "output": {"count": {"$sum": 1}},
+            }
+        },
+    ]
+
+
+def _band_counts(buckets: List[Dict[str, Any]], bands: List[float]) -> List[FacetRangeCount]:
+    """Every band with its count, including empty ones"""
+    counts = {bucket["_id"]: bucket["count"] for bucket in buckets}
+    return [
+        FacetRangeCount(
+            min=lower,
+            max=bands[index + 1] if index + 1 < len(bands) else None,
+            count=counts.get(lower, 0)
+        )
+        for index, lower in enumerate(bands)
+    ]
+
+
+@router.get("/facets", response_model=ListingFacets)
+async def get_listing_facets(
+    status: Optional[BusinessStatus] = None,
+    industry: Optional[str] = None,
+    min_revenue: Optional[float] = None,
+    max_revenue: Optional[float] = None,
+    min_profit: Optional[float] = None,
+    max_profit: Optional[float] = None,
+    location: Optional[str] = None,
+    search: Optional[str] = None,
+    facet_limit: int = Query(20, ge=1, le=100),
+    db=Depends(get_database)
+):
+    """
+    Get counts per industry, location and revenue/profit band for the listings
+    matching the same filters as get_listings, in a single aggregation
+    """
+    filter_query = _listing_filter(
+        status, industry, min_revenue, max_revenue, min_profit, max_profit, location
+    )
+    mode = _search_mode(search)
+    if mode == SEARCH_MODE_BM25:
+        # Counts cover the engine's top LISTING_SEARCH_MAX_RESULTS matches
+        filter_query["_id"] = {"$in": listing_search.search(search)}
+    elif mode == SEARCH_MODE_TEXT:
+        filter_query["$text"] = {"$search": search}
+    elif search:
+        filter_query["$or"] = _regex_search_clauses(search)
+    
+    # Serve repeats from the query cache until the next listing write
+    cache_key = query_cache.key("business_listings", "facets", filter_query, facet_limit)
+    body = query_cache.get(cache_key)
+    if body is MISSING:
+        results = await facet_counts(
+            "business_listings",
+            filter_query,
+            {
+                "total": [{"$count": "count"}],
+                "industry": _value_facet("industry", facet_limit),
+                "location": _value_facet("location", facet_limit),
+                "annual_revenue": _band_facet("annual_revenue", REVENUE_BANDS),
+                "annual_profit": _band_facet("annual_profit", PROFIT_BANDS),
+            },
+            browse=True
+        )
+        
+        facets = ListingFacets(
+            total=results["total"][0]["count"] if results["total"] else 0,
+            industry=[FacetValueCount(value=row["_id"], count=row["count"]) for row in results["industry"]],
+            location=[FacetValueCount(value=row["_id"], count=row["count"]) for row in results["location"]],
+            annual_revenue=_band_counts(results["annual_revenue"], REVENUE_BANDS),
+            annual_profit=_band_counts(results["annual_profit"], PROFIT_BANDS)
+        )
+        body = encode_json(ListingFacets, facets)
+        query_cache.set(cache_key, body)
     
-    # Convert to BusinessListing objects
-    return [BusinessListing(**listing) for listing in listings]
+    return JSONBytesResponse(content=body)
 
 
 @router.get("/featured", response_model=List[BusinessListing])
@@ -131,21 +517,64 @@ async def get_featured_listings(
     # Only show active listings for featured
     filter_query = {"status": BusinessStatus.ACTIVE.value}
     
-    # Sort by funding progress (percentage of target raised)
-    # In a real implementation, you might want to use aggregation to sort by funding_raised/funding_target
-    # For now, just sort by funding_raised
-    sort_by = {"funding_raised": -1}
+    # Sort by funding progress (share of the target raised), kept up to date on
+    # every investment so this is an indexed top-K read
+    sort_by = {"funding_progress": -1, "_id": -1}
+    
+    # Serve repeats from the query cache until the next listing write
+    cache_key = query_cache.key("business_listings", "featured", filter_query, sort_by, limit)
+    body = query_cache.get(cache_key)
+    if body is MISSING:
+        # Get listings
+        listings = await list_documents(
+            "business_listings", 
+            filter_query=filter_query, 
+            limit=limit,
+            sort_by=sort_by,
+            browse=True
+        )
+        
+        # Encode the listings straight to JSON bytes
+        body = encode_json(List[BusinessListing], hydrate_many(BusinessListing, listings))
+        query_cache.set(cache_key, body)
     
-    # Get listings
-    listings = await list_documents(
-        "business_listings", 
-        filter_query=filter_query, 
-        limit=limit,
-        sort_by=sort_by
-    )
+    return JSONBytesResponse(content=body)
+
+
+@router.get("/closing-soon", response_model=List[BusinessListing])
+async def get_closing_soon_listings(
+    limit: int = Query(6, ge=1, le=12),
+    db=Depends(get_database)
+):
+    """
+    Get active listings whose funding round ends soonest and is not yet fully funded
+    """
+    # "Now" is taken to the minute so requests within a minute share a cache
+    # entry; a round that ended earlier in the current minute may still show
+    now = datetime.utcnow().replace(second=0, microsecond=0)
+    filter_query = {
+        "status": BusinessStatus.ACTIVE.value,
+        "funding_end_date": {"$gte": now},
+        "funding_progress": {"$lt": 1}
+    }
+    sort_by = {"funding_end_date": 1, "_id": 1}
+    
+    # Serve repeats from the query cache until the next listing write or the
+    # next minute, whichever comes first
+    cache_key = query_cache.key("business_listings", "closing_soon", limit, now)
+    body = query_cache.get(cache_key)
+    if body is MISSING:
+        listings = await list_documents(
+            "business_listings",
+            filter_query=filter_query,
+            limit=limit,
+            sort_by=sort_by,
+            browse=True
+        )
+        body = encode_json(List[BusinessListing], hydrate_many(BusinessListing, listings))
+        query_cache.set(cache_key, body)
     
-    # Convert to BusinessListing objects
-    return [BusinessListing(**listing) for listing in listings]
+    return JSONBytesResponse(content=body)
 
 
 @router.get("/{listing_id}", response_model=BusinessListing)
@@ -156,7 +585,29 @@ async def get_listing(
     """
     Get a business listing by ID
     """
-    listing = await get_document("business_listings", listing_id)
+    listing = await get_document("business_listings", listing_id, browse=True)
+    
+    if not listing:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Business listing not found"
+        )
+    
+    return hydrate(BusinessListing, listing)
+
+
+@router.get("/{listing_id}/funding")
+async def stream_listing_funding(
+    listing_id: str,
+    db=Depends(get_database)
+):
+    """
+    Stream a listing's funding totals as Server-Sent Events: the current
+    totals, then at most one update per interval while investments come in
+    """
+    # Check the listing exists before starting the stream (the stream reads
+    # the current totals itself, once it is subscribed)
+    listing = await get_document("business_listings", listing_id, projection={"_id": 1})
     
     if not listing:
         raise HTTPException(
@@ -164,7 +615,12 @@ async def get_listing(
             detail="Business listing not found"
         )
     
-    return BusinessListing(**listing)
+    return StreamingResponse(
+        funding_stream(listing_id),
+        media_type="text/event-stream",
+        # Keep proxies from caching or buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 @router.put("/{listing_id}", response_model=BusinessListing)
@@ -177,8 +633,13 @@ async def update_listing(
     """
     Update a business listing
     """
-    # Get existing listing
-    listing = await get_document("business_listings", listing_id)
+    # Get existing listing (only the field the ownership check needs)
+    listing = await get_document(
+        "business_listings",
+        listing_id,
+        projection={"seller_id": 1},
+        use_cache=False
+    )
     
     if not listing:
         raise HTTPException(
@@ -199,19 +660,28 @@ async def update_listing(
     # Add updated_at timestamp
     update_data["updated_at"] = datetime.utcnow()
     
-    # Update the document
-    success = await update_document("business_listings", listing_id, update_data)
+    # Update the document and get it back as updated. Funding progress is
+    # recomputed in the same write from the stored total, so an investment
+    # landing meanwhile can't leave it out of step with a new target
+    # ($literal keeps values such as "$5k profit" from reading as field paths)
+    updated_listing = await find_and_update_document(
+        "business_listings",
+        {"_id": listing_id},
+        [
+            {"$set": {field: {"$literal": value} for field, value in update_data.items()}},
+            {"$set": {"funding_progress": FUNDING_PROGRESS_EXPRESSION}},
+        ]
+    )
     
-    if not success:
+    if not updated_listing:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Failed to update listing"
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Business listing not found"
         )
     
-    # Get the updated listing
-    updated_listing = await get_document("business_listings", listing_id)
+    await listing_changed(listing_id, updated_listing)
     
-    return BusinessListing(**updated_listing)
+    return hydrate(BusinessListing, updated_listing)
 
 
 @router.delete("/{listing_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -223,8 +693,8 @@ async def delete_listing(
     """
     Delete a business listing
     """
-    # Get existing listing
-    listing = await get_document("business_listings", listing_id)
+    # Get existing listing (only the fields the ownership check needs)
+    listing = await get_document("business_listings", listing_id, projection={"seller_id": 1})
     
     if not listing:
         raise HTTPException(
@@ -247,24 +717,38 @@ async def delete_listing(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to delete listing"
         )
+    
+    await listing_changed(listing_id, None)
 
 
 @router.get("/seller/{seller_id}", response_model=List[BusinessListing])
 async def get_seller_listings(
     seller_id: str,
+    response: Response,
+    limit: int = Query(100, ge=1, le=100),
+    cursor: Optional[str] = None,
     db=Depends(get_database)
 ):
     """
-    Get listings for a specific seller
+    Get listings for a specific seller, paged with the X-Next-Cursor header
     """
     # Build filter query
     filter_query = {"seller_id": seller_id}
     
     # Get listings
-    listings = await list_documents("business_listings", filter_query=filter_query)
+    listings, next_cursor = await list_documents_page(
+        "business_listings",
+        filter_query=filter_query,
+        limit=limit,
+        sort_by={"created_at": 1},
+        cursor=cursor
+    )
+    
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
     
     # Convert to BusinessListing objects
-    return [BusinessListing(**listing) for listing in listings]
+    return hydrate_many(BusinessListing, listings)
 
 
 @router.put("/{listing_id}/publish", response_model=BusinessListing)
@@ -276,8 +760,10 @@ async def publish_listing(
     """
     Publish a draft listing
     """
-    # Get existing listing
-    listing = await get_document("business_listings", listing_id)
+    # Get existing listing (only the fields the checks below need)
+    listing = await get_document(
+        "business_listings", listing_id, projection={"seller_id": 1, "status": 1}
+    )
     
     if not listing:
         raise HTTPException(
@@ -305,16 +791,19 @@ async def publish_listing(
         "updated_at": datetime.utcnow()
     }
     
-    # Update the document
-    success = await update_document("business_listings", listing_id, update_data)
+    # Update the document and get it back as updated. The draft check is
+    # repeated in the update so a concurrent publish can't apply twice
+    updated_listing = await update_document_returning(
+        "business_listings",
+        listing_id,
+        update_data,
+        precondition={"status": BusinessStatus.DRAFT.value}
+    )
     
-    if not success:
+    if not updated_listing:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Failed to publish listing"
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Listing is already published"
         )
     
-    # Get the updated listing
-    updated_listing = await get_document("business_listings", listing_id)
-    
-    return BusinessListing(**updated_listing)
+    return hydrate(BusinessListing, updated_listing)
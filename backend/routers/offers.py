@@ -1,6 +1,9 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Response
+from typing import List, Optional
 from datetime import datetime
+from bson import ObjectId
+import asyncio
+import logging
 
 from models import (
     Offer,
@@ -11,10 +14,30 @@ from models import (
     Deal,
     TimelineEvent,
     BusinessStatus,
-    BusinessListing
+    BusinessListing,
+    hydrate,
+    hydrate_many
 )
 from auth import get_current_user
-from database import get_database, create_document, list_documents, get_document, update_document
+from realtime import publish_timeline_event
+from database import (
+    get_database,
+    create_document,
+    append_timeline_event,
+    delete_timeline_event,
+    list_documents,
+    list_documents_page,
+    get_document,
+    get_documents_many,
+    update_document,
+    update_document_returning,
+    update_documents_many,
+    find_and_update_document,
+    delete_document,
+    NEXT_CURSOR_HEADER
+)
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/offers", tags=["offers"])
 
@@ -35,8 +58,10 @@ async def create_offer(
             detail="Only buyers can make offers"
         )
     
-    # Get the business listing
-    listing = await get_document("business_listings", offer_data.business_id)
+    # Get the business listing (only the field the LOI check needs)
+    listing = await get_document(
+        "business_listings", offer_data.business_id, projection={"under_loi": 1}
+    )
     
     if not listing:
         raise HTTPException(
@@ -70,38 +95,62 @@ async def create_offer(
 
 @router.get("/", response_model=List[Offer])
 async def get_user_offers(
+    response: Response,
+    limit: int = Query(100, ge=1, le=100),
+    cursor: Optional[str] = None,
     current_user: UserProfile = Depends(get_current_user),
     db=Depends(get_database)
 ):
     """
-    Get offers for the current user (as buyer)
+    Get offers for the current user (as buyer), paged with the X-Next-Cursor header
     """
     # Build filter query
     filter_query = {"buyer_id": current_user.id}
     
     # Get offers
-    offers = await list_documents("offers", filter_query=filter_query)
+    offers, next_cursor = await list_documents_page(
+        "offers",
+        filter_query=filter_query,
+        limit=limit,
+        sort_by={"created_at": 1},
+        cursor=cursor
+    )
     
-    # For each offer, get the associated business listing
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    
+    # Fetch the associated business listings in one query
+    businesses = await get_documents_many(
+        "business_listings", [offer["business_id"] for offer in offers]
+    )
     for offer in offers:
-        business = await get_document("business_listings", offer["business_id"])
+        business = businesses.get(offer["business_id"])
         if business:
             offer["business"] = business
     
     # Convert to Offer objects
-    return [Offer(**offer) for offer in offers]
+    return hydrate_many(Offer, offers)
 
 
 @router.get("/seller", response_model=List[Offer])
 async def get_seller_offers(
+    response: Response,
+    limit: int = Query(100, ge=1, le=100),
+    cursor: Optional[str] = None,
     current_user: UserProfile = Depends(get_current_user),
     db=Depends(get_database)
 ):
     """
-    Get offers for businesses owned by the current user (as seller)
+    Get offers for businesses owned by the current user (as seller),
+    paged with the X-Next-Cursor header
     """
-    # First, get all business listings owned by the seller
-    seller_listings = await list_documents("business_listings", filter_query={"seller_id": current_user.id})
+    # First, get the IDs of every business listing owned by the seller
+    seller_listings = await list_documents(
+        "business_listings",
+        filter_query={"seller_id": current_user.id},
+        limit=None,
+        projection={"_id": 1}
+    )
     
     if not seller_listings:
         return []
@@ -113,17 +162,28 @@ async def get_seller_offers(
     filter_query = {"business_id": {"$in": business_ids}}
     
     # Get offers
-    offers = await list_documents("offers", filter_query=filter_query)
+    offers, next_cursor = await list_documents_page(
+        "offers",
+        filter_query=filter_query,
+        limit=limit,
+        sort_by={"created_at": 1},
+        cursor=cursor
+    )
     
-    # For each offer, get the associated business listing
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    
+    # Fetch the business listings for this page in one query
+    businesses = await get_documents_many(
+        "business_listings", [offer["business_id"] for offer in offers]
+    )
     for offer in offers:
-        for listing in seller_listings:
-            if listing["_id"] == offer["business_id"]:
-                offer["business"] = listing
-                break
+        business = businesses.get(offer["business_id"])
+        if business:
+            offer["business"] = business
     
     # Convert to Offer objects
-    return [Offer(**offer) for offer in offers]
+    return hydrate_many(Offer, offers)
 
 
 @router.get("/{offer_id}", response_model=Offer)
@@ -144,8 +204,21 @@ async def get_offer(
             detail="Offer not found"
         )
     
-    # Get the business listing
-    business = await get_document("business_listings", offer["business_id"])
+    # Get the business listing, and the other pending offers on it (rejected
+    # below) in the same round trip
+    business, other_offers = await asyncio.gather(
+        get_document("business_listings", offer["business_id"]),
+        list_documents(
+            "offers",
+            filter_query={
+                "business_id": offer["business_id"],
+                "status": DealStatus.PENDING.value,
+                "_id": {"$ne": offer_id}
+            },
+            limit=None,
+            projection={"_id": 1}
+        )
+    )
     
     if not business:
         raise HTTPException(
@@ -165,7 +238,16 @@ async def get_offer(
     # Add the business to the offer
     offer["business"] = business
     
-    return Offer(**offer)
+    return hydrate(Offer, offer)
+
+
+async def _release_listing(business):
+    """Hand back a listing claimed by an acceptance that didn't go through"""
+    await update_document("business_listings", business["_id"], {
+        "under_loi": False,
+        "status": BusinessStatus.ACTIVE.value,
+        "updated_at": datetime.utcnow()
+    })
 
 
 @router.post("/{offer_id}/accept", response_model=Deal)
@@ -177,8 +259,8 @@ async def accept_offer(
     """
     Accept an offer and create a deal
     """
-    # Get the offer
-    offer = await get_document("offers", offer_id)
+    # Get the offer (from the primary, since its status gates the update below)
+    offer = await get_document("offers", offer_id, use_cache=False)
     
     if not offer:
         raise HTTPException(
@@ -186,8 +268,21 @@ async def accept_offer(
             detail="Offer not found"
         )
     
-    # Get the business listing
-    business = await get_document("business_listings", offer["business_id"])
+    # Get the business listing, and the other pending offers on it (rejected
+    # below) in the same round trip
+    business, other_offers = await asyncio.gather(
+        get_document("business_listings", offer["business_id"]),
+        list_documents(
+            "offers",
+            filter_query={
+                "business_id": offer["business_id"],
+                "status": DealStatus.PENDING.value,
+                "_id": {"$ne": offer_id}
+            },
+            limit=None,
+            projection={"_id": 1}
+        )
+    )
     
     if not business:
         raise HTTPException(
@@ -209,57 +304,123 @@ async def accept_offer(
             detail="This offer cannot be accepted"
         )
     
-    # Update the offer status
-    await update_document("offers", offer_id, {
-        "status": DealStatus.ACCEPTED.value,
-        "updated_at": datetime.utcnow()
-    })
+    now = datetime.utcnow()
+    
+    # Claim the listing first: only an active listing not yet under LOI
+    # matches, so of two offers on it accepted at the same time exactly one
+    # goes through
+    updated_business = await find_and_update_document(
+        "business_listings",
+        {
+            "_id": business["_id"],
+            "status": BusinessStatus.ACTIVE.value,
+            "under_loi": {"$ne": True}
+        },
+        {"$set": {
+            "under_loi": True,
+            "status": BusinessStatus.UNDER_LOI.value,
+            "updated_at": now
+        }}
+    )
     
-    # Update the business listing
-    await update_document("business_listings", business["_id"], {
-        "under_loi": True,
-        "status": BusinessStatus.UNDER_LOI.value,
-        "updated_at": datetime.utcnow()
-    })
+    if not updated_business:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="This business is no longer accepting offers"
+        )
+    
+    # Then claim the offer. Only a still-pending offer matches, so an accept
+    # racing a reject (or a withdrawal) can't both win
+    claimed = await find_and_update_document(
+        "offers",
+        {"_id": offer_id, "status": DealStatus.PENDING.value},
+        {"$set": {"status": DealStatus.ACCEPTED.value, "updated_at": now}},
+        projection={"_id": 1}
+    )
     
-    # Create a deal
+    if not claimed:
+        await _release_listing(business)
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="This offer cannot be accepted"
+        )
+    
+    # Create the deal and its first timeline event
     deal = Deal(
+        id=str(ObjectId()),
         business_id=business["_id"],
         seller_id=business["seller_id"],
         buyer_id=offer["buyer_id"],
         offer_id=offer_id,
         status=DealStatus.IN_PROGRESS
     )
-    
-    # Insert document
-    deal_dict = deal.model_dump(by_alias=True)
-    deal_id = await create_document("deals", deal_dict)
-    
-    # Update the ID
-    deal.id = deal_id
-    
-    # Create timeline event
     timeline_event = TimelineEvent(
-        deal_id=deal_id,
+        deal_id=deal.id,
         title="Offer Accepted",
         description=f"Offer of ${offer['offer_amount']:,.2f} was accepted by the seller",
         event_type="offer_accepted"
     )
     
+    deal_dict = deal.model_dump(by_alias=True)
+    deal_dict["_id"] = deal.id
     timeline_event_dict = timeline_event.model_dump(by_alias=True)
-    await create_document("timeline_events", timeline_event_dict)
-    
-    # Get all timeline events
-    timeline_events = await list_documents(
-        "timeline_events", 
-        filter_query={"deal_id": deal_id}
+    # Both IDs are assigned here, so nothing below waits on another write
+    timeline_event_dict["_id"] = ObjectId()
+    timeline_event.id = str(timeline_event_dict["_id"])
+    
+    # With the listing and the offer claimed, write the deal and its first
+    # event and reject the other pending offers on the listing all at once
+    deal_result, event_result, rejected_result = await asyncio.gather(
+        create_document("deals", deal_dict),
+        append_timeline_event(timeline_event_dict),
+        update_documents_many(
+            "offers",
+            {
+                "business_id": business["_id"],
+                "status": DealStatus.PENDING.value,
+                "_id": {"$ne": offer_id}
+            },
+            {"status": DealStatus.REJECTED.value, "updated_at": now},
+            document_ids=[other["_id"] for other in other_offers]
+        ),
+        return_exceptions=True
     )
     
-    # Add the timeline events to the deal
-    deal.timeline_events = [TimelineEvent(**event) for event in timeline_events]
-    
-    # Add the business to the deal
-    deal.business = BusinessListing(**business)
+    if isinstance(deal_result, Exception) or isinstance(event_result, Exception):
+        # Undo whatever went through and hand the offer and the listing back
+        if not isinstance(deal_result, Exception):
+            await delete_document("deals", deal.id)
+        if not isinstance(event_result, Exception):
+            await delete_timeline_event(deal.id, timeline_event.id)
+        if not isinstance(rejected_result, Exception):
+            await update_documents_many(
+                "offers",
+                {
+                    "business_id": business["_id"],
+                    "status": DealStatus.REJECTED.value,
+                    "updated_at": now
+                },
+                {"status": DealStatus.PENDING.value, "updated_at": datetime.utcnow()},
+                document_ids=[other["_id"] for other in other_offers]
+            )
+        await update_document("offers", offer_id, {
+            "status": DealStatus.PENDING.value,
+            "updated_at": datetime.utcnow()
+        })
+        await _release_listing(business)
+        raise deal_result if isinstance(deal_result, Exception) else event_result
+    
+    # The listing claim already stops the other offers being accepted, so if
+    # rejecting them failed the acceptance stands and they are merely left
+    # pending
+    if isinstance(rejected_result, Exception):
+        logger.warning(f"Rejecting the other offers on {business['_id']} failed: {rejected_result}")
+    
+    await publish_timeline_event(timeline_event)
+    
+    # Build the response from what was just written instead of reading it back
+    deal.timeline_events = [timeline_event]
+    deal.business = hydrate(BusinessListing, updated_business)
     
     return deal
 
@@ -273,8 +434,8 @@ async def reject_offer(
     """
     Reject an offer
     """
-    # Get the offer
-    offer = await get_document("offers", offer_id)
+    # Get the offer (from the primary, since its status gates the update below)
+    offer = await get_document("offers", offer_id, use_cache=False)
     
     if not offer:
         raise HTTPException(
@@ -282,8 +443,21 @@ async def reject_offer(
             detail="Offer not found"
         )
     
-    # Get the business listing
-    business = await get_document("business_listings", offer["business_id"])
+    # Get the business listing, and the other pending offers on it (rejected
+    # below) in the same round trip
+    business, other_offers = await asyncio.gather(
+        get_document("business_listings", offer["business_id"]),
+        list_documents(
+            "offers",
+            filter_query={
+                "business_id": offer["business_id"],
+                "status": DealStatus.PENDING.value,
+                "_id": {"$ne": offer_id}
+            },
+            limit=None,
+            projection={"_id": 1}
+        )
+    )
     
     if not business:
         raise HTTPException(
@@ -305,16 +479,21 @@ async def reject_offer(
             detail="This offer cannot be rejected"
         )
     
-    # Update the offer status
-    await update_document("offers", offer_id, {
-        "status": DealStatus.REJECTED.value,
-        "updated_at": datetime.utcnow()
-    })
+    # Update the offer status, provided it is still pending, and get it back
+    updated_offer = await update_document_returning(
+        "offers",
+        offer_id,
+        {"status": DealStatus.REJECTED.value, "updated_at": datetime.utcnow()},
+        precondition={"status": DealStatus.PENDING.value}
+    )
     
-    # Get the updated offer
-    updated_offer = await get_document("offers", offer_id)
+    if not updated_offer:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="This offer cannot be rejected"
+        )
     
     # Add the business to the offer
     updated_offer["business"] = business
     
-    return Offer(**updated_offer)
+    return hydrate(Offer, updated_offer)
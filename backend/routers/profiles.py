@@ -1,9 +1,15 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Response
+from typing import List, Optional
 
-from models import UserProfile, UserProfileUpdate, UserType
+from models import UserProfile, UserProfileUpdate, UserType, hydrate, hydrate_many
 from auth import get_current_user
-from database import get_database, update_document, get_document, list_documents
+from database import (
+    get_database,
+    update_document_returning,
+    get_document,
+    list_documents_page,
+    NEXT_CURSOR_HEADER
+)
 
 router = APIRouter(prefix="/profiles", tags=["profiles"])
 
@@ -16,16 +22,8 @@ async def get_current_user_profile(
     """
     Get the current user's profile
     """
-    # Get fresh user data from database
-    user = await get_document("profiles", current_user.id)
-    
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="User not found"
-        )
-    
-    return UserProfile(**user)
+    # The principal is already built from the stored profile
+    return current_user
 
 
 @router.put("/me", response_model=UserProfile)
@@ -37,38 +35,26 @@ async def update_current_user_profile(
     """
     Update the current user's profile
     """
-    # Get current user from database
-    user = await get_document("profiles", current_user.id)
-    
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="User not found"
-        )
-    
     # Update the profile
     update_data = profile_data.model_dump(exclude_unset=True)
     
     # Don't allow changing user type once set
-    if "user_type" in update_data and user.get("user_type") and user.get("completed_onboarding"):
+    if "user_type" in update_data and current_user.user_type and current_user.completed_onboarding:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Cannot change user type after onboarding completion"
         )
     
-    # Update document
-    success = await update_document("profiles", current_user.id, update_data)
+    # Update document and get it back as updated
+    updated_user = await update_document_returning("profiles", current_user.id, update_data)
     
-    if not success:
+    if not updated_user:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Failed to update profile"
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found"
         )
     
-    # Get the updated profile
-    updated_user = await get_document("profiles", current_user.id)
-    
-    return UserProfile(**updated_user)
+    return hydrate(UserProfile, updated_user)
 
 
 @router.put("/me/complete-onboarding", response_model=UserProfile)
@@ -79,17 +65,8 @@ async def complete_onboarding(
     """
     Mark a user's onboarding as completed
     """
-    # Get current user from database
-    user = await get_document("profiles", current_user.id)
-    
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="User not found"
-        )
-    
     # Check if user has a user_type set
-    if not user.get("user_type"):
+    if not current_user.user_type:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="User type must be set before completing onboarding"
@@ -97,18 +74,15 @@ async def complete_onboarding(
     
     # Update document
     update_data = {"completed_onboarding": True}
-    success = await update_document("profiles", current_user.id, update_data)
+    updated_user = await update_document_returning("profiles", current_user.id, update_data)
     
-    if not success:
+    if not updated_user:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Failed to complete onboarding"
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found"
         )
     
-    # Get the updated profile
-    updated_user = await get_document("profiles", current_user.id)
-    
-    return UserProfile(**updated_user)
+    return hydrate(UserProfile, updated_user)
 
 
 @router.get("/{user_id}", response_model=UserProfile)
@@ -129,17 +103,20 @@ async def get_user_profile(
             detail="User not found"
         )
     
-    return UserProfile(**user)
+    return hydrate(UserProfile, user)
 
 
 @router.get("/type/{user_type}", response_model=List[UserProfile])
 async def get_users_by_type(
     user_type: UserType,
+    response: Response,
+    limit: int = Query(100, ge=1, le=100),
+    cursor: Optional[str] = None,
     current_user: UserProfile = Depends(get_current_user),
     db=Depends(get_database)
 ):
     """
-    Get users by type (admin only)
+    Get users by type (admin only), paged with the X-Next-Cursor header
     """
     # Only admin can access this endpoint
     if current_user.user_type != UserType.ADMIN:
@@ -149,6 +126,15 @@ async def get_users_by_type(
         )
     
     # Get users by type
-    users = await list_documents("profiles", filter_query={"user_type": user_type.value})
-    
-    return [UserProfile(**user) for user in users]
+    users, next_cursor = await list_documents_page(
+        "profiles",
+        filter_query={"user_type": user_type.value},
+        limit=limit,
+        sort_by={"created_at": 1},
+        cursor=cursor
+    )
+    
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    
+    return hydrate_many(UserProfile, users)
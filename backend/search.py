@@ -0,0 +1,390 @@
+"""
+In-process full-text search over business listings.
+
+ListingSearchEngine keeps an inverted index of listing title, industry,
+location and description in memory and ranks matches with BM25 (fields are
+weighted by scaling their term frequencies). Query terms are also matched
+within one edit (typos) and the last term by prefix (search-as-you-type), at
+a discount.
+
+Postings are compact typed arrays of internal document numbers and weighted
+term frequencies. Documents are numbered in insertion order, so postings stay
+sorted by appending; an update re-adds the listing under a new number and
+tombstones the old one, and the index is compacted once tombstones outnumber
+live documents.
+
+The index is built from business_listings at startup when
+LISTING_SEARCH_MODE=bm25 and kept current by the listing create, import,
+update and delete endpoints. Other workers are told over the cache bus and
+re-read the listing; a worker whose bus subscription drops rebuilds its index,
+since it may have missed some. Search only ranks IDs; the listing filters and the
+documents themselves still come from MongoDB (database.list_ranked_documents_page).
+
+Only the best LISTING_SEARCH_MAX_RESULTS matches are ranked (default 1000):
+results, including the pages a cursor walks through and the facet counts,
+end there.
+"""
+from array import array
+from bisect import bisect_left, insort
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+import asyncio
+import heapq
+import logging
+import math
+import os
+import re
+import uuid
+
+from pymongo.errors import PyMongoError
+
+from cache import cache_bus, query_cache
+from database import get_document, stream_documents
+
+logger = logging.getLogger(__name__)
+
+# Searchable listing fields and how much a term counts in each
+FIELD_WEIGHTS = {"title": 3.0, "industry": 2.0, "location": 1.5, "description": 1.0}
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# Score multipliers for expanded query terms
+PREFIX_WEIGHT = 0.8
+FUZZY_WEIGHT = 0.6
+
+# Shortest query terms expanded by prefix and by edit distance
+MIN_PREFIX_LENGTH = 2
+MIN_FUZZY_LENGTH = 4
+
+# Most expansions considered per query term
+MAX_EXPANSIONS = 50
+
+# Most matches a search returns (LISTING_SEARCH_MAX_RESULTS)
+DEFAULT_MAX_RESULTS = 1000
+
+_TOKEN_RE = re.compile(r"[^\W_]+")
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Split text into lowercase word tokens"""
+    if not text:
+        return []
+    return _TOKEN_RE.findall(text.lower())
+
+
+def _deletes(term: str) -> Set[str]:
+    """Every string one deletion away from term"""
+    return {term[:i] + term[i + 1:] for i in range(len(term))}
+
+
+def _within_one_edit(a: str, b: str) -> bool:
+    """Whether a and b differ by at most one insertion, deletion, substitution or transposition"""
+    if a == b:
+        return True
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) == len(b):
+        diffs = [i for i in range(len(a)) if a[i] != b[i]]
+        if len(diffs) == 1:
+            return True
+        return (
+            len(diffs) == 2
+            and diffs[1] == diffs[0] + 1
+            and a[diffs[0]] == b[diffs[1]]
+            and a[diffs[1]] == b[diffs[0]]
+        )
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    return a[i:] == b[i + 1:]
+
+
+class ListingSearchEngine:
+    """
+    BM25 inverted index over listings, updated incrementally
+    """
+
+    def __init__(self):
+        self.ready = False
+        self._reset_index()
+
+    def _reset_index(self) -> None:
+        # term -> (document numbers, weighted term frequencies)
+        self._postings: Dict[str, Tuple[array, array]] = {}
+        # term -> live documents containing it
+        self._df: Dict[str, int] = {}
+        # Sorted vocabulary for prefix lookups, and deletion variants for typos
+        self._vocabulary: List[str] = []
+        self._variants: Dict[str, Set[str]] = {}
+        # Per document number: listing ID (None once tombstoned), length, terms
+        self._ids: List[Optional[str]] = []
+        self._lengths = array("f")
+        self._terms: List[Tuple[str, ...]] = []
+        self._numbers: Dict[str, int] = {}
+        self._total_length = 0.0
+        self._dead = 0
+
+    def __len__(self) -> int:
+        return len(self._numbers)
+
+    # Indexing
+
+    def _add_term(self, term: str) -> None:
+        """Register a term the index hasn't seen before"""
+        self._postings[term] = (array("I"), array("f"))
+        self._df[term] = 0
+        insort(self._vocabulary, term)
+        for variant in _deletes(term) | {term}:
+            self._variants.setdefault(variant, set()).add(term)
+
+    def add(self, listing_id: str, document: Dict[str, Any]) -> None:
+        """
+        Index (or re-index) a listing from its searchable fields
+        """
+        self.remove(listing_id)
+
+        frequencies: Dict[str, float] = {}
+        for field, weight in FIELD_WEIGHTS.items():
+            for token in tokenize(document.get(field)):
+                frequencies[token] = frequencies.get(token, 0.0) + weight
+
+        number = len(self._ids)
+        length = sum(frequencies.values())
+        self._ids.append(listing_id)
+        self._lengths.append(length)
+        self._terms.append(tuple(frequencies))
+        self._numbers[listing_id] = number
+        self._total_length += length
+
+        for term, frequency in frequencies.items():
+            if term not in self._postings:
+                self._add_term(term)
+            numbers, weights = self._postings[term]
+            numbers.append(number)
+            weights.append(frequency)
+            self._df[term] += 1
+
+    def remove(self, listing_id: str) -> None:
+        """
+        Drop a listing from the index (a no-op if it isn't indexed)
+        """
+        number = self._numbers.pop(listing_id, None)
+        if number is None:
+            return
+        self._ids[number] = None
+        self._total_length -= self._lengths[number]
+        for term in self._terms[number]:
+            self._df[term] -= 1
+        self._terms[number] = ()
+        self._dead += 1
+
+        if self._dead > max(1000, len(self._numbers)):
+            self.compact()
+
+    def compact(self) -> None:
+        """
+        Renumber the live documents and drop tombstones and unused terms
+        """
+        renumber = array("i", [-1]) * len(self._ids)
+        ids, lengths, terms = [], array("f"), []
+        for number, listing_id in enumerate(self._ids):
+            if listing_id is not None:
+                renumber[number] = len(ids)
+                ids.append(listing_id)
+                lengths.append(self._lengths[number])
+                terms.append(self._terms[number])
+
+        postings = {}
+        for term, (numbers, weights) in self._postings.items():
+            if not self._df.get(term):
+                continue
+            new_numbers, new_weights = array("I"), array("f")
+            for number, weight in zip(numbers, weights):
+                if renumber[number] >= 0:
+                    new_numbers.append(renumber[number])
+                    new_weights.append(weight)
+            postings[term] = (new_numbers, new_weights)
+
+        self._postings = postings
+        self._df = {term: self._df[term] for term in postings}
+        self._vocabulary = sorted(postings)
+        self._variants = {}
+        for term in postings:
+            for variant in _deletes(term) | {term}:
+                self._variants.setdefault(variant, set()).add(term)
+        self._ids, self._lengths, self._terms = ids, lengths, terms
+        self._numbers = {listing_id: number for number, listing_id in enumerate(ids)}
+        self._dead = 0
+
+    # Searching
+
+    def _expand(self, token: str, prefix: bool) -> Dict[str, float]:
+        """Index terms matching a query token, with the weight each counts for"""
+        expansions: Dict[str, float] = {}
+        if self._df.get(token):
+            expansions[token] = 1.0
+
+        if prefix and len(token) >= MIN_PREFIX_LENGTH:
+            position = bisect_left(self._vocabulary, token)
+            found = 0
+            while position < len(self._vocabulary) and found < MAX_EXPANSIONS:
+                term = self._vocabulary[position]
+                if not term.startswith(token):
+                    break
+                if term not in expansions and self._df.get(term):
+                    expansions[term] = PREFIX_WEIGHT
+                    found += 1
+                position += 1
+
+        if len(token) >= MIN_FUZZY_LENGTH:
+            candidates: Set[str] = set()
+            for variant in _deletes(token) | {token}:
+                candidates |= self._variants.get(variant, set())
+            for term in sorted(candidates)[:MAX_EXPANSIONS]:
+                if term not in expansions and self._df.get(term) and _within_one_edit(token, term):
+                    expansions[term] = FUZZY_WEIGHT
+
+        return expansions
+
+    def search(self, query: str, limit: Optional[int] = None) -> List[str]:
+        """
+        Listing IDs matching query, best first (most recently indexed first on
+        ties), at most limit of them (LISTING_SEARCH_MAX_RESULTS by default)
+        """
+        if limit is None:
+            limit = max_search_results()
+        tokens = list(dict.fromkeys(tokenize(query)))
+        live = len(self._numbers)
+        if not tokens or not live:
+            return []
+        average_length = self._total_length / live or 1.0
+        # BM25 length normalization is K1 * (1 - B + B * length / average_length)
+        norm_base = K1 * (1 - B)
+        norm_scale = K1 * B / average_length
+        ids, lengths = self._ids, self._lengths
+
+        scores: Dict[int, float] = {}
+        for position, token in enumerate(tokens):
+            # A document scores each query token once, by its best matching term
+            token_scores: Dict[int, float] = {}
+            for term, weight in self._expand(token, prefix=position == len(tokens) - 1).items():
+                df = self._df[term]
+                term_weight = weight * math.log(1 + (live - df + 0.5) / (df + 0.5)) * (K1 + 1)
+                numbers, frequencies = self._postings[term]
+                for number, frequency in zip(numbers, frequencies):
+                    if ids[number] is None:
+                        continue
+                    norm = norm_base + norm_scale * lengths[number]
+                    score = term_weight * frequency / (frequency + norm)
+                    if score > token_scores.get(number, 0.0):
+                        token_scores[number] = score
+            for number, score in token_scores.items():
+                scores[number] = scores.get(number, 0.0) + score
+
+        best = heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], item[0]))
+        return [self._ids[number] for number, _ in best]
+
+    def build(self, documents: Iterable[Tuple[str, Dict[str, Any]]]) -> None:
+        """
+        Replace the index with the given (listing ID, document) pairs
+        """
+        self._reset_index()
+        for listing_id, document in documents:
+            self.add(listing_id, document)
+        self.ready = True
+
+
+# Listing search modes (LISTING_SEARCH_MODE)
+SEARCH_MODE_TEXT = "text"
+SEARCH_MODE_REGEX = "regex"
+SEARCH_MODE_BM25 = "bm25"
+
+# Projection of the fields the engine indexes
+_SEARCH_PROJECTION = {field: 1 for field in FIELD_WEIGHTS}
+
+# Identifies this worker's own messages on the cache bus
+_WORKER_ID = uuid.uuid4().hex
+
+listing_search = ListingSearchEngine()
+
+
+def max_search_results() -> int:
+    """The most matches a listing search returns"""
+    return int(os.environ.get("LISTING_SEARCH_MAX_RESULTS", DEFAULT_MAX_RESULTS))
+
+
+def search_mode() -> str:
+    """The configured listing search mode"""
+    return os.environ.get("LISTING_SEARCH_MODE", SEARCH_MODE_TEXT)
+
+
+async def _refresh_listing(listing_id: str) -> None:
+    """Re-read a listing another worker changed and re-index it"""
+    document = await get_document(
+        "business_listings", listing_id, projection=_SEARCH_PROJECTION, use_cache=False
+    )
+    if document is None:
+        listing_search.remove(listing_id)
+    else:
+        listing_search.add(listing_id, document)
+    # Searches cached since the write was announced ranked with the old index
+    query_cache.bump_local("business_listings")
+
+
+def _on_listing_changed(payload: str) -> None:
+    worker_id, _, listing_id = payload.partition(" ")
+    if worker_id != _WORKER_ID and listing_search.ready:
+        asyncio.get_running_loop().create_task(_refresh_listing(listing_id))
+
+
+async def listing_changed(listing_id: str, document: Optional[Dict[str, Any]]) -> None:
+    """
+    Update the index after a listing write (document None for a delete)
+    and tell the other workers to do the same
+    """
+    if not listing_search.ready:
+        return
+    if document is None:
+        listing_search.remove(listing_id)
+    else:
+        listing_search.add(listing_id, document)
+    # The write already moved the query cache to a new generation; searches
+    # cached under it before this point ranked with the old index
+    await query_cache.bump("business_listings")
+    await cache_bus.publish("search", f"{_WORKER_ID} {listing_id}")
+
+
+async def build_search_index() -> None:
+    """
+    Build the listing index at startup when LISTING_SEARCH_MODE is bm25
+    """
+    if search_mode() != SEARCH_MODE_BM25:
+        return
+    documents = []
+    async for document in stream_documents("business_listings", projection=_SEARCH_PROJECTION):
+        documents.append((document["id"], document))
+    listing_search.build(documents)
+    logger.info(f"Listing search index built: {len(listing_search)} listings")
+
+
+async def _rebuild_search_index() -> None:
+    """Rebuild the index from MongoDB and drop searches ranked with the old one"""
+    try:
+        await build_search_index()
+    except PyMongoError as exc:
+        logger.warning(f"Listing search index rebuild failed: {exc}")
+        return
+    query_cache.bump_local("business_listings")
+
+
+def _on_bus_reset() -> None:
+    # Updates may have been missed while the bus was disconnected; nothing
+    # to do when the index is not in use or the bus is shutting down
+    if listing_search.ready and cache_bus.redis is not None:
+        asyncio.get_running_loop().create_task(_rebuild_search_index())
+
+
+cache_bus.register("search", _on_listing_changed, _on_bus_reset)
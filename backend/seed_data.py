@@ -183,6 +183,7 @@ async def create_listings(seller_id):
             "updated_at": datetime.utcnow(),
             "funding_target": funding_target,
             "funding_raised": funding_raised,
+            "funding_progress": funding_raised / funding_target if funding_target else 0,
             "under_loi": status == "under_loi",
             "investor_count": random.randint(3, 20) if funding_raised > 0 else 0,
             "funding_end_date": datetime.utcnow() + timedelta(days=random.randint(10, 90)) if funding_target else None,
@@ -1,4 +1,6 @@
-from fastapi import FastAPI, APIRouter
+from fastapi import FastAPI, APIRouter, Request, status
+from fastapi.responses import JSONResponse, ORJSONResponse
+from pymongo.errors import ExecutionTimeout, WaitQueueTimeoutError
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 import os
@@ -10,16 +12,30 @@ import sys
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 # Import routers
-from routers import auth, listings, investments, offers, deals, profiles
+from routers import auth, listings, investments, offers, deals, profiles, exports
 
-# Import database functions
-from database import connect_to_mongo, close_mongo_connection
+# Import cache and database functions
+from cache import connect_cache, close_cache
+from auth import shutdown_password_hashing
+from search import build_search_index
+from database import (
+    connect_to_mongo,
+    close_mongo_connection,
+    ensure_indexes,
+    InvalidCursorError,
+    NEXT_CURSOR_HEADER
+)
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # Create the main app without a prefix
-app = FastAPI(title="SeedSMB API", description="API for the SeedSMB marketplace")
+# Render responses with orjson rather than the standard json module
+app = FastAPI(
+    title="SeedSMB API",
+    description="API for the SeedSMB marketplace",
+    default_response_class=ORJSONResponse
+)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -31,6 +47,7 @@ api_router.include_router(listings.router)
 api_router.include_router(investments.router)
 api_router.include_router(offers.router)
 api_router.include_router(deals.router)
+api_router.include_router(exports.router)
 
 # Add a root endpoint for API health check
 @api_router.get("/")
@@ -40,6 +57,25 @@ async def root():
 # Include the router in the main app
 app.include_router(api_router)
 
+# Malformed pagination cursors are a client error
+@app.exception_handler(InvalidCursorError)
+async def invalid_cursor_handler(request: Request, exc: InvalidCursorError):
+    return JSONResponse(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        content={"detail": str(exc)}
+    )
+
+# Queries that hit MONGO_MAX_TIME_MS, or requests that waited too long for a
+# pooled connection, mean the database is overloaded rather than a server bug
+@app.exception_handler(ExecutionTimeout)
+@app.exception_handler(WaitQueueTimeoutError)
+async def database_timeout_handler(request: Request, exc: Exception):
+    logger.warning(f"Database timeout on {request.url.path}: {exc}")
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "The database is busy, please retry"}
+    )
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -47,6 +83,7 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
 # Configure logging
@@ -60,8 +97,15 @@ logger = logging.getLogger(__name__)
 async def startup_db_client():
     await connect_to_mongo()
     logger.info("Connected to MongoDB")
+    await ensure_indexes()
+    logger.info("MongoDB indexes verified")
+    await connect_cache()
+    logger.info("Entity cache ready")
+    await build_search_index()
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await close_cache()
     await close_mongo_connection()
+    shutdown_password_hashing()
     logger.info("Disconnected from MongoDB")
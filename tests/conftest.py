@@ -0,0 +1,199 @@
+"""
+Shared test setup.
+
+The backend runs against an in-memory mongomock-motor database (and fakeredis
+where a test needs Redis), so no servers are required. mongomock differs from
+the real driver in a few ways the backend relies on, patched here:
+
+- the driver decodes ObjectIds to strings on read (codec.CODEC_OPTIONS);
+  mongomock ignores type registries, so replies are decoded at the motor
+  boundary instead (except for raw_db, which stands in for a plain
+  connection);
+- $lookup with let/pipeline is emulated for the $expr equality joins the
+  backend uses;
+- every collection call yields to the event loop first, as a network round
+  trip would, so concurrent requests interleave the way they do in production.
+"""
+import asyncio
+import os
+import sys
+
+import bson
+import fakeredis
+import pytest
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend")
+sys.path.insert(0, BACKEND_DIR)
+
+os.environ.setdefault("LISTING_SEARCH_MODE", "regex")  # mongomock has no $text
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+
+import httpx
+import mongomock_motor
+from fastapi.testclient import TestClient
+from mongomock import aggregate
+
+import cache
+import database
+import server
+from cache import entity_cache, query_cache
+from codec import CODEC_OPTIONS
+
+
+# Off for tests of code that connects without the backend's codec (migrations)
+_decode_replies = True
+
+
+def _decode(document):
+    if isinstance(document, dict) and _decode_replies:
+        return bson.decode(bson.encode(document), codec_options=CODEC_OPTIONS)
+    return document
+
+
+def _collection_method(method, decode):
+    async def wrapper(self, *args, **kwargs):
+        await asyncio.sleep(0)
+        result = await method(self, *args, **kwargs)
+        return _decode(result) if decode else result
+    return wrapper
+
+
+def _cursor_method(method, many):
+    async def wrapper(self, *args, **kwargs):
+        await asyncio.sleep(0)
+        result = await method(self, *args, **kwargs)
+        return [_decode(document) for document in result] if many else _decode(result)
+    return wrapper
+
+
+_DECODED_METHODS = {"find_one", "find_one_and_update", "find_one_and_replace", "find_one_and_delete"}
+for _name in (
+    "bulk_write", "count_documents", "delete_many", "delete_one", "distinct",
+    "find_one", "find_one_and_delete", "find_one_and_replace", "find_one_and_update",
+    "insert_many", "insert_one", "replace_one", "update_many", "update_one",
+):
+    setattr(
+        mongomock_motor.AsyncMongoMockCollection,
+        _name,
+        _collection_method(getattr(mongomock_motor.AsyncMongoMockCollection, _name), _name in _DECODED_METHODS),
+    )
+
+for _cursor in (
+    mongomock_motor.AsyncCursor,
+    mongomock_motor.AsyncCommandCursor,
+    mongomock_motor.AsyncLatentCommandCursor,
+):
+    _cursor.next = _cursor_method(_cursor.next, many=False)
+    _cursor.__anext__ = _cursor.next
+    _cursor.to_list = _cursor_method(_cursor.to_list, many=True)
+
+
+_original_lookup = aggregate._handle_lookup_stage
+
+
+def _lookup(in_collection, db, options):
+    """$lookup with let/pipeline, for pipelines starting with $expr equality matches"""
+    if "pipeline" not in options:
+        return _original_lookup(in_collection, db, options)
+    foreign = db.get_collection(options["from"])
+    for document in in_collection:
+        variables = {
+            name: aggregate.helpers.get_value_by_dot(document, value[1:])
+            for name, value in options.get("let", {}).items()
+        }
+        query, pipeline = {}, []
+        for stage in options["pipeline"]:
+            match = stage.get("$match")
+            if isinstance(match, dict) and "$eq" in match.get("$expr", {}):
+                field, variable = match["$expr"]["$eq"]
+                query[field[1:]] = variables[variable[2:]]
+            else:
+                pipeline.append(stage)
+        joined = list(foreign.find(query))
+        if pipeline:
+            joined = list(aggregate.process_pipeline(joined, db, pipeline, None))
+        document[options["as"]] = joined
+    return in_collection
+
+
+aggregate._handle_lookup_stage = _lookup
+aggregate._PIPELINE_HANDLERS["$lookup"] = _lookup
+
+
+@pytest.fixture
+def db():
+    """A fresh in-memory database behind the backend, with empty caches"""
+    client = mongomock_motor.AsyncMongoMockClient()
+    database.client = client
+    database.db = client["seedsmb"]
+    entity_cache.reset()
+    query_cache.reset()
+    yield database.db
+    entity_cache.reset()
+    query_cache.reset()
+    database.client = None
+    database.db = None
+
+
+@pytest.fixture
+def raw_db(monkeypatch):
+    """A fresh in-memory database as a plain driver connection sees it (no codec)"""
+    monkeypatch.setitem(globals(), "_decode_replies", False)
+    return mongomock_motor.AsyncMongoMockClient()["seedsmb"]
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    """Point every CacheBus at one shared in-memory Redis server"""
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(
+        cache.aioredis,
+        "from_url",
+        lambda url, **kwargs: fakeredis.aioredis.FakeRedis(server=server, **kwargs),
+    )
+
+
+@pytest.fixture
+def client(db):
+    """Synchronous API client (startup hooks don't run, so nothing connects out)"""
+    return TestClient(server.app)
+
+
+@pytest.fixture
+def async_client(db):
+    """Factory for an async API client, for tests that issue concurrent requests"""
+    def make():
+        return httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://test")
+    return make
+
+
+def register(client, email, user_type="BUYER", password="password123"):
+    """Register a user and return the Authorization header for them"""
+    response = client.post(
+        "/api/auth/register",
+        json={"email": email, "password": password, "user_type": user_type},
+    )
+    assert response.status_code == 201, response.text
+    response = client.post("/api/auth/login", json={"email": email, "password": password})
+    assert response.status_code == 200, response.text
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def create_active_listing(client, headers, **fields):
+    """Create a listing as the given seller and publish it; returns it"""
+    data = {
+        "title": "Corner Coffee",
+        "industry": "Food & Beverage",
+        "location": "Austin, TX",
+        "description": "Espresso bar downtown",
+        "annual_revenue": 300000,
+        "annual_profit": 60000,
+        "funding_target": 50000,
+        **fields,
+    }
+    response = client.post("/api/listings/", headers=headers, json=data)
+    assert response.status_code == 200, response.text
+    listing = response.json()
+    response = client.put(f"/api/listings/{listing['id']}/publish", headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()
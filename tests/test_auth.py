@@ -0,0 +1,158 @@
+import asyncio
+
+import mongomock_motor
+import pytest
+from pymongo.errors import PyMongoError
+
+import auth
+import database
+from cache import entity_cache
+from routers import auth as auth_router
+from tests.conftest import register
+
+
+@pytest.fixture
+def profile_reads(monkeypatch):
+    """Counts find_one calls that reach the profiles collection"""
+    reads = []
+    find_one = mongomock_motor.AsyncMongoMockCollection.find_one
+
+    async def counting_find_one(self, *args, **kwargs):
+        if self.name == "profiles":
+            reads.append(args)
+        return await find_one(self, *args, **kwargs)
+
+    monkeypatch.setattr(mongomock_motor.AsyncMongoMockCollection, "find_one", counting_find_one)
+    return reads
+
+
+def test_repeat_authentication_is_served_from_the_cache(client, profile_reads):
+    headers = register(client, "buyer@example.com", "BUYER")
+
+    assert client.get("/api/auth/me", headers=headers).status_code == 200
+    reads_after_first = len(profile_reads)
+    for _ in range(3):
+        response = client.get("/api/auth/me", headers=headers)
+        assert response.status_code == 200
+        assert "hashed_password" not in response.json()
+
+    assert len(profile_reads) == reads_after_first
+
+
+def test_principal_sees_profile_changes_immediately(client):
+    headers = register(client, "buyer@example.com", "BUYER")
+    assert client.get("/api/auth/me", headers=headers).json()["user_type"] == "BUYER"
+
+    response = client.put("/api/profiles/me", headers=headers, json={"user_type": "INVESTOR"})
+    assert response.status_code == 200, response.text
+
+    assert client.get("/api/auth/me", headers=headers).json()["user_type"] == "INVESTOR"
+    # The role check uses the new role: an investor gets past it to the listing lookup
+    response = client.post(
+        "/api/investments/",
+        headers=headers,
+        json={"business_id": "64b000000000000000000000", "amount": 10},
+    )
+    assert response.status_code == 404
+
+
+def test_token_for_missing_user_is_rejected(client):
+    from auth import create_access_token
+
+    token = create_access_token({"sub": "64b000000000000000000000", "email": "ghost@example.com"})
+
+    response = client.get("/api/auth/me", headers={"Authorization": f"Bearer {token}"})
+
+    assert response.status_code == 401
+
+
+def test_deal_stream_accepts_a_stream_token_in_the_query(client):
+    headers = register(client, "buyer@example.com", "BUYER")
+    events_url = "/api/deals/64b000000000000000000000/events"
+
+    response = client.post("/api/auth/stream-token", headers=headers)
+    assert response.status_code == 200, response.text
+    stream_token = response.json()["token"]
+
+    # Authenticated either way, so the (missing) deal is looked up
+    assert client.get(events_url, params={"token": stream_token}).status_code == 404
+    assert client.get(events_url, headers=headers).status_code == 404
+    assert client.get(events_url).status_code == 401
+    # A stream token is good for nothing else
+    stream_headers = {"Authorization": f"Bearer {stream_token}"}
+    assert client.get("/api/auth/me", headers=stream_headers).status_code == 401
+
+
+def test_expired_stream_token_is_rejected(client, monkeypatch):
+    headers = register(client, "buyer@example.com", "BUYER")
+    monkeypatch.setenv("STREAM_TOKEN_EXPIRE_SECONDS", "-1")
+    stream_token = client.post("/api/auth/stream-token", headers=headers).json()["token"]
+
+    response = client.get("/api/deals/64b000000000000000000000/events", params={"token": stream_token})
+
+    assert response.status_code == 401
+
+
+@pytest.fixture
+def raised_bcrypt_cost(monkeypatch):
+    """Raise BCRYPT_ROUNDS after the test has registered its users"""
+    def raise_cost():
+        monkeypatch.setenv("BCRYPT_ROUNDS", "5")
+        auth.password_context.cache_clear()
+    yield raise_cost
+    auth.password_context.cache_clear()
+
+
+def test_login_succeeds_when_storing_the_rehash_fails(client, raised_bcrypt_cost, monkeypatch):
+    register(client, "buyer@example.com", "BUYER")
+    raised_bcrypt_cost()
+
+    async def failing_update_document(collection, document_id, data):
+        raise PyMongoError("write failed")
+
+    monkeypatch.setattr(auth_router, "update_document", failing_update_document)
+
+    response = client.post("/api/auth/login", json={"email": "buyer@example.com", "password": "password123"})
+
+    assert response.status_code == 200, response.text
+
+
+def test_unknown_email_costs_a_bcrypt_check(client, monkeypatch):
+    checks = []
+    verify_dummy_password = auth._verify_dummy_password
+
+    def counting_verify(password):
+        checks.append(password)
+        return verify_dummy_password(password)
+
+    monkeypatch.setattr(auth, "_verify_dummy_password", counting_verify)
+
+    response = client.post("/api/auth/login", json={"email": "nobody@example.com", "password": "password123"})
+
+    assert response.status_code == 401
+    assert checks == ["password123"]
+
+
+def test_password_hashes_are_kept_out_of_the_entity_cache(async_client, fake_redis):
+    async def scenario():
+        await entity_cache.bus.start("redis://test")
+        try:
+            async with async_client() as api:
+                await api.post("/api/auth/register", json={"email": "buyer@example.com", "password": "password123"})
+                response = await api.post("/api/auth/login", json={"email": "buyer@example.com", "password": "password123"})
+                headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+                user_id = (await api.get("/api/auth/me", headers=headers)).json()["id"]
+            key = f"profiles:{user_id}"
+            local = entity_cache.local.get(key)
+            remote = await entity_cache.bus.redis.get(key)
+            # Asking for the hash explicitly still gets it, from MongoDB
+            stored = await database.get_document("profiles", user_id, projection={"hashed_password": 1})
+            return local, remote, stored
+        finally:
+            await entity_cache.bus.stop()
+
+    local, remote, stored = asyncio.run(scenario())
+
+    assert "email" in local and "hashed_password" not in local
+    assert "buyer@example.com" in remote and "hashed_password" not in remote
+    assert stored["hashed_password"].startswith("$2")
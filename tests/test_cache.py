@@ -0,0 +1,146 @@
+import asyncio
+from datetime import datetime
+
+
+import cache
+import database
+from cache import CacheBus, EntityCache
+from tests.conftest import create_active_listing, register
+
+
+async def _two_workers(channels=("test:cache", "test:cache")):
+    """Entity caches of two workers sharing Redis"""
+    workers = []
+    for channel in channels:
+        bus = CacheBus(channel)
+        await bus.start("redis://test")
+        workers.append((bus, EntityCache(bus, {"deals"})))
+    # Let both subscriptions come up
+    await asyncio.sleep(0.05)
+    return workers
+
+
+DEAL = {
+    "_id": "64b000000000000000000001",
+    "id": "64b000000000000000000001",
+    "status": "in_progress",
+    "created_at": datetime(2026, 3, 1, 12, 30, 15, 123000),
+    "documents": [{"file_name": "loi.pdf"}],
+}
+
+
+def test_redis_tier_returns_the_document_as_mongodb_does(fake_redis):
+    async def scenario():
+        (bus_a, worker_a), (bus_b, worker_b) = await _two_workers()
+        await worker_a.set("deals", DEAL["id"], DEAL, await worker_a.fill_token("deals", DEAL["id"]))
+
+        # Worker B has nothing locally, so this comes from Redis
+        document = await worker_b.get("deals", DEAL["id"])
+
+        await bus_a.stop()
+        await bus_b.stop()
+        return document
+
+    document = asyncio.run(scenario())
+
+    assert document == DEAL
+    assert document["created_at"].tzinfo is None
+    assert document["created_at"] < datetime.utcnow()
+
+
+def test_cached_documents_are_isolated_from_callers():
+    async def scenario():
+        entity_cache = EntityCache(CacheBus(), {"deals"})
+        document = {**DEAL, "documents": [dict(item) for item in DEAL["documents"]]}
+        await entity_cache.set("deals", DEAL["id"], document, await entity_cache.fill_token("deals", DEAL["id"]))
+        document["documents"].append({"file_name": "changed after caching"})
+
+        first = await entity_cache.get("deals", DEAL["id"])
+        first["documents"].append({"file_name": "changed by a reader"})
+        return await entity_cache.get("deals", DEAL["id"])
+
+    assert asyncio.run(scenario())["documents"] == DEAL["documents"]
+
+
+def test_invalidation_reaches_other_workers(fake_redis):
+    async def scenario():
+        (bus_a, worker_a), (bus_b, worker_b) = await _two_workers()
+        await worker_a.set("deals", DEAL["id"], DEAL, await worker_a.fill_token("deals", DEAL["id"]))
+        assert await worker_b.get("deals", DEAL["id"]) is not None
+
+        await worker_a.invalidate("deals", [DEAL["id"]])
+        await asyncio.sleep(0.05)
+
+        local = worker_b.local.get(f"deals:{DEAL['id']}")
+        remote = await worker_b.get("deals", DEAL["id"])
+        await bus_a.stop()
+        await bus_b.stop()
+        return local, remote
+
+    local, remote = asyncio.run(scenario())
+
+    assert local is cache.MISSING
+    assert remote is None
+
+
+def test_listing_writes_invalidate_cached_reads(client):
+    seller = register(client, "seller@example.com", "SELLER")
+    listing = create_active_listing(client, seller, title="Corner Coffee")
+
+    # Fill the entity cache and the feed's query cache
+    assert client.get(f"/api/listings/{listing['id']}").json()["title"] == "Corner Coffee"
+    assert [item["id"] for item in client.get("/api/listings/").json()] == [listing["id"]]
+
+    response = client.put(f"/api/listings/{listing['id']}", headers=seller, json={"title": "Corner Cafe"})
+    assert response.status_code == 200, response.text
+    second = create_active_listing(client, seller, title="Bike Shop")
+
+    assert client.get(f"/api/listings/{listing['id']}").json()["title"] == "Corner Cafe"
+    feed = client.get("/api/listings/").json()
+    assert {item["id"]: item["title"] for item in feed} == {
+        listing["id"]: "Corner Cafe",
+        second["id"]: "Bike Shop",
+    }
+
+
+def test_browse_reads_from_secondaries_do_not_fill_the_cache(client, monkeypatch):
+    from pymongo.read_preferences import Primary, SecondaryPreferred
+
+    seller = register(client, "seller@example.com", "SELLER")
+    listing = create_active_listing(client, seller)
+    cache.entity_cache.reset()
+
+    monkeypatch.setattr(database, "browse_read_preference", SecondaryPreferred())
+    assert client.get(f"/api/listings/{listing['id']}").status_code == 200
+    assert cache.entity_cache.local.get(f"business_listings:{listing['id']}") is cache.MISSING
+
+    monkeypatch.setattr(database, "browse_read_preference", Primary())
+    assert client.get(f"/api/listings/{listing['id']}").status_code == 200
+    assert cache.entity_cache.local.get(f"business_listings:{listing['id']}") is not cache.MISSING
+
+
+def test_copy_read_before_another_workers_write_stays_out_of_redis(fake_redis):
+    async def scenario():
+        # Separate channels: worker B's invalidation message hasn't reached A yet
+        (bus_a, worker_a), (bus_b, worker_b) = await _two_workers(("test:a", "test:b"))
+
+        # A reads the deal from MongoDB...
+        token = await worker_a.fill_token("deals", DEAL["id"])
+        # ...B writes it and invalidates it...
+        await worker_b.invalidate("deals", [DEAL["id"]])
+        # ...and A caches the copy it read before the write
+        await worker_a.set("deals", DEAL["id"], DEAL, token)
+        stale = await worker_b.get("deals", DEAL["id"])
+
+        # A read that starts after the write is cached as usual
+        await worker_a.set("deals", DEAL["id"], DEAL, await worker_a.fill_token("deals", DEAL["id"]))
+        fresh = await worker_b.get("deals", DEAL["id"])
+
+        await bus_a.stop()
+        await bus_b.stop()
+        return stale, fresh
+
+    stale, fresh = asyncio.run(scenario())
+
+    assert stale is None
+    assert fresh == DEAL
@@ -0,0 +1,56 @@
+import pytest
+from pymongo.errors import PyMongoError
+
+from routers import deals as deals_router
+from tests.conftest import create_active_listing, register
+
+
+@pytest.fixture
+def deal_setup(client):
+    seller = register(client, "seller@example.com", "SELLER")
+    buyer = register(client, "buyer@example.com", "BUYER")
+    listing = create_active_listing(client, seller)
+    response = client.post("/api/offers/", headers=buyer, json={"business_id": listing["id"], "offer_amount": 90000})
+    assert response.status_code == 200, response.text
+    response = client.post(f"/api/offers/{response.json()['id']}/accept", headers=seller)
+    assert response.status_code == 200, response.text
+    return seller, buyer, listing, response.json()
+
+
+def test_complete_deal_closes_the_listing(client, deal_setup):
+    seller, buyer, listing, deal = deal_setup
+
+    response = client.post(f"/api/deals/{deal['id']}/complete", headers=seller)
+
+    assert response.status_code == 200, response.text
+    completed = response.json()
+    assert completed["status"] == "completed"
+    assert completed["business"]["status"] == "closed"
+    assert [event["event_type"] for event in completed["timeline_events"]] == ["offer_accepted", "deal_completed"]
+
+
+@pytest.fixture(params=["collection", "buckets"])
+def timeline_storage(request, monkeypatch):
+    monkeypatch.setenv("TIMELINE_STORAGE", request.param)
+
+
+def test_failed_completion_is_undone(client, timeline_storage, deal_setup, monkeypatch):
+    seller, buyer, listing, deal = deal_setup
+
+    list_timeline_events = deals_router.list_timeline_events
+
+    async def failing_list_timeline_events(deal_id):
+        raise PyMongoError("read failed")
+
+    monkeypatch.setattr(deals_router, "list_timeline_events", failing_list_timeline_events)
+
+    with pytest.raises(PyMongoError):
+        client.post(f"/api/deals/{deal['id']}/complete", headers=seller)
+
+    monkeypatch.setattr(deals_router, "list_timeline_events", list_timeline_events)
+    restored = client.get(f"/api/deals/{deal['id']}", headers=seller).json()
+    assert restored["status"] == "in_progress"
+    assert restored["business"]["status"] == "under_loi"
+    assert [event["event_type"] for event in restored["timeline_events"]] == ["offer_accepted"]
+    # It can be completed once the failure has passed
+    assert client.post(f"/api/deals/{deal['id']}/complete", headers=seller).status_code == 200
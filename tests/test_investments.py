@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+from routers import investments as investments_router
+from tests.conftest import create_active_listing, register
+
+
+@pytest.fixture
+def investment_setup(client):
+    seller = register(client, "seller@example.com", "SELLER")
+    investor = register(client, "investor@example.com", "INVESTOR")
+    listing = create_active_listing(client, seller)
+    return seller, investor, listing
+
+
+def _invest(client, headers, listing, amount):
+    return client.post("/api/investments/", headers=headers, json={"business_id": listing["id"], "amount": amount})
+
+
+def test_investment_amount_must_be_positive(client, investment_setup):
+    seller, investor, listing = investment_setup
+
+    assert _invest(client, investor, listing, -1000).status_code == 422
+    assert _invest(client, investor, listing, 0).status_code == 422
+    assert client.get(f"/api/listings/{listing['id']}").json()["funding_raised"] == 0
+
+
+def test_investments_past_the_target_are_accepted_without_the_cap(client, investment_setup):
+    seller, investor, listing = investment_setup
+
+    assert _invest(client, investor, listing, 40000).status_code == 200
+    assert _invest(client, investor, listing, 40000).status_code == 200
+
+    totals = client.get(f"/api/listings/{listing['id']}").json()
+    assert (totals["funding_raised"], totals["investor_count"]) == (80000, 2)
+
+
+def test_concurrent_investments_cannot_overshoot_a_capped_target(client, async_client, investment_setup, monkeypatch):
+    seller, investor, listing = investment_setup
+    monkeypatch.setenv("INVESTMENT_CAP_AT_TARGET", "true")
+
+    async def invest_concurrently():
+        async with async_client() as api:
+            return await asyncio.gather(*(
+                api.post("/api/investments/", headers=investor, json={"business_id": listing["id"], "amount": 30000})
+                for _ in range(3)
+            ))
+
+    responses = asyncio.run(invest_concurrently())
+
+    assert sorted(response.status_code for response in responses) == [200, 400, 400]
+    rejected = next(response for response in responses if response.status_code == 400)
+    assert rejected.json()["detail"] == "Investment exceeds the remaining funding target (20000)"
+    totals = client.get(f"/api/listings/{listing['id']}").json()
+    assert (totals["funding_raised"], totals["investor_count"]) == (30000, 1)
+    assert len(client.get("/api/investments/", headers=investor).json()) == 1
+
+
+def test_investing_in_a_listing_taken_off_the_market_is_refused(client, investment_setup):
+    seller, investor, listing = investment_setup
+    response = client.put(f"/api/listings/{listing['id']}", headers=seller, json={"status": "closed"})
+    assert response.status_code == 200, response.text
+
+    response = _invest(client, investor, listing, 1000)
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Cannot invest in a non-active business"
+
+
+def test_lost_race_without_the_cap_is_not_reported_as_over_target(client, investment_setup, monkeypatch):
+    seller, investor, listing = investment_setup
+
+    async def listing_changed_meanwhile(collection, filter_query, update, **kwargs):
+        return None
+
+    monkeypatch.setattr(investments_router, "find_and_update_document", listing_changed_meanwhile)
+
+    response = _invest(client, investor, listing, 1000)
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Cannot invest in a non-active business"
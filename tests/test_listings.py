@@ -0,0 +1,89 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+from routers import listings as listings_router
+from tests.conftest import create_active_listing, register
+
+
+def _clock(monkeypatch, start):
+    """Make the listings router's utcnow return start plus the advanced time"""
+    offset = [timedelta()]
+
+    class FakeDatetime(datetime):
+        @classmethod
+        def utcnow(cls):
+            return start + offset[0]
+
+    monkeypatch.setattr(listings_router, "datetime", FakeDatetime)
+    return lambda **delta: offset.__setitem__(0, offset[0] + timedelta(**delta))
+
+
+def _set_funding_end_date(db, listing, end_date):
+    asyncio.run(db.business_listings.update_one({"_id": ObjectId(listing["id"])}, {"$set": {"funding_end_date": end_date}}))
+
+
+def test_closing_soon_drops_rounds_that_ended_since_it_was_cached(client, db, monkeypatch):
+    seller = register(client, "seller@example.com", "SELLER")
+    start = datetime.utcnow()
+    ending = create_active_listing(client, seller)
+    later = create_active_listing(client, seller, title="Bike Shop")
+    _set_funding_end_date(db, ending, start + timedelta(seconds=90))
+    _set_funding_end_date(db, later, start + timedelta(days=7))
+    advance = _clock(monkeypatch, start)
+
+    ids = [listing["id"] for listing in client.get("/api/listings/closing-soon").json()]
+    assert ids == [ending["id"], later["id"]]
+
+    # No listing writes in between, so only the clock can move the result
+    advance(minutes=3)
+    ids = [listing["id"] for listing in client.get("/api/listings/closing-soon").json()]
+    assert ids == [later["id"]]
+
+
+def test_failed_delete_leaves_the_search_index_alone(client, monkeypatch):
+    seller = register(client, "seller@example.com", "SELLER")
+    listing = create_active_listing(client, seller)
+    changed = []
+
+    async def failing_delete_document(collection, document_id):
+        return False
+
+    async def recording_listing_changed(listing_id, document):
+        changed.append(listing_id)
+
+    monkeypatch.setattr(listings_router, "delete_document", failing_delete_document)
+    monkeypatch.setattr(listings_router, "listing_changed", recording_listing_changed)
+
+    response = client.delete(f"/api/listings/{listing['id']}", headers=seller)
+
+    assert response.status_code == 500
+    assert changed == []
+
+
+def test_target_change_keeps_progress_in_step_with_a_concurrent_investment(client, db, monkeypatch):
+    seller = register(client, "seller@example.com", "SELLER")
+    listing = create_active_listing(client, seller)
+    get_document = listings_router.get_document
+
+    async def read_then_invest(*args, **kwargs):
+        document = await get_document(*args, **kwargs)
+        # An investment lands between the update's read and its write
+        await db.business_listings.update_one(
+            {"_id": ObjectId(listing["id"])}, {"$inc": {"funding_raised": 10000, "investor_count": 1}}
+        )
+        return document
+
+    monkeypatch.setattr(listings_router, "get_document", read_then_invest)
+
+    response = client.put(
+        f"/api/listings/{listing['id']}",
+        headers=seller,
+        json={"funding_target": 20000, "description": "$5k monthly profit"},
+    )
+
+    assert response.status_code == 200, response.text
+    updated = response.json()
+    assert (updated["funding_raised"], updated["funding_progress"]) == (10000, 0.5)
+    assert updated["description"] == "$5k monthly profit"
@@ -0,0 +1,116 @@
+import asyncio
+
+import pytest
+from pymongo.errors import PyMongoError
+
+from routers import offers as offers_router
+from tests.conftest import create_active_listing, register
+
+
+@pytest.fixture
+def offer_setup(client):
+    seller = register(client, "seller@example.com", "SELLER")
+    buyer = register(client, "buyer@example.com", "BUYER")
+    listing = create_active_listing(client, seller)
+    offer_ids = []
+    for amount in (90000, 80000):
+        response = client.post(
+            "/api/offers/", headers=buyer, json={"business_id": listing["id"], "offer_amount": amount}
+        )
+        assert response.status_code == 200, response.text
+        offer_ids.append(response.json()["id"])
+    return seller, buyer, listing, offer_ids
+
+
+def test_accept_creates_deal_and_rejects_other_offers(client, offer_setup):
+    seller, buyer, listing, (first, second) = offer_setup
+
+    response = client.post(f"/api/offers/{first}/accept", headers=seller)
+
+    assert response.status_code == 200, response.text
+    deal = response.json()
+    assert deal["business"]["status"] == "under_loi"
+    assert [event["event_type"] for event in deal["timeline_events"]] == ["offer_accepted"]
+    assert client.get(f"/api/offers/{second}", headers=buyer).json()["status"] == "rejected"
+    assert client.post(f"/api/offers/{first}/accept", headers=seller).status_code == 400
+
+
+def test_concurrent_accepts_on_one_listing_create_one_deal(client, async_client, db, offer_setup):
+    seller, buyer, listing, offer_ids = offer_setup
+
+    async def accept_both():
+        async with async_client() as api:
+            return await asyncio.gather(*(
+                api.post(f"/api/offers/{offer_id}/accept", headers=seller) for offer_id in offer_ids
+            ))
+
+    responses = asyncio.run(accept_both())
+
+    assert sorted(response.status_code for response in responses) == [200, 400]
+    winner = next(response.json() for response in responses if response.status_code == 200)
+    deals = asyncio.run(db.deals.find({}).to_list(None))
+    assert [deal["offer_id"] for deal in deals] == [winner["offer_id"]]
+    statuses = {
+        offer_id: client.get(f"/api/offers/{offer_id}", headers=buyer).json()["status"]
+        for offer_id in offer_ids
+    }
+    assert sorted(statuses.values()) == ["accepted", "rejected"]
+    assert statuses[winner["offer_id"]] == "accepted"
+
+
+def test_accept_hands_back_offer_and_listing_when_deal_insert_fails(client, db, offer_setup, monkeypatch):
+    seller, buyer, listing, (first, second) = offer_setup
+
+    async def failing_create_document(collection, document):
+        raise PyMongoError("insert failed")
+
+    monkeypatch.setattr(offers_router, "create_document", failing_create_document)
+
+    with pytest.raises(PyMongoError):
+        client.post(f"/api/offers/{first}/accept", headers=seller)
+
+    _assert_acceptance_undone(client, db, buyer, listing, (first, second))
+
+
+@pytest.mark.parametrize("storage", ["collection", "buckets"])
+def test_accept_undoes_the_deal_and_rejections_when_the_event_insert_fails(
+    client, db, offer_setup, monkeypatch, storage
+):
+    monkeypatch.setenv("TIMELINE_STORAGE", storage)
+    seller, buyer, listing, (first, second) = offer_setup
+
+    async def failing_append_timeline_event(event):
+        raise PyMongoError("insert failed")
+
+    monkeypatch.setattr(offers_router, "append_timeline_event", failing_append_timeline_event)
+
+    with pytest.raises(PyMongoError):
+        client.post(f"/api/offers/{first}/accept", headers=seller)
+
+    _assert_acceptance_undone(client, db, buyer, listing, (first, second))
+
+
+@pytest.mark.parametrize("storage", ["collection", "buckets"])
+def test_accept_leaves_no_event_behind_when_the_deal_insert_fails(client, db, offer_setup, monkeypatch, storage):
+    monkeypatch.setenv("TIMELINE_STORAGE", storage)
+    seller, buyer, listing, (first, second) = offer_setup
+
+    async def failing_create_document(collection, document):
+        raise PyMongoError("insert failed")
+
+    monkeypatch.setattr(offers_router, "create_document", failing_create_document)
+
+    with pytest.raises(PyMongoError):
+        client.post(f"/api/offers/{first}/accept", headers=seller)
+
+    assert asyncio.run(db.timeline_events.count_documents({})) == 0
+    buckets = asyncio.run(db.timeline_buckets.find({}).to_list(None))
+    assert [event for bucket in buckets for event in bucket["events"]] == []
+
+
+def _assert_acceptance_undone(client, db, buyer, listing, offer_ids):
+    for offer_id in offer_ids:
+        assert client.get(f"/api/offers/{offer_id}", headers=buyer).json()["status"] == "pending"
+    restored = client.get(f"/api/listings/{listing['id']}").json()
+    assert restored["status"] == "active" and restored["under_loi"] is False
+    assert asyncio.run(db.deals.count_documents({})) == 0
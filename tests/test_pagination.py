@@ -0,0 +1,55 @@
+from tests.conftest import create_active_listing, register
+
+
+def _walk(client, url, limit, between_pages=None):
+    """Follow X-Next-Cursor from the first page to the last; returns the pages' ids"""
+    pages, cursor = [], None
+    while True:
+        params = {"limit": limit, **({"cursor": cursor} if cursor else {})}
+        response = client.get(url, params=params)
+        assert response.status_code == 200, response.text
+        pages.append([item["id"] for item in response.json()])
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            return pages
+        if between_pages:
+            between_pages()
+
+
+def test_cursor_pages_cover_the_feed_once(client):
+    seller = register(client, "seller@example.com", "SELLER")
+    created = [create_active_listing(client, seller, title=f"Shop {number}")["id"] for number in range(5)]
+
+    pages = _walk(client, "/api/listings/", limit=2)
+
+    assert [len(page) for page in pages] == [2, 2, 1]
+    # Newest first
+    assert [listing_id for page in pages for listing_id in page] == created[::-1]
+
+
+def test_new_listings_do_not_shift_later_pages(client):
+    seller = register(client, "seller@example.com", "SELLER")
+    created = [create_active_listing(client, seller, title=f"Shop {number}")["id"] for number in range(5)]
+    added = []
+
+    pages = _walk(
+        client,
+        "/api/listings/",
+        limit=2,
+        between_pages=lambda: added.append(create_active_listing(client, seller, title="New shop")["id"])
+    )
+
+    # With skip/limit each insert would push an already-seen listing onto the next page
+    assert [listing_id for page in pages for listing_id in page] == created[::-1]
+    assert len(added) == 2
+
+
+def test_seller_listings_are_paged_by_cursor(client):
+    seller = register(client, "seller@example.com", "SELLER")
+    created = {create_active_listing(client, seller, title=f"Shop {number}")["id"] for number in range(3)}
+    seller_id = client.get("/api/auth/me", headers=seller).json()["id"]
+
+    pages = _walk(client, f"/api/listings/seller/{seller_id}", limit=2)
+
+    assert [len(page) for page in pages] == [2, 1]
+    assert {listing_id for page in pages for listing_id in page} == created
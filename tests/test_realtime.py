@@ -0,0 +1,81 @@
+import asyncio
+import json
+
+import pytest
+from bson import ObjectId
+
+import realtime
+
+
+def _data(message):
+    """The JSON payload of one SSE message"""
+    return json.loads(message.split("data: ", 1)[1])
+
+
+@pytest.fixture
+def funding_listing(db, monkeypatch):
+    monkeypatch.setenv("FUNDING_TICKER_INTERVAL_SECONDS", "0.05")
+    listing_id = ObjectId()
+    asyncio.run(db.business_listings.insert_one({
+        "_id": listing_id,
+        "funding_raised": 1000.0,
+        "funding_target": 50000.0,
+        "funding_progress": 0.02,
+        "investor_count": 1,
+    }))
+    return str(listing_id)
+
+
+def _totals(listing_id, investor_count):
+    return {
+        "id": listing_id,
+        "funding_raised": 1000.0 * investor_count,
+        "funding_target": 50000.0,
+        "funding_progress": 0.02 * investor_count,
+        "investor_count": investor_count,
+    }
+
+
+def test_funding_stream_delivers_investment_landing_during_its_first_read(funding_listing, monkeypatch):
+    get_document = realtime.get_document
+
+    async def read_then_invest(*args, **kwargs):
+        listing = await get_document(*args, **kwargs)
+        # An investment commits and is published right after the read
+        realtime.publish_funding_update(_totals(funding_listing, 2))
+        return listing
+
+    monkeypatch.setattr(realtime, "get_document", read_then_invest)
+
+    async def scenario():
+        stream = realtime.funding_stream(funding_listing)
+        messages = [await stream.__anext__(), await asyncio.wait_for(stream.__anext__(), 1)]
+        await stream.aclose()
+        return messages
+
+    first, second = asyncio.run(scenario())
+
+    assert _data(first)["investor_count"] == 1
+    assert _data(second)["investor_count"] == 2
+
+
+def test_funding_updates_are_coalesced_per_interval(funding_listing):
+    async def scenario():
+        stream = realtime.funding_stream(funding_listing)
+        await stream.__anext__()
+        # The first change goes out at once, the rest of the burst at the
+        # end of the interval as one update carrying the newest totals
+        for investor_count in (2, 3, 5, 4):
+            realtime.publish_funding_update(_totals(funding_listing, investor_count))
+        messages = [
+            await asyncio.wait_for(stream.__anext__(), 1),
+            await asyncio.wait_for(stream.__anext__(), 1),
+        ]
+        await stream.aclose()
+        return messages
+
+    first, second = asyncio.run(scenario())
+
+    assert _data(first)["investor_count"] == 2
+    assert _data(second)["investor_count"] == 5
+    assert realtime.funding_ticker_hub.subscriber_count() == 0
@@ -0,0 +1,66 @@
+import asyncio
+
+from bson import ObjectId
+
+import search
+from cache import MISSING, cache_bus, query_cache
+from search import ListingSearchEngine
+
+
+def _engine(count):
+    engine = ListingSearchEngine()
+    engine.build(
+        (f"listing-{number}", {"title": "Coffee shop", "description": "coffee " * (number % 5 + 1)})
+        for number in range(count)
+    )
+    return engine
+
+
+def test_search_returns_up_to_the_configured_number_of_matches(monkeypatch):
+    engine = _engine(30)
+
+    assert len(engine.search("coffee")) == 30
+    monkeypatch.setenv("LISTING_SEARCH_MAX_RESULTS", "10")
+    results = engine.search("coffee")
+    assert len(results) == 10
+    assert results == engine.search("coffee", limit=30)[:10]
+
+
+def _bm25_index(monkeypatch, documents=()):
+    monkeypatch.setenv("LISTING_SEARCH_MODE", search.SEARCH_MODE_BM25)
+    engine = ListingSearchEngine()
+    engine.build(documents)
+    monkeypatch.setattr(search, "listing_search", engine)
+    return engine
+
+
+def test_search_cached_before_reindexing_is_not_served(db, monkeypatch):
+    _bm25_index(monkeypatch, [("listing-1", {"title": "Coffee shop"})])
+
+    async def scenario():
+        # A search lands after the write bumped the generation but before
+        # the listing was re-indexed
+        stale_key = query_cache.key("business_listings", "coffee")
+        query_cache.set(stale_key, ["listing-1"])
+        await search.listing_changed("listing-1", {"title": "Bakery"})
+        return query_cache.get(query_cache.key("business_listings", "coffee"))
+
+    assert asyncio.run(scenario()) is MISSING
+
+
+def test_index_is_rebuilt_when_the_bus_subscription_drops(db, monkeypatch):
+    engine = _bm25_index(monkeypatch)
+    # Created by another worker while this one missed the announcement
+    listing_id = ObjectId()
+    asyncio.run(db.business_listings.insert_one({"_id": listing_id, "title": "Coffee shop"}))
+    monkeypatch.setattr(cache_bus, "redis", object())
+
+    async def scenario():
+        for reset in cache_bus._resets:
+            reset()
+        for _ in range(20):
+            await asyncio.sleep(0)
+        return search.listing_search.search("coffee")
+
+    assert asyncio.run(scenario()) == [str(listing_id)]
+    assert search.listing_search is engine
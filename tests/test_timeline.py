@@ -0,0 +1,110 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+from pymongo.errors import PyMongoError
+
+import database
+import migrations
+
+START = datetime(2026, 3, 1, 12, 0)
+
+
+@pytest.fixture
+def buckets(monkeypatch):
+    monkeypatch.setenv("TIMELINE_STORAGE", "buckets")
+    monkeypatch.setenv("TIMELINE_BUCKET_SIZE", "2")
+
+
+def _event(deal_id, minute):
+    return {
+        "_id": ObjectId(),
+        "deal_id": deal_id,
+        "event_type": "note",
+        "description": f"minute {minute}",
+        "timestamp": START + timedelta(minutes=minute),
+    }
+
+
+def test_events_of_concurrently_opened_buckets_are_merged_in_order(db, buckets):
+    deal_id = ObjectId()
+    # Two appends that both found every bucket full each opened one
+    asyncio.run(db.timeline_buckets.insert_many([
+        {"deal_id": deal_id, "count": 2, "events": [_event(deal_id, 1), _event(deal_id, 3)]},
+        {"deal_id": deal_id, "count": 2, "events": [_event(deal_id, 2), _event(deal_id, 4)]},
+    ]))
+    asyncio.run(db.deals.insert_one({"_id": deal_id}))
+
+    events = asyncio.run(database.list_timeline_events(str(deal_id)))
+    deals, _ = asyncio.run(database.get_hydrated_deals({"_id": str(deal_id)}))
+
+    expected = ["minute 1", "minute 2", "minute 3", "minute 4"]
+    assert [event["description"] for event in events] == expected
+    assert [event["description"] for event in deals[0]["timeline_events"]] == expected
+
+
+def test_concurrent_appends_keep_every_event(db, buckets):
+    deal_id = ObjectId()
+
+    async def append_concurrently():
+        await asyncio.gather(*(
+            database.append_timeline_event(_event(deal_id, minute)) for minute in range(7)
+        ))
+        return await database.list_timeline_events(str(deal_id))
+
+    events = asyncio.run(append_concurrently())
+
+    assert [event["description"] for event in events] == [f"minute {minute}" for minute in range(7)]
+    bucket_counts = asyncio.run(db.timeline_buckets.distinct("count", {"deal_id": deal_id}))
+    assert max(bucket_counts) <= 2
+
+
+def _bucketed_events(db, deal_id):
+    """Descriptions of a deal's bucketed events, in bucket order"""
+    buckets = asyncio.run(db.timeline_buckets.find({"deal_id": deal_id}).sort("_id", 1).to_list(None))
+    return [[event["description"] for event in bucket["events"]] for bucket in buckets]
+
+
+def test_migration_rebuilds_each_deals_buckets(raw_db, buckets):
+    deal_id = ObjectId()
+    events = [_event(deal_id, minute) for minute in (2, 0, 1)]
+    asyncio.run(raw_db.timeline_events.insert_many(events))
+    # Left by an earlier run with a larger bucket size
+    asyncio.run(raw_db.timeline_buckets.insert_one({"deal_id": deal_id, "count": 3, "events": events}))
+
+    asyncio.run(migrations.bucket_timeline_events(raw_db))
+
+    assert _bucketed_events(raw_db, deal_id) == [["minute 0", "minute 1"], ["minute 2"]]
+
+
+def test_failed_migration_keeps_the_existing_buckets(raw_db, buckets, monkeypatch):
+    deal_id = ObjectId()
+    event = _event(deal_id, 0)
+    asyncio.run(raw_db.timeline_events.insert_one(event))
+    asyncio.run(raw_db.timeline_buckets.insert_one({"deal_id": deal_id, "count": 1, "events": [event]}))
+
+    async def failing_insert_many(self, documents, **kwargs):
+        raise PyMongoError("insert failed")
+
+    monkeypatch.setattr(type(raw_db.timeline_buckets), "insert_many", failing_insert_many)
+
+    with pytest.raises(PyMongoError):
+        asyncio.run(migrations.bucket_timeline_events(raw_db))
+
+    assert _bucketed_events(raw_db, deal_id) == [["minute 0"]]
+
+
+def test_migration_leaves_deals_with_newer_bucketed_events_alone(raw_db, buckets):
+    deal_id, other_deal_id = ObjectId(), ObjectId()
+    migrated = _event(deal_id, 0)
+    asyncio.run(raw_db.timeline_events.insert_many([migrated, _event(other_deal_id, 0)]))
+    # After the switch to buckets a new event was only stored in a bucket
+    asyncio.run(raw_db.timeline_buckets.insert_one(
+        {"deal_id": deal_id, "count": 2, "events": [migrated, _event(deal_id, 1)]}
+    ))
+
+    asyncio.run(migrations.bucket_timeline_events(raw_db))
+
+    assert _bucketed_events(raw_db, deal_id) == [["minute 0", "minute 1"]]
+    assert _bucketed_events(raw_db, other_deal_id) == [["minute 0"]]